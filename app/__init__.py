@@ -1,35 +1,341 @@
+import time
+IMPORT_STARTED_AT = time.perf_counter()
 from flask import Flask
 from flask_cors import CORS
-from .model.download_model import download_model_file
+from .model.download_model import load_model_path
+from .model.model_store import ModelStore, AzureBlobBackend, LocalDirBackend, model_version
+from .model.candidate_pool import CandidatePool
+from .model.cascade import Cascade, DEFAULT_STAGES
+from .model.budget import BatchSizeController
+from .model.vivygan import generate_noise, variation_noise, binarize_generated, binarize_variations
+from .model.batching import PredictBatcher
+from .model.inference import CompiledModel
+from .jobs import JobQueue
+from .storage import ArtifactStore
+from .cache import ResultCache
+from .audio import AudioRenderer
+from .startup import Startup
+from .log import configure_logging
+import logging
+import numpy as np
+import os
+import threading
 
-def create_app():
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED_AT
+logger = logging.getLogger(__name__)
+
+def create_app(test_config=None):
+    # test_config overrides the defaults and instance/config.py, e.g. the benchmarks' stub models
+    started_at = time.perf_counter()
     app = Flask(__name__, static_folder='static', instance_relative_config=True)
     CORS(app, resources={r"/*": {"origins": "*"}})
+    app.config.from_mapping(
+        # 'background' loads the models after create_app returns, 'lazy' waits for the first request that needs
+        # them and 'eager' loads them inside create_app. until then those requests get a 503, after waiting up
+        # to STARTUP_WAIT_TIMEOUT seconds. 'preload' is for a gunicorn master with preload_app (gunicorn.conf.py):
+        # create_app fetches the model files and imports the heavy modules, each worker loads the models after fork
+        STARTUP_MODE=os.environ.get('STARTUP_MODE', 'background'),
+        STARTUP_WAIT_TIMEOUT=0,
+        # TF intra-op threads per process, None splits the cores evenly between WEB_WORKERS gunicorn workers
+        WEB_WORKERS=int(os.environ.get('WEB_CONCURRENCY', 1)),
+        TF_INTRA_OP_THREADS=None,
+        TF_INTER_OP_THREADS=None,
+        # model files are cached per blob and ETag, MODEL_OFFLINE only loads from the cache and
+        # MODEL_LOCAL_DIR reads the blobs from a directory instead of Azure
+        MODEL_CACHE_DIR='model_cache',
+        MODEL_OFFLINE=os.environ.get('MODEL_OFFLINE', '') == '1',
+        MODEL_LOCAL_DIR=os.environ.get('MODEL_LOCAL_DIR'),
+        MODEL_CACHE_VERIFY=True,
+        # callable taking 'MODEL_BLOB_NAME' or 'MODEL_BLOB_NAME_2' and returning a model to use instead of the
+        # stored file, see benchmarks/stub_models.py
+        MODEL_FACTORY=None,
+        # candidates generated per request, the cascade drops the ones failing cheap (stage, min, max) checks
+        # before the full metrics are computed
+        CANDIDATE_BATCH_SIZE=500,
+        CASCADE_ENABLED=True,
+        CASCADE_STAGES=DEFAULT_STAGES,
+        # with a budget (config or ?budget_ms=) candidates are generated in chunks until it runs out, chunks are sized
+        # from the measured cost per candidate. None generates CANDIDATE_BATCH_SIZE at once
+        GENERATE_LATENCY_BUDGET_MS=None,
+        GENERATE_MAX_LATENCY_BUDGET_MS=30000,
+        GENERATE_MIN_CHUNK_SIZE=100,
+        GENERATE_MAX_CHUNK_SIZE=2000,
+        # most strategies and scales one /api/generate_batch request can ask for
+        GENERATE_BATCH_MAX_SELECTIONS=16,
+        # background pool of scored candidates for the /api/generate* routes
+        CANDIDATE_POOL_ENABLED=True,
+        CANDIDATE_POOL_LOW_WATERMARK=1000,
+        CANDIDATE_POOL_HIGH_WATERMARK=2000,
+        CANDIDATE_POOL_REFILL_BATCH_SIZE=500,
+        CANDIDATE_POOL_MAX_BYTES=64 * 1024 * 1024,
+        # /api/jobs worker threads, queued jobs past JOB_QUEUE_SIZE get a 429
+        JOB_WORKERS=2,
+        JOB_QUEUE_SIZE=16,
+        JOB_RESULT_TTL=600,
+        # predict runs a function traced per bucket size instead of keras' predict, INFERENCE_PRECISION='int8' swaps
+        # in a quantized TFLite model unless it changes more than INFERENCE_MAX_MISMATCH of the binarized cells
+        INFERENCE_COMPILED=True,
+        INFERENCE_BUCKETS=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+        INFERENCE_PRECISION='float32',
+        INFERENCE_MAX_MISMATCH=0.001,
+        # startup only traces the buckets of CANDIDATE_BATCH_SIZE (and the pool refill) and of
+        # INFERENCE_WARMUP_VARIATION_BATCH_SIZE, 'background' traces the others in a thread once the app is ready and
+        # 'lazy' leaves them to their first predict call
+        INFERENCE_WARMUP='background',
+        INFERENCE_WARMUP_VARIATION_BATCH_SIZE=10,
+        # concurrent predict calls on the same model within the window share one inference
+        PREDICT_BATCHING_ENABLED=True,
+        PREDICT_BATCH_WINDOW_MS=5,
+        PREDICT_MAX_BATCH_SIZE=2048,
+        # per-request outputs under static/results, evicted by age (seconds) and total size (bytes)
+        ARTIFACT_MAX_AGE=3600,
+        ARTIFACT_MAX_BYTES=512 * 1024 * 1024,
+        # /api/generate_variations uploads are read in memory up to VARIATION_UPLOAD_MAX_BYTES (larger ones get a
+        # 413) and parsed straight into the model input, images and npz pianorolls that would decode to more than
+        # VARIATION_INPUT_MAX_DECODED_BYTES are turned away. parsed inputs are kept by the hash of the file up to
+        # VARIATION_INPUT_CACHE_MAX_BYTES, so sending the same file again skips parsing
+        VARIATION_UPLOAD_MAX_BYTES=2 * 1024 * 1024,
+        VARIATION_INPUT_MAX_DECODED_BYTES=64 * 1024 * 1024,
+        VARIATION_INPUT_CACHE_MAX_BYTES=16 * 1024 * 1024,
+        # variations per request, they all go through one predict call
+        VARIATION_MAX_BATCH_SIZE=100,
+        # 'fast' draws the pianoroll straight into a PIL image, 'pretty' uses muspy.show_pianoroll
+        PIANOROLL_IMAGE_MODE='fast',
+        PIANOROLL_TIME_SCALE=2,
+        PIANOROLL_PITCH_SCALE=6,
+        PIANOROLL_COLORMAP='blues',
+        # parallel muspy.write_audio renders, AUDIO_RENDER_TIMEOUT is the per-request deadline in seconds
+        AUDIO_RENDER_WORKERS=os.cpu_count() or 2,
+        AUDIO_RENDER_EXECUTOR='thread',
+        AUDIO_RENDER_TIMEOUT=60,
+        # default audio format when a request doesn't pick one: wav, flac or ogg
+        AUDIO_FORMAT='wav',
+        # requests with a seed are deterministic, their results and rendered files are cached in memory up to
+        # RESULT_CACHE_MAX_BYTES and spill to RESULT_CACHE_DIR, so repeating one skips inference and rendering
+        RESULT_CACHE_ENABLED=True,
+        RESULT_CACHE_MAX_BYTES=64 * 1024 * 1024,
+        RESULT_CACHE_DIR='result_cache',
+        RESULT_CACHE_DISK_MAX_BYTES=512 * 1024 * 1024,
+        # logs are one JSON object per line unless LOG_FORMAT is 'text'. SERVER_TIMING adds a Server-Timing header
+        # with the per-stage durations to every /api response, the same timings are always at /api/metrics
+        LOG_LEVEL=os.environ.get('LOG_LEVEL', 'INFO'),
+        LOG_FORMAT=os.environ.get('LOG_FORMAT', 'json'),
+        SERVER_TIMING=True,
+    )
     app.config.from_pyfile('config.py', silent=True)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    configure_logging(app.config['LOG_LEVEL'], app.config['LOG_FORMAT'])
 
     # real heroku blob connection
     # connection_string = os.environ.get('AZURE_STORAGE_CONNECTION_STRING')
     # container_name = os.environ.get('MODEL_CONTAINER_NAME')
     # blob_name = os.environ.get('MODEL_BLOB_NAME')
-    # model = download_model_file(connection_string, container_name, blob_name)
 
     # Temp testing blob connection
-    model = download_model_file(
-        app.config['AZURE_STORAGE_CONNECTION_STRING'],
-        app.config['MODEL_CONTAINER_NAME'],
-        app.config['MODEL_BLOB_NAME']
+    if app.config['MODEL_LOCAL_DIR']:
+        backend = LocalDirBackend(app.config['MODEL_LOCAL_DIR'])
+    elif app.config['MODEL_OFFLINE'] or app.config['MODEL_FACTORY'] is not None:
+        backend = None
+    else:
+        backend = AzureBlobBackend(app.config['AZURE_STORAGE_CONNECTION_STRING'], app.config['MODEL_CONTAINER_NAME'])
+    model_store = ModelStore(
+        backend,
+        app.config['MODEL_CACHE_DIR'],
+        offline=app.config['MODEL_OFFLINE'],
+        verify=app.config['MODEL_CACHE_VERIFY']
     )
 
-    variation_model = download_model_file(
-        app.config['AZURE_STORAGE_CONNECTION_STRING'],
-        app.config['MODEL_CONTAINER_NAME'],
-        app.config['MODEL_BLOB_NAME_2']
+    app.config['model'] = None
+    app.config['variation_model'] = None
+    app.config['candidate_pool'] = None
+    app.config['model_versions'] = {}
+    app.config['cascade'] = Cascade(app.config['CASCADE_STAGES']) if app.config['CASCADE_ENABLED'] else None
+    app.config['batch_controller'] = BatchSizeController(
+        min_batch_size=app.config['GENERATE_MIN_CHUNK_SIZE'],
+        max_batch_size=app.config['GENERATE_MAX_CHUNK_SIZE']
     )
+    model_paths = {}
+    startup = Startup()
+    startup.add('imports', import_heavy_modules, before_fork=True)
+    startup.add('soundfont', download_soundfont, before_fork=True)
+    startup.add('fetch_models', lambda: fetch_models(app, model_store, model_paths), before_fork=True)
+    # nothing below may run in a preloading master, tensorflow's thread pools and the background threads
+    # would not survive the fork
+    startup.add('tensorflow', lambda: configure_tensorflow(app))
+    startup.add('models', lambda: load_models(app, model_paths))
+    startup.add('candidate_pool', lambda: start_candidate_pool(app))
+    startup.add('job_queue', lambda: app.config['job_queue'].start())
+    startup.add('warmup', lambda: start_warmup(app))
+    app.config['startup'] = startup
 
-    app.config['model'] = model
-    app.config['variation_model'] = variation_model
+    app.config['artifact_store'] = ArtifactStore(
+        os.path.join(app.root_path, 'static', 'results'),
+        url_prefix='static/results',
+        max_age=app.config['ARTIFACT_MAX_AGE'],
+        max_bytes=app.config['ARTIFACT_MAX_BYTES']
+    )
+    app.config['input_cache'] = ResultCache(max_bytes=app.config['VARIATION_INPUT_CACHE_MAX_BYTES'])
+
+    app.config['result_cache'] = ResultCache(
+        max_bytes=app.config['RESULT_CACHE_MAX_BYTES'],
+        disk_dir=app.config['RESULT_CACHE_DIR'],
+        disk_max_bytes=app.config['RESULT_CACHE_DISK_MAX_BYTES']
+    ) if app.config['RESULT_CACHE_ENABLED'] else None
+
+    app.config['job_queue'] = JobQueue(
+        workers=app.config['JOB_WORKERS'],
+        max_queued=app.config['JOB_QUEUE_SIZE'],
+        result_ttl=app.config['JOB_RESULT_TTL']
+    )
 
     from . import routes
     app.register_blueprint(routes.bp)
 
+    app.config['audio_renderer'] = AudioRenderer(
+        workers=app.config['AUDIO_RENDER_WORKERS'],
+        executor=app.config['AUDIO_RENDER_EXECUTOR']
+    )
+
+    startup.import_seconds = round(IMPORT_SECONDS, 3)
+    startup.create_app_seconds = round(time.perf_counter() - started_at, 3)
+    logger.info(f"App created in {startup.create_app_seconds:.2f}s after {startup.import_seconds:.2f}s of imports",
+                extra={'create_app_seconds': startup.create_app_seconds, 'import_seconds': startup.import_seconds})
+    if app.config['STARTUP_MODE'] == 'eager':
+        startup.start(background=False)
+    elif app.config['STARTUP_MODE'] == 'background':
+        startup.start()
+    elif app.config['STARTUP_MODE'] == 'preload':
+        startup.run_before_fork()
+    elif app.config['STARTUP_MODE'] != 'lazy':
+        raise ValueError("STARTUP_MODE must be 'background', 'lazy', 'eager' or 'preload'.")
+
     return app
+
+
+def import_heavy_modules():
+    # tensorflow/keras for the models and muspy for building music, timed on their own in /api/ready
+    import keras
+    import muspy
+
+
+def download_soundfont():
+    import muspy
+    muspy.download_musescore_soundfont()
+
+
+def fetch_models(app, model_store, model_paths):
+    if app.config['MODEL_FACTORY'] is not None:
+        return
+    for name in ('MODEL_BLOB_NAME', 'MODEL_BLOB_NAME_2'):
+        model_paths[name] = model_store.fetch(app.config[name])
+        # part of the result cache keys, so a new model version never serves results of the old one
+        app.config['model_versions'][name] = model_version(model_paths[name]) or model_paths[name]
+
+
+def configure_tensorflow(app):
+    # has to run before tensorflow's runtime starts, i.e. before the first model is loaded in this process
+    intra_op_threads = app.config['TF_INTRA_OP_THREADS']
+    inter_op_threads = app.config['TF_INTER_OP_THREADS']
+    if intra_op_threads is None and app.config['WEB_WORKERS'] > 1:
+        intra_op_threads = max(1, (os.cpu_count() or 1) // app.config['WEB_WORKERS'])
+        inter_op_threads = inter_op_threads or 1
+    if intra_op_threads is None and inter_op_threads is None:
+        return
+
+    import tensorflow as tf
+    if intra_op_threads is not None:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    if inter_op_threads is not None:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    logger.info(f"Tensorflow limited to {intra_op_threads} intra-op and {inter_op_threads} inter-op threads",
+                extra={'intra_op_threads': intra_op_threads, 'inter_op_threads': inter_op_threads})
+
+
+def load_models(app, model_paths):
+    factory = app.config['MODEL_FACTORY']
+    if factory is not None:
+        model = factory('MODEL_BLOB_NAME')
+        variation_model = factory('MODEL_BLOB_NAME_2')
+    else:
+        model = load_model_path(model_paths['MODEL_BLOB_NAME'])
+        variation_model = load_model_path(model_paths['MODEL_BLOB_NAME_2'])
+
+    if app.config['INFERENCE_COMPILED']:
+        sample_rolls = (np.random.random((32,) + tuple(variation_model.input_shape[1:])) < 0.05).astype(np.float32)
+        batch_sizes = [app.config['CANDIDATE_BATCH_SIZE']]
+        if app.config['CANDIDATE_POOL_ENABLED']:
+            batch_sizes.append(app.config['CANDIDATE_POOL_REFILL_BATCH_SIZE'])
+        model = compile_model(app, model, generate_noise(256, model.input_shape[-1]), binarize_generated, batch_sizes)
+        variation_model = compile_model(
+            app, variation_model,
+            np.concatenate([variation_noise(roll, 1) for roll in sample_rolls]),
+            binarize_variations,
+            [app.config['INFERENCE_WARMUP_VARIATION_BATCH_SIZE']]
+        )
+
+    if app.config['PREDICT_BATCHING_ENABLED']:
+        model = PredictBatcher(
+            model,
+            window_ms=app.config['PREDICT_BATCH_WINDOW_MS'],
+            max_batch_size=app.config['PREDICT_MAX_BATCH_SIZE']
+        )
+        variation_model = PredictBatcher(
+            variation_model,
+            window_ms=app.config['PREDICT_BATCH_WINDOW_MS'],
+            max_batch_size=app.config['PREDICT_MAX_BATCH_SIZE']
+        )
+
+    app.config['model'] = model
+    app.config['variation_model'] = variation_model
+
+
+def compile_model(app, model, sample_inputs, binarize, batch_sizes=None):
+    # batch_sizes are the predict sizes warmed before the app is ready, None warms every bucket
+    compiled = CompiledModel(model, buckets=app.config['INFERENCE_BUCKETS'], precision=app.config['INFERENCE_PRECISION'])
+    if compiled.precision != 'float32':
+        accuracy = compiled.check_accuracy(sample_inputs, binarize)
+        logger.info(f"{model.name} at {compiled.precision}: {accuracy}",
+                    extra={'model': model.name, 'precision': compiled.precision, 'accuracy': accuracy})
+        if accuracy['mismatch_rate'] > app.config['INFERENCE_MAX_MISMATCH']:
+            logger.warning(f"{model.name} at {compiled.precision} is too far from float32, using float32",
+                           extra={'model': model.name, 'precision': compiled.precision})
+            compiled = CompiledModel(model, buckets=app.config['INFERENCE_BUCKETS'])
+    return compiled.warmup(batch_sizes)
+
+
+def start_warmup(app):
+    # traces the buckets compile_model left out in a background thread, requests needing one meanwhile trace it
+    # themselves
+    if app.config['INFERENCE_WARMUP'] not in ('background', 'lazy'):
+        raise ValueError("`INFERENCE_WARMUP` must be either 'background' or 'lazy'.")
+    compiled = []
+    for name in ('model', 'variation_model'):
+        model = app.config[name]
+        if isinstance(model, PredictBatcher):
+            model = model.model
+        if isinstance(model, CompiledModel):
+            compiled.append(model)
+    if app.config['INFERENCE_WARMUP'] != 'background' or not compiled:
+        return
+
+    def warmup():
+        started_at = time.perf_counter()
+        for model in compiled:
+            model.warmup()
+        seconds = time.perf_counter() - started_at
+        logger.info(f"Warmed the remaining inference buckets in {seconds:.1f}s", extra={'seconds': seconds})
+
+    threading.Thread(target=warmup, name='inference-warmup', daemon=True).start()
+
+
+def start_candidate_pool(app):
+    if app.config['CANDIDATE_POOL_ENABLED']:
+        app.config['candidate_pool'] = CandidatePool(
+            app.config['model'],
+            low_watermark=app.config['CANDIDATE_POOL_LOW_WATERMARK'],
+            high_watermark=app.config['CANDIDATE_POOL_HIGH_WATERMARK'],
+            refill_batch_size=app.config['CANDIDATE_POOL_REFILL_BATCH_SIZE'],
+            max_bytes=app.config['CANDIDATE_POOL_MAX_BYTES'],
+            cascade=app.config['cascade']
+        ).start()
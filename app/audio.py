@@ -0,0 +1,98 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from .metrics import STAGE_SECONDS
+
+# file extension -> (fluidsynth file type, mimetype)
+AUDIO_FORMATS = {
+    'wav': ('wav', 'audio/wav'),
+    'flac': ('flac', 'audio/flac'),
+    'ogg': ('oga', 'audio/ogg'),
+}
+
+_worker_soundfont_path = None
+
+
+class AudioRenderTimeout(Exception):
+    pass
+
+
+def _init_worker(soundfont_path):
+    # resolved once when the worker starts instead of on every write_audio
+    global _worker_soundfont_path
+    _worker_soundfont_path = soundfont_path
+
+
+def _write_audio(path, music, audio_format, soundfont_path=None):
+    # returns (path, seconds), timed here so process workers report the render and not the queueing
+    import muspy
+    started_at = time.perf_counter()
+    muspy.write_audio(path, music, audio_format=audio_format, soundfont_path=soundfont_path or _worker_soundfont_path)
+    return path, time.perf_counter() - started_at
+
+
+def _record_render(future):
+    # only the histogram, the request waiting on it sees the render as audio_wait
+    if not future.cancelled() and future.exception() is None:
+        STAGE_SECONDS.observe(future.result()[1], stage='write_audio')
+
+
+class AudioRenderer:
+    # renders muspy.write_audio calls in parallel. each render is a fluidsynth subprocess, so 'thread' workers
+    # already spread renders over the cores; 'process' runs the MIDI writing in spawned workers as well
+    def __init__(self, workers=4, executor='thread', soundfont_path=None):
+        if executor not in ('thread', 'process'):
+            raise ValueError("`executor` must be either 'thread' or 'process'.")
+        self.workers = workers
+        self.executor = executor
+        self._soundfont_path = soundfont_path
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def soundfont_path(self):
+        # resolved on first use, finding it means importing muspy
+        if self._soundfont_path is None:
+            import muspy
+            self._soundfont_path = muspy.get_musescore_soundfont_path()
+        return str(self._soundfont_path)
+
+    def submit(self, path, music, audio_format='wav'):
+        # audio_format is a key of AUDIO_FORMATS
+        soundfont_path = self.soundfont_path if self.executor == 'thread' else None
+        future = self._get_executor().submit(_write_audio, path, music, AUDIO_FORMATS[audio_format][0], soundfont_path)
+        future.add_done_callback(_record_render)
+        return future
+
+    def wait(self, futures, deadline=None):
+        # deadline is a time.monotonic() value, renders still pending past it are cancelled
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        done, not_done = wait(futures, timeout=timeout)
+        if not_done:
+            for future in not_done:
+                future.cancel()
+            raise AudioRenderTimeout(f'{len(not_done)} of {len(futures)} audio renders missed the deadline')
+        return [future.result()[0] for future in futures]
+
+    def render(self, items, audio_format='wav', deadline=None):
+        # items are (path, music) pairs
+        return self.wait([self.submit(path, music, audio_format) for path, music in items], deadline)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None and self.executor == 'process':
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.soundfont_path,)
+                )
+            elif self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='audio-render')
+            return self._executor
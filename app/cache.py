@@ -0,0 +1,132 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def cache_key(*parts):
+    # parts are plain values (str, int, float, None and tuples/lists/dicts of them), repr is stable for those
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+class ResultCache:
+    # LRU of pickled values bounded by max_bytes in memory, entries evicted from memory are spilled to disk_dir
+    # where the least recently used go once it passes disk_max_bytes. a disk hit is moved back into memory
+    def __init__(self, max_bytes=64 * 1024 * 1024, disk_dir=None, disk_max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._spills = 0
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return pickle.loads(data)
+
+        data = self._read(key)
+        if data is None:
+            with self._lock:
+                self._misses += 1
+            return None
+        with self._lock:
+            self._disk_hits += 1
+        self._store(key, data)
+        return pickle.loads(data)
+
+    def put(self, key, value):
+        self._store(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self._hits,
+                'disk_hits': self._disk_hits,
+                'misses': self._misses,
+                'spills': self._spills,
+                'disk_entries': len(self._disk_files()) if self.disk_dir is not None else 0,
+            }
+
+    def _store(self, key, data):
+        spilled = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and self._entries:
+                old_key, old_data = self._entries.popitem(last=False)
+                self._bytes -= len(old_data)
+                spilled.append((old_key, old_data))
+            self._spills += len(spilled)
+        if self.disk_dir is not None and spilled:
+            for old_key, old_data in spilled:
+                self._write(old_key, old_data)
+            self._evict_disk()
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f'{key}.pickle')
+
+    def _read(self, key):
+        if self.disk_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path)  # the mtime orders the disk entries for eviction
+        except FileNotFoundError:
+            return None
+        return data
+
+    def _write(self, key, data):
+        # written under a temporary name and renamed, so a reader never sees half an entry
+        fd, temp_path = tempfile.mkstemp(dir=self.disk_dir, prefix='.spill-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def _disk_files(self):
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.pickle'):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                files.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except FileNotFoundError:
+                continue
+        return files
+
+    def _evict_disk(self):
+        with self._disk_lock:
+            files = sorted(self._disk_files())
+            total = sum(size for _, size, _ in files)
+            for _, size, path in files:
+                if total <= self.disk_max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
@@ -0,0 +1,114 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+PENDING = 'pending'
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, func, args, kwargs, stages):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.status = QUEUED
+        self.stages = {stage: PENDING for stage in stages}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+
+    def stage(self, name):
+        # marks name as running and every stage before it as done
+        for stage in self.stages:
+            if stage == name:
+                self.stages[stage] = RUNNING
+                break
+            self.stages[stage] = DONE
+        self.updated_at = time.time()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'stages': dict(self.stages),
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+        }
+
+
+class JobQueue:
+    # bounded in-process queue drained by a fixed pool of worker threads, submit raises QueueFull instead of blocking
+    def __init__(self, workers=2, max_queued=16, result_ttl=600):
+        self.result_ttl = result_ttl
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+            for i in range(workers)
+        ]
+
+    def start(self):
+        # threads don't survive a fork, so a preloading gunicorn master creates the queue and each worker starts it
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def submit(self, func, *args, stages=(), **kwargs):
+        # func is called as func(job, *args, **kwargs) and its return value becomes the job result
+        job = Job(func, args, kwargs, stages)
+        self._prune()
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise QueueFull(f'{self._queue.maxsize} jobs already queued')
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        expired = time.time() - self.result_ttl
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job.status in (DONE, FAILED) and job.updated_at < expired]:
+                del self._jobs[job_id]
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            job.status = RUNNING
+            job.updated_at = time.time()
+            try:
+                job.result = job.func(job, *job.args, **job.kwargs)
+                job.stages = {stage: DONE for stage in job.stages}
+                job.status = DONE
+            except Exception as e:
+                logger.exception('Job failed', extra={'job_id': job.id, 'job': getattr(job.func, '__name__', repr(job.func))})
+                job.error = str(e)
+                job.status = FAILED
+            job.updated_at = time.time()
+            self._queue.task_done()
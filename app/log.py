@@ -0,0 +1,36 @@
+import json
+import logging
+
+# attributes every LogRecord has, anything else on a record came from extra= and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    # one JSON object per line: time, level, logger, message and the extra= fields
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level='INFO', log_format='json'):
+    # handler on the package logger so the app logs the same way under flask run and gunicorn, calling it again
+    # (one create_app per test or worker) only updates the level
+    if log_format not in ('json', 'text'):
+        raise ValueError("`log_format` must be either 'json' or 'text'.")
+    logger = logging.getLogger(__package__)
+    logger.setLevel(level)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter() if log_format == 'json' else
+                             logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        logger.addHandler(handler)
+        logger.propagate = False
+    return logger
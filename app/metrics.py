@@ -0,0 +1,190 @@
+import bisect
+import contextvars
+import math
+import threading
+import time
+
+# seconds, upper bounds of the histogram buckets. a stage runs anywhere from a few microseconds (ranking) to a
+# minute (an audio render on a busy host)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# stage -> seconds for the request running in this context, None outside a request (jobs, the candidate pool)
+_timings = contextvars.ContextVar('timings', default=None)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {', '.join(self.labelnames)}")
+        try:
+            return tuple(str(labels[name]) for name in self.labelnames)
+        except KeyError:
+            raise ValueError(f"{self.name} takes the labels {', '.join(self.labelnames)}") from None
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f'{self.name}{self._labels(key)} {_number(value)}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # per bucket (not cumulative) counts, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def _samples(self, key, counts):
+        samples, cumulative = [], 0
+        for bound, count in zip(self.buckets + (math.inf,), counts[:-1]):
+            cumulative += count
+            samples.append(f'{self.name}_bucket{self._labels(key, [("le", _number(bound))])} {cumulative}')
+        samples.append(f'{self.name}_sum{self._labels(key)} {_number(counts[-1])}')
+        samples.append(f'{self.name}_count{self._labels(key)} {cumulative}')
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        # Prometheus text exposition format 0.0.4
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'vivygan_stage_seconds', 'Time spent in each generation and rendering stage.', ('stage',)))
+STAGES_IN_FLIGHT = REGISTRY.register(Gauge(
+    'vivygan_stages_in_flight', 'Stages currently running.', ('stage',)))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'vivygan_request_seconds', 'Time from the start of a request to its response.', ('endpoint',)))
+REQUESTS = REGISTRY.register(Counter(
+    'vivygan_requests_total', 'Requests answered, by endpoint and status code.', ('endpoint', 'status')))
+REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'vivygan_requests_in_flight', 'Requests currently being handled.', ('endpoint',)))
+JOB_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'vivygan_job_queue_depth', 'Jobs waiting for a worker.'))
+CANDIDATE_POOL_SIZE = REGISTRY.register(Gauge(
+    'vivygan_candidate_pool_size', 'Scored candidates ready in the pool.'))
+RESULT_CACHE_BYTES = REGISTRY.register(Gauge(
+    'vivygan_result_cache_bytes', 'Bytes held by the in-memory result cache.'))
+
+
+class timed:
+    # `with timed('stage'):` records the block in STAGE_SECONDS and the request's Server-Timing, a class rather
+    # than a contextmanager generator since it wraps every stage of every request
+    __slots__ = ('stage', 'started_at')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        STAGES_IN_FLIGHT.inc(stage=self.stage)
+        self.started_at = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.started_at
+        STAGES_IN_FLIGHT.dec(stage=self.stage)
+        observe(self.stage, seconds)
+
+
+def observe(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def start_timings():
+    _timings.set({})
+
+
+def finish_timings():
+    # the stage timings collected since start_timings, repeated stages are summed
+    timings = _timings.get()
+    _timings.set(None)
+    return timings or {}
+
+
+def server_timing(timings):
+    # Server-Timing header value, durations in milliseconds
+    return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in timings.items())
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
@@ -0,0 +1,118 @@
+import threading
+import time
+import numpy as np
+
+
+class _PendingPredict:
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.arrived_at = time.perf_counter()
+        self.done = threading.Event()
+        self.outputs = None
+        self.error = None
+
+
+class PredictBatcher:
+    # stands in for a keras model: predict() calls arriving within window_ms of the first waiting call
+    # are concatenated into one model.predict and the outputs are split back to each caller
+    def __init__(self, model, window_ms=5, max_batch_size=2048):
+        self.model = model
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+
+        self._pending = []
+        self._condition = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._rows = 0
+        self._max_batch_rows = 0
+        self._max_batch_requests = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+        self._thread = threading.Thread(target=self._run, name='predict-batcher', daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def predict(self, inputs, **kwargs):
+        # keras kwargs such as batch_size don't apply once calls are merged
+        pending = _PendingPredict(np.asarray(inputs))
+        with self._condition:
+            self._pending.append(pending)
+            self._condition.notify_all()
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.outputs
+
+    def stats(self):
+        with self._stats_lock:
+            batches = max(self._batches, 1)
+            requests = max(self._requests, 1)
+            return {
+                'batches': self._batches,
+                'requests': self._requests,
+                'rows': self._rows,
+                'mean_batch_rows': self._rows / batches,
+                'max_batch_rows': self._max_batch_rows,
+                'mean_batch_requests': self._requests / batches,
+                'max_batch_requests': self._max_batch_requests,
+                'mean_wait_ms': self._total_wait / requests * 1000,
+                'max_wait_ms': self._max_wait * 1000,
+            }
+
+    def _collect(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending)
+            deadline = self._pending[0].arrived_at + self.window
+            while sum(len(pending.inputs) for pending in self._pending) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            # only calls with the same sample shape as the oldest one can share a batch
+            sample_shape = self._pending[0].inputs.shape[1:]
+            batch, rows = [], 0
+            for pending in list(self._pending):
+                if pending.inputs.shape[1:] != sample_shape:
+                    continue
+                if batch and rows + len(pending.inputs) > self.max_batch_size:
+                    break
+                batch.append(pending)
+                rows += len(pending.inputs)
+                self._pending.remove(pending)
+            return batch, rows
+
+    def _run(self):
+        while True:
+            batch, rows = self._collect()
+            started_at = time.perf_counter()
+            try:
+                if len(batch) == 1:
+                    outputs = [self.model.predict(batch[0].inputs)]
+                else:
+                    merged = self.model.predict(np.concatenate([pending.inputs for pending in batch]))
+                    outputs = np.split(merged, np.cumsum([len(pending.inputs) for pending in batch])[:-1])
+                for pending, output in zip(batch, outputs):
+                    pending.outputs = output
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+
+            with self._stats_lock:
+                self._batches += 1
+                self._requests += len(batch)
+                self._rows += rows
+                self._max_batch_rows = max(self._max_batch_rows, rows)
+                self._max_batch_requests = max(self._max_batch_requests, len(batch))
+                for pending in batch:
+                    wait = started_at - pending.arrived_at
+                    self._total_wait += wait
+                    self._max_wait = max(self._max_wait, wait)
+
+            for pending in batch:
+                pending.done.set()
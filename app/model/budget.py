@@ -0,0 +1,49 @@
+import threading
+
+
+class BatchSizeController:
+    # sizes candidate chunks to a latency budget from a moving average of the seconds each candidate costs to
+    # generate, post-process and score. under load the average rises and requests search fewer candidates,
+    # on an idle host they fit more into the same budget
+    def __init__(self, min_batch_size=100, max_batch_size=2000, initial_seconds_per_candidate=0.002,
+                 smoothing=0.2, safety=0.8):
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.smoothing = smoothing
+        self.safety = safety  # share of the remaining budget a chunk is sized to fill
+        self.seconds_per_candidate = initial_seconds_per_candidate
+        self._lock = threading.Lock()
+        self._chunks = 0
+        self._requests = 0
+        self._searched = 0
+        self._last_searched = 0
+
+    def chunk_size(self, remaining):
+        # 0 once the remaining budget can't fit a minimum sized chunk
+        with self._lock:
+            size = int(remaining * self.safety / self.seconds_per_candidate)
+        if size < self.min_batch_size:
+            return 0
+        return min(size, self.max_batch_size)
+
+    def record(self, batch_size, seconds):
+        with self._lock:
+            observed = seconds / batch_size
+            self.seconds_per_candidate += self.smoothing * (observed - self.seconds_per_candidate)
+            self._chunks += 1
+
+    def record_request(self, searched):
+        with self._lock:
+            self._requests += 1
+            self._searched += searched
+            self._last_searched = searched
+
+    def stats(self):
+        with self._lock:
+            return {
+                'seconds_per_candidate': self.seconds_per_candidate,
+                'chunks': self._chunks,
+                'requests': self._requests,
+                'mean_candidates_searched': self._searched / max(self._requests, 1),
+                'last_candidates_searched': self._last_searched,
+            }
@@ -0,0 +1,128 @@
+import logging
+import threading
+import numpy as np
+from .vivygan import generate_candidates, CandidateBatch, CUT_NOTES_PERCENTAGE
+
+logger = logging.getLogger(__name__)
+
+
+class CandidatePool:
+    # keeps generated candidates post-processed and scored in the background so requests only rank them.
+    # the worker refills once a view drops below low_watermark and stops at high_watermark or max_bytes
+    def __init__(self, generator, low_watermark=1000, high_watermark=2000, refill_batch_size=500,
+                 max_bytes=64 * 1024 * 1024, latent_dim=100, retry_interval=5.0, cascade=None):
+        self.generator = generator
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.refill_batch_size = refill_batch_size
+        self.max_bytes = max_bytes
+        self.latent_dim = latent_dim
+        self.retry_interval = retry_interval
+        self.cascade = cascade
+
+        # a plain view and one with the lowest notes cut for cut_notes requests. the cascade filters each view
+        # on its own notes, so they are separate queues fed from the same generated candidates
+        self._views = {False: None, True: None}
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+
+    def __len__(self):
+        with self._condition:
+            return min(self._size(cut) for cut in self._views)
+
+    @property
+    def nbytes(self):
+        with self._condition:
+            return sum(view.nbytes for view in self._views.values() if view is not None)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'size': self._size(False),
+                'cut_size': self._size(True),
+                'bytes': self.nbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'refills': self.refills,
+            }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='candidate-pool', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def take(self, batch_size, cut_notes=False):
+        with self._condition:
+            available = self._size(cut_notes)
+            if available < batch_size:
+                self.misses += 1
+                self._condition.notify_all()
+                return None
+
+            view = self._views[cut_notes]
+            taken = view.take(np.arange(batch_size))
+            self._views[cut_notes] = view.take(np.arange(batch_size, available))
+            self.hits += 1
+            # frees bytes as well as candidates, either can let a waiting refill go on
+            self._condition.notify_all()
+        return taken
+
+    def _size(self, cut):
+        view = self._views[cut]
+        return 0 if view is None else len(view)
+
+    def _views_with_room(self):
+        with self._condition:
+            if not self._has_room():
+                return []
+            return [cut for cut in self._views if self._size(cut) < self.high_watermark]
+
+    def _has_room(self):
+        return self.nbytes < self.max_bytes
+
+    def _run(self):
+        while True:
+            with self._condition:
+                # a pool at max_bytes sleeps until take() frees some, even below the low watermark
+                self._condition.wait_for(lambda: self._stopped or (len(self) < self.low_watermark and self._has_room()))
+                if self._stopped:
+                    return
+
+            while True:
+                cuts = self._views_with_room()
+                if not cuts:
+                    break
+                try:
+                    candidates = generate_candidates(self.generator, self.refill_batch_size, self.latent_dim)
+                    views = {}
+                    for cut in cuts:
+                        view = candidates.cut(CUT_NOTES_PERCENTAGE) if cut else candidates
+                        if self.cascade is not None:
+                            view, _ = self.cascade.apply(view)
+                        view.score()
+                        views[cut] = view
+                except Exception:
+                    logger.exception("Candidate pool refill failed")
+                    with self._condition:
+                        self._condition.wait(self.retry_interval)
+                    break
+
+                with self._condition:
+                    if self._stopped:
+                        return
+                    for cut, view in views.items():
+                        if self._views[cut] is not None:
+                            view = CandidateBatch.concatenate([self._views[cut], view])
+                        self._views[cut] = view
+                    self.refills += 1
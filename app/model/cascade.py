@@ -0,0 +1,109 @@
+import logging
+import threading
+import numpy as np
+from .vivygan import ROLL_SHAPE
+from ..metrics import timed
+
+# (stage, min, max) in the order they run, None leaves that side open
+DEFAULT_STAGES = (
+    ('note_count', 4, None),
+    ('coverage', 0.25, None),
+    ('pitch_range', None, 48),
+)
+
+logger = logging.getLogger(__name__)
+
+
+def note_counts(notes, batch_size):
+    return np.bincount(notes['index'], minlength=batch_size)
+
+
+def coverage(notes, batch_size, length=ROLL_SHAPE[1]):
+    # fraction of time steps where at least one note is playing
+    width = length + 1
+    starts = notes['index'].astype(np.int64) * width + notes['time']
+    ends = notes['index'].astype(np.int64) * width + np.minimum(notes['time'] + notes['duration'], length)
+    changes = np.bincount(starts, minlength=batch_size * width) - np.bincount(ends, minlength=batch_size * width)
+    active = np.cumsum(changes.reshape(batch_size, width).astype(np.int32), axis=1)[:, :length] > 0
+    return active.mean(axis=1)
+
+
+def pitch_range(notes, batch_size):
+    # highest minus lowest pitch, 0 for empty candidates. notes are grouped by candidate index
+    counts = note_counts(notes, batch_size)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    ranges = np.zeros(batch_size, dtype=np.int64)
+    nonempty = counts > 0
+    if nonempty.any():
+        pitches = notes['pitch']
+        ranges[nonempty] = np.maximum.reduceat(pitches, starts[nonempty]) - np.minimum.reduceat(pitches, starts[nonempty])
+    return ranges
+
+
+FEATURES = {
+    'note_count': note_counts,
+    'coverage': coverage,
+    'pitch_range': pitch_range,
+}
+
+
+class Cascade:
+    # drops candidates that fail cheap note-level checks before CandidateBatch.score() computes the full metrics.
+    # a stage that would drop every remaining candidate is skipped instead, so ranking always has something to pick
+    def __init__(self, stages=DEFAULT_STAGES, verbose=True):
+        for name, _, _ in stages:
+            if name not in FEATURES:
+                raise ValueError(f"Unknown cascade stage {name}, expected one of {', '.join(FEATURES)}.")
+        self.stages = tuple(stages)
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._runs = 0
+        self._candidates = 0
+        self._survivors = 0
+        self._dropped = dict.fromkeys((name for name, _, _ in self.stages), 0)
+        self._skipped = dict.fromkeys((name for name, _, _ in self.stages), 0)
+
+    def apply(self, candidates):
+        # returns (surviving candidates, per-stage report)
+        keep = np.arange(len(candidates))
+        report = []
+        with timed('cascade'):
+            for name, low, high in self.stages:
+                values = FEATURES[name](candidates.notes, len(candidates))[keep]
+                passes = np.ones(len(keep), dtype=bool)
+                if low is not None:
+                    passes &= values >= low
+                if high is not None:
+                    passes &= values <= high
+                skipped = not passes.any()
+                if not skipped:
+                    keep = keep[passes]
+                report.append({'stage': name, 'dropped': 0 if skipped else int((~passes).sum()),
+                               'remaining': len(keep), 'skipped': skipped})
+
+        with self._lock:
+            self._runs += 1
+            self._candidates += len(candidates)
+            self._survivors += len(keep)
+            for stage in report:
+                self._dropped[stage['stage']] += stage['dropped']
+                self._skipped[stage['stage']] += stage['skipped']
+
+        if self.verbose:
+            dropped = ', '.join(f"{stage['stage']} -{stage['dropped']}" + (' (skipped)' if stage['skipped'] else '')
+                                for stage in report)
+            logger.info(f"Cascade kept {len(keep)} of {len(candidates)} candidates ({dropped})",
+                        extra={'kept': len(keep), 'candidates': len(candidates), 'stages': report})
+        if len(keep) == len(candidates):
+            return candidates, report
+        return candidates.take(keep), report
+
+    def stats(self):
+        with self._lock:
+            return {
+                'runs': self._runs,
+                'candidates': self._candidates,
+                'scored': self._survivors,
+                'dropped': dict(self._dropped),
+                'skipped': dict(self._skipped),
+            }
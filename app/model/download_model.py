@@ -1,14 +1,17 @@
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '1'
-from azure.storage.blob import BlobServiceClient
-import keras
+from .model_store import ModelStore, AzureBlobBackend
 
 
-def download_model_file(connection_string, container_name, blob_name):
-    blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+def download_model_file(connection_string, container_name, blob_name, cache_dir='model_cache', offline=False):
+    backend = None if offline else AzureBlobBackend(connection_string, container_name)
+    return load_model_file(ModelStore(backend, cache_dir, offline=offline), blob_name)
 
-    with open("model_save.keras", "wb") as download_file:
-        download_file.write(blob_client.download_blob().readall())
 
-    return keras.models.load_model('model_save.keras')
+def load_model_file(store, blob_name):
+    return load_model_path(store.fetch(blob_name))
+
+
+def load_model_path(path):
+    import keras  # pulls in tensorflow, a few seconds that create_app shouldn't pay up front
+    return keras.models.load_model(path)
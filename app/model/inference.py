@@ -0,0 +1,152 @@
+import tempfile
+import threading
+import numpy as np
+
+PRECISIONS = ('float32', 'int8')
+
+
+class CompiledModel:
+    # stands in for a keras model: predict() pads each batch up to the next bucket size and runs a serving function
+    # traced once per bucket with a fixed input signature, so calls skip keras' predict loop and never retrace.
+    # 'int8' runs a TFLite conversion with dynamic range quantized weights instead, see check_accuracy
+    def __init__(self, model, buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512), precision='float32'):
+        if precision not in PRECISIONS:
+            raise ValueError(f"`precision` must be one of {', '.join(PRECISIONS)}.")
+        self.model = model
+        self.buckets = tuple(sorted(buckets))
+        self.precision = precision
+        self.input_shape = tuple(model.input_shape[1:])
+        self.output_shape = tuple(model.output_shape[1:])
+        self.accuracy = None
+
+        self._lock = threading.Lock()
+        self._functions = {}
+        self._warm = set()
+        self._interpreter = None
+        self._runners = {}
+        self._stats_lock = threading.Lock()
+        self._calls = 0
+        self._rows = 0
+        self._padded_rows = 0
+        self._bucket_calls = dict.fromkeys(self.buckets, 0)
+
+        if precision == 'int8':
+            self._interpreter = _convert_to_tflite(model, self.buckets, self.input_shape, quantize=True)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def predict(self, inputs, **kwargs):
+        # keras kwargs such as batch_size don't apply, batches are split by bucket instead
+        inputs = np.asarray(inputs, dtype=np.float32)
+        if len(inputs) == 0:
+            return np.zeros((0,) + self.output_shape, dtype=np.float32)
+
+        outputs = []
+        largest = self.buckets[-1]
+        for start in range(0, len(inputs), largest):
+            chunk = inputs[start:start + largest]
+            bucket = self.buckets[np.searchsorted(self.buckets, len(chunk))]
+            if bucket > len(chunk):
+                chunk = np.concatenate([chunk, np.zeros((bucket - len(chunk),) + self.input_shape, dtype=np.float32)])
+            outputs.append(self._run(bucket, chunk)[:min(len(inputs) - start, largest)])
+            with self._stats_lock:
+                self._bucket_calls[bucket] += 1
+                self._padded_rows += bucket - min(len(inputs) - start, largest)
+
+        with self._stats_lock:
+            self._calls += 1
+            self._rows += len(inputs)
+        return outputs[0] if len(outputs) == 1 else np.concatenate(outputs)
+
+    def warmup(self, batch_sizes=None):
+        # runs each bucket once so tracing and the first-call graph optimisation happen here, not on requests.
+        # batch_sizes limits it to the buckets predict uses for those sizes, buckets already run are skipped
+        if batch_sizes is None:
+            buckets = self.buckets
+        else:
+            buckets = sorted(set().union(*(self.buckets_for(batch_size) for batch_size in batch_sizes)))
+        for bucket in buckets:
+            if bucket not in self._warm:
+                self._run(bucket, np.zeros((bucket,) + self.input_shape, dtype=np.float32))
+                self._warm.add(bucket)
+        return self
+
+    def buckets_for(self, batch_size):
+        # the buckets a predict call with batch_size rows runs
+        largest = self.buckets[-1]
+        full, rest = divmod(batch_size, largest)
+        buckets = {largest} if full else set()
+        if rest:
+            buckets.add(self.buckets[np.searchsorted(self.buckets, rest)])
+        return buckets
+
+    def check_accuracy(self, inputs, binarize=None):
+        # compares predict() with the float model on inputs, binarize maps outputs to the notes the app keeps so
+        # the mismatch rate counts the piano roll cells that would change
+        inputs = np.asarray(inputs, dtype=np.float32)
+        reference = np.asarray(self.model(inputs, training=False))
+        outputs = self.predict(inputs)
+        errors = np.abs(outputs - reference)
+        self.accuracy = {
+            'samples': len(inputs),
+            'max_abs_error': float(errors.max()),
+            'mean_abs_error': float(errors.mean()),
+        }
+        if binarize is not None:
+            self.accuracy['mismatch_rate'] = float(np.mean(binarize(outputs) != binarize(reference)))
+        return self.accuracy
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'precision': self.precision,
+                'calls': self._calls,
+                'rows': self._rows,
+                'padded_rows': self._padded_rows,
+                'bucket_calls': {str(bucket): calls for bucket, calls in self._bucket_calls.items()},
+                'warm_buckets': sorted(self._warm),
+                'accuracy': self.accuracy,
+            }
+
+    def _run(self, bucket, inputs):
+        if self._interpreter is None:
+            return self._function(bucket)(inputs).numpy()
+        # a TFLite interpreter isn't thread-safe
+        with self._lock:
+            runner = self._runners.get(bucket)
+            if runner is None:
+                runner = self._runners[bucket] = self._interpreter.get_signature_runner(f'serve_{bucket}')
+            return next(iter(runner(inputs=inputs).values()))
+
+    def _function(self, bucket):
+        with self._lock:
+            function = self._functions.get(bucket)
+            if function is None:
+                import tensorflow as tf
+                function = self._functions[bucket] = tf.function(
+                    lambda inputs: self.model(inputs, training=False),
+                    input_signature=[tf.TensorSpec((bucket,) + self.input_shape, tf.float32)]
+                )
+            return function
+
+
+def _convert_to_tflite(model, buckets, input_shape, quantize=False):
+    # one flatbuffer with a fixed-shape signature per bucket, the weights are stored once and shared between them
+    import keras
+    import tensorflow as tf
+    archive = keras.export.ExportArchive()
+    archive.track(model)
+    for bucket in buckets:
+        archive.add_endpoint(
+            f'serve_{bucket}',
+            lambda inputs: model(inputs, training=False),
+            input_signature=[tf.TensorSpec((bucket,) + input_shape, tf.float32, name='inputs')]
+        )
+    with tempfile.TemporaryDirectory() as directory:
+        archive.write_out(directory)
+        converter = tf.lite.TFLiteConverter.from_saved_model(directory, signature_keys=[f'serve_{bucket}' for bucket in buckets])
+        if quantize:
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        content = converter.convert()
+    return tf.lite.Interpreter(model_content=content)
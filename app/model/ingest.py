@@ -0,0 +1,271 @@
+import os
+import numpy as np
+from PIL import Image
+from .vivygan import ROLL_SHAPE
+
+# turns an uploaded file into the (pitch, time) float32 roll the variation model takes. every loader stops at the
+# model's input shape, files longer than ROLL_SHAPE[1] steps are cropped and shorter ones padded, so the work and
+# memory of a request don't grow with the length of the upload
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+MIDI_EXTENSIONS = ('.mid', '.midi')
+ARRAY_EXTENSIONS = ('.npz', '.npy')
+MIDI_DRUM_CHANNEL = 9
+MIDI_SUSTAIN_PEDAL = 64
+MIDI_SET_TEMPO = 0x51
+# data bytes after a channel message status (high nibble) or a system common status
+MIDI_DATA_BYTES = {0x80: 2, 0x90: 2, 0xa0: 2, 0xb0: 2, 0xc0: 1, 0xd0: 1, 0xe0: 2, 0xf1: 1, 0xf2: 2, 0xf3: 1}
+
+
+class InputError(Exception):
+    pass
+
+
+def input_kind(filename):
+    # 'image', 'midi', 'npz' or 'npy', None for a file we don't read
+    extension = os.path.splitext(filename.lower())[1]
+    if extension in IMAGE_EXTENSIONS:
+        return 'image'
+    if extension in MIDI_EXTENSIONS:
+        return 'midi'
+    if extension in ARRAY_EXTENSIONS:
+        return extension[1:]
+    return None
+
+
+def load_input(file, filename, shape=ROLL_SHAPE, max_decoded_bytes=64 * 1024 * 1024):
+    # file is a path or a binary file object. max_decoded_bytes bounds the decoded size of an image or a compressed
+    # npz, checked from its header before it is decoded. raises InputError for anything that can't be used
+    kind = input_kind(filename)
+    if kind == 'image':
+        return load_from_png(file, shape, max_decoded_bytes)
+    if kind == 'midi':
+        return load_from_midi(file, shape)
+    if kind == 'npz':
+        return load_from_pianoroll(file, shape, max_decoded_bytes=max_decoded_bytes)
+    if kind == 'npy':
+        return load_from_array(file, shape)
+    raise InputError(f"Unsupported file type, upload one of {', '.join(IMAGE_EXTENSIONS + MIDI_EXTENSIONS + ARRAY_EXTENSIONS)}")
+
+
+def load_from_png(file, shape=ROLL_SHAPE, max_decoded_bytes=64 * 1024 * 1024):
+    # grayscale, nearest neighbour resized to shape and scaled to [0, 1], as keras' load_img did
+    try:
+        with Image.open(file) as image:
+            # open only reads the header
+            width, height = image.size
+            if width * height * len(image.getbands()) > max_decoded_bytes:
+                raise InputError(f'The image is too large ({width}x{height})')
+            if image.mode != 'L':
+                image = image.convert('L')
+            image = image.resize((shape[1], shape[0]), Image.NEAREST)
+    except Image.DecompressionBombError as e:
+        raise InputError('The image is too large') from e
+    except (OSError, ValueError) as e:
+        raise InputError('Could not read the image') from e
+    return np.asarray(image, dtype=np.float32) / 255.0
+
+
+def load_from_midi(file, shape=ROLL_SHAPE, fs=100, pitch_range=(0, 72), pedal_threshold=64):
+    # the first shape[1] steps at fs steps a second. each track is decoded only until the end of that window and the
+    # note offs and pedal releases of what is still on, so a long file costs no more than a short one. the same roll
+    # as pretty_midi's get_piano_roll(fs)[pitch_range] binarized: drums are left out, a note off ends the notes of
+    # that pitch started before it, notes never turned off are dropped and the sustain pedal holds notes until it's
+    # released. pitch bends are ignored
+    data = read_bytes(file)
+    resolution, tracks = midi_chunks(data)
+    steps = shape[1]
+    tempo_changes = midi_tempo_changes(tracks[0], resolution, steps / fs)
+    roll = np.zeros((pitch_range[1] - pitch_range[0], steps), dtype=np.uint8)
+    for track in tracks:
+        # (channel, pitch) -> (tick, step) the notes still on started at, channel -> step the pedal went down
+        open_notes, pedal_down = {}, {}
+        spans, pedals = {}, {}
+        tick, change = 0, 0
+        for delta, status, first, second in midi_events(track):
+            tick += delta
+            while change + 1 < len(tempo_changes) and tempo_changes[change + 1][0] <= tick:
+                change += 1
+            change_tick, change_seconds, tick_scale = tempo_changes[change]
+            step = int((change_seconds + (tick - change_tick) * tick_scale) * fs)
+            past_window = step >= steps
+            if past_window:
+                if not open_notes and not pedal_down:
+                    break
+                step = steps
+            kind, channel = status & 0xf0, status & 0x0f
+            if kind not in (0x80, 0x90, 0xb0) or status >= 0xf0 or channel == MIDI_DRUM_CHANNEL:
+                continue
+
+            if kind == 0x90 and second > 0:
+                if not past_window:
+                    open_notes.setdefault((channel, first), []).append((tick, step))
+            elif kind in (0x80, 0x90):
+                notes = open_notes.pop((channel, first), [])
+                closed = [start for start_tick, start in notes if start_tick != tick]
+                spans.setdefault(channel, []).extend((first, start, step) for start in closed)
+                if closed and len(closed) < len(notes):
+                    # a note on in the same tick as the note off carries on
+                    open_notes[channel, first] = [note for note in notes if note[0] == tick]
+            elif first == MIDI_SUSTAIN_PEDAL:
+                if second >= pedal_threshold and channel not in pedal_down and not past_window:
+                    pedal_down[channel] = step
+                elif second < pedal_threshold and channel in pedal_down:
+                    pedals.setdefault(channel, []).append((pedal_down.pop(channel), step))
+
+        for channel, channel_spans in spans.items():
+            channel_roll = np.zeros_like(roll)
+            for pitch, start, end in channel_spans:
+                if pitch_range[0] <= pitch < pitch_range[1]:
+                    channel_roll[pitch - pitch_range[0], start:end] = 1
+            for start, end in pedals.get(channel, ()):
+                channel_roll[:, start:end] = np.maximum.accumulate(channel_roll[:, start:end], axis=1)
+            roll |= channel_roll
+    return roll.astype(np.float32)
+
+
+def midi_chunks(data):
+    # (ticks per beat, the MTrk chunks) of a standard midi file, the chunks are located from their headers and
+    # decoded later by midi_events
+    if data[:4] != b'MThd' or len(data) < 14:
+        raise InputError('Could not read the MIDI file')
+    resolution = int.from_bytes(data[12:14], 'big')
+    tracks = []
+    position = 8 + int.from_bytes(data[4:8], 'big')
+    while position + 8 <= len(data):
+        length = int.from_bytes(data[position + 4:position + 8], 'big')
+        if data[position:position + 4] == b'MTrk':
+            tracks.append(data[position + 8:position + 8 + length])
+        position += 8 + length
+    if resolution == 0 or not tracks:
+        raise InputError('Could not read the MIDI file')
+    return resolution, tracks
+
+
+def midi_events(track):
+    # yields (delta ticks, status, first data byte, second data byte) as the track is read, (delta, 0xff, meta type,
+    # payload) for meta events and (delta, 0xf0, None, None) for sysex. data bytes missing from a message are None
+    position, running_status, end = 0, None, len(track)
+    try:
+        while position < end:
+            delta, position = read_variable_length(track, position)
+            status = track[position]
+            if status < 0x80:
+                if running_status is None:
+                    raise InputError('Could not read the MIDI file')
+                status = running_status
+            else:
+                position += 1
+                if status != 0xff:
+                    running_status = status
+
+            if status == 0xff:
+                meta_type = track[position]
+                length, position = read_variable_length(track, position + 1)
+                yield delta, status, meta_type, track[position:position + length]
+                position += length
+            elif status in (0xf0, 0xf7):
+                length, position = read_variable_length(track, position)
+                position += length
+                yield delta, 0xf0, None, None
+            else:
+                size = MIDI_DATA_BYTES.get(status & 0xf0 if status < 0xf0 else status, 0)
+                values = track[position:position + size]
+                if len(values) < size or any(value >= 0x80 for value in values):
+                    raise InputError('Could not read the MIDI file')
+                position += size
+                yield (delta, status) + tuple(values) + (None,) * (2 - size)
+    except IndexError:
+        raise InputError('Could not read the MIDI file') from None
+
+
+def read_variable_length(data, position):
+    # a midi variable length quantity at position, returns (value, position after it)
+    value = 0
+    for _ in range(4):
+        byte = data[position]
+        position += 1
+        value = (value << 7) | (byte & 0x7f)
+        if byte < 0x80:
+            return value, position
+    raise InputError('Could not read the MIDI file')
+
+
+def midi_tempo_changes(track, resolution, seconds):
+    # (tick, seconds at that tick, seconds per tick) from the set_tempo events of the first track up to seconds in,
+    # as pretty_midi reads them
+    changes = [(0, 0.0, 60.0 / (120.0 * resolution))]
+    tick = 0
+    for delta, status, meta_type, payload in midi_events(track):
+        tick += delta
+        last_tick, last_seconds, last_scale = changes[-1]
+        if last_seconds + (tick - last_tick) * last_scale >= seconds:
+            break
+        if status != 0xff or meta_type != MIDI_SET_TEMPO or len(payload) != 3:
+            continue
+        tempo = int.from_bytes(payload, 'big')
+        if tempo == 0:
+            continue
+        tick_scale = 60.0 / ((6e7 / tempo) * resolution)
+        if tick == 0:
+            changes = [(0, 0.0, tick_scale)]
+        elif tick_scale != last_scale:
+            changes.append((tick, last_seconds + (tick - last_tick) * last_scale, tick_scale))
+    return changes
+
+
+def read_bytes(file):
+    if hasattr(file, 'read'):
+        return file.read()
+    with open(file, 'rb') as opened:
+        return opened.read()
+
+
+def load_from_pianoroll(file, shape=ROLL_SHAPE, track_index=0, pitch_range=(0, 72), max_decoded_bytes=64 * 1024 * 1024):
+    # a pypianoroll npz (pypianoroll.save), read from its sparse (time, 128) components without building the dense
+    # roll of the whole track
+    name = f'pianoroll_{track_index}_csc'
+    try:
+        with np.load(file, allow_pickle=False) as loaded:
+            members = [f'{name}_{part}' for part in ('data', 'indices', 'indptr', 'shape')]
+            if any(member not in loaded.files for member in members):
+                raise InputError('Expected a pianoroll saved by pypianoroll')
+            if sum(loaded.zip.getinfo(member + '.npy').file_size for member in members) > max_decoded_bytes:
+                raise InputError('The pianoroll is too large')
+            data, indices, indptr, roll_shape = (loaded[member] for member in members)
+    except InputError:
+        raise
+    except Exception as e:
+        raise InputError('Could not read the pianoroll') from e
+
+    if (roll_shape.shape != (2,) or len(indptr) != roll_shape[1] + 1 or indptr[0] != 0 or np.any(np.diff(indptr) < 0)
+            or indptr[-1] != len(indices) or len(indices) != len(data)):
+        raise InputError('Could not read the pianoroll')
+    pitches = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    keep = ((data > 0) & (indices >= 0) & (indices < shape[1])
+            & (pitches >= pitch_range[0]) & (pitches < pitch_range[1]))
+    roll = np.zeros((pitch_range[1] - pitch_range[0], shape[1]), dtype=np.float32)
+    roll[pitches[keep] - pitch_range[0], indices[keep]] = 1
+    return roll
+
+
+def load_from_array(file, shape=ROLL_SHAPE, pitch_range=(0, 72)):
+    # a (pitch, time) roll, either with the model's pitch rows or all 128 midi pitches, binarized. npy isn't
+    # compressed so the upload size already bounds it
+    try:
+        array = np.load(file, allow_pickle=False)
+    except Exception as e:
+        raise InputError('Could not read the array') from e
+    array = np.squeeze(array)
+    if array.dtype.kind not in 'biuf' or array.ndim != 2 or array.shape[0] not in (shape[0], 128):
+        raise InputError(f'Expected a numeric ({shape[0]}, time) or (128, time) array')
+    if array.shape[0] == 128:
+        array = array[pitch_range[0]:pitch_range[1]]
+    return fit_steps((array[:, :shape[1]] > 0).astype(np.float32), shape[1])
+
+
+def fit_steps(roll, steps):
+    # crops or zero pads the time axis to steps
+    if roll.shape[1] >= steps:
+        return roll[:, :steps]
+    return np.pad(roll, ((0, 0), (0, steps - roll.shape[1])))
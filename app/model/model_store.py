@@ -0,0 +1,192 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+
+MODEL_FILENAME = 'model.keras'
+META_FILENAME = 'meta.json'
+
+logger = logging.getLogger(__name__)
+
+
+class ModelUnavailable(Exception):
+    pass
+
+
+class AzureBlobBackend:
+    def __init__(self, connection_string, container_name):
+        from azure.storage.blob import BlobServiceClient
+        self.container_client = BlobServiceClient.from_connection_string(connection_string) \
+            .get_container_client(container_name)
+
+    def fingerprint(self, blob_name):
+        # (version, md5 hex or None), the version is the blob's ETag
+        properties = self.container_client.get_blob_client(blob_name).get_blob_properties()
+        content_md5 = properties.content_settings.content_md5
+        return properties.etag.strip('"'), bytes(content_md5).hex() if content_md5 else None
+
+    def download(self, blob_name, file):
+        self.container_client.get_blob_client(blob_name).download_blob().readinto(file)
+
+
+class LocalDirBackend:
+    # serves blobs from a plain directory, for tests and machines without Azure access
+    def __init__(self, root):
+        self.root = root
+
+    def fingerprint(self, blob_name):
+        stat = os.stat(os.path.join(self.root, blob_name))
+        return f'{stat.st_size:x}-{stat.st_mtime_ns:x}', None
+
+    def download(self, blob_name, file):
+        with open(os.path.join(self.root, blob_name), 'rb') as source:
+            shutil.copyfileobj(source, file, 1024 * 1024)
+
+
+class ModelStore:
+    # on-disk cache of model files under cache_dir/<blob name>/<version>/, a version directory only
+    # counts once its meta.json is written, so a crashed download is never picked up
+    def __init__(self, backend, cache_dir, offline=False, keep_versions=2, verify=True):
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.keep_versions = keep_versions
+        self.verify = verify  # re-hash cached files before using them
+
+    def fetch(self, blob_name):
+        # returns the path of an up to date local copy of blob_name
+        blob_dir = os.path.join(self.cache_dir, _safe_name(blob_name))
+        os.makedirs(blob_dir, exist_ok=True)
+
+        # one worker downloads while the others wait and then find it in the cache
+        with _file_lock(blob_dir + '.lock'):
+            if self.offline or self.backend is None:
+                return self._latest(blob_name, blob_dir)
+
+            try:
+                version, md5 = self.backend.fingerprint(blob_name)
+            except Exception as e:
+                logger.warning(f"Couldn't reach the model store for {blob_name} ({e}), using the cached copy",
+                               extra={'blob_name': blob_name, 'error': str(e)})
+                return self._latest(blob_name, blob_dir)
+
+            version_dir = os.path.join(blob_dir, _safe_name(version))
+            path = self._cached(version_dir)
+            if path is None:
+                path = self._download(blob_name, version, md5, version_dir)
+            self._prune(blob_dir, keep=version_dir)
+            return path
+
+    def _download(self, blob_name, version, md5, version_dir):
+        started_at = time.perf_counter()
+        if os.path.exists(version_dir):
+            shutil.rmtree(version_dir)
+        staging_dir = tempfile.mkdtemp(prefix='.download-', dir=os.path.dirname(version_dir))
+        try:
+            path = os.path.join(staging_dir, MODEL_FILENAME)
+            with open(path, 'wb') as file:
+                self.backend.download(blob_name, file)
+            sha256, md5_hex = _file_digests(path)
+            if md5 is not None and md5 != md5_hex:
+                raise ModelUnavailable(f'{blob_name} failed its MD5 check, expected {md5} got {md5_hex}')
+            _write_meta(staging_dir, {
+                'blob_name': blob_name,
+                'version': version,
+                'sha256': sha256,
+                'size': os.path.getsize(path),
+                'downloaded_at': time.time(),
+            })
+            os.replace(staging_dir, version_dir)
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        seconds = time.perf_counter() - started_at
+        logger.info(f"Downloaded {blob_name} ({version}) in {seconds:.1f}s",
+                    extra={'blob_name': blob_name, 'version': version, 'seconds': seconds})
+        return os.path.join(version_dir, MODEL_FILENAME)
+
+    def _cached(self, version_dir):
+        try:
+            with open(os.path.join(version_dir, META_FILENAME)) as file:
+                meta = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        path = os.path.join(version_dir, MODEL_FILENAME)
+        if not os.path.exists(path) or os.path.getsize(path) != meta['size']:
+            return None
+        if self.verify and _file_digests(path)[0] != meta['sha256']:
+            logger.warning(f"Cached {meta['blob_name']} ({meta['version']}) failed its checksum, downloading it again",
+                           extra={'blob_name': meta['blob_name'], 'version': meta['version']})
+            return None
+        return path
+
+    def _latest(self, blob_name, blob_dir):
+        # newest complete version, used offline or when the backend can't be reached
+        for version_dir in _versions(blob_dir):
+            path = self._cached(version_dir)
+            if path is not None:
+                return path
+        raise ModelUnavailable(f'No cached copy of {blob_name} in {blob_dir}')
+
+    def _prune(self, blob_dir, keep):
+        versions = [version_dir for version_dir in _versions(blob_dir) if version_dir != keep]
+        for version_dir in versions[max(self.keep_versions - 1, 0):]:
+            shutil.rmtree(version_dir, ignore_errors=True)
+        for name in os.listdir(blob_dir):
+            if name.startswith('.download-'):
+                shutil.rmtree(os.path.join(blob_dir, name), ignore_errors=True)
+
+
+def model_version(path):
+    # content hash of a model fetched by ModelStore, None for files that didn't come from its cache
+    try:
+        with open(os.path.join(os.path.dirname(path), META_FILENAME)) as file:
+            return json.load(file)['sha256']
+    except (FileNotFoundError, NotADirectoryError, ValueError, KeyError):
+        return None
+
+
+def _versions(blob_dir):
+    # complete version directories, newest first
+    versions = []
+    for name in os.listdir(blob_dir):
+        meta_path = os.path.join(blob_dir, name, META_FILENAME)
+        if not name.startswith('.') and os.path.exists(meta_path):
+            versions.append((os.path.getmtime(meta_path), os.path.join(blob_dir, name)))
+    return [version_dir for _, version_dir in sorted(versions, reverse=True)]
+
+
+def _write_meta(directory, meta):
+    with open(os.path.join(directory, META_FILENAME), 'w') as file:
+        json.dump(meta, file)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def _file_digests(path):
+    sha256, md5 = hashlib.sha256(), hashlib.md5()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            sha256.update(chunk)
+            md5.update(chunk)
+    return sha256.hexdigest(), md5.hexdigest()
+
+
+def _safe_name(name):
+    return re.sub(r'[^A-Za-z0-9._-]', '_', name)
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    with open(path, 'a') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
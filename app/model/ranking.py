@@ -0,0 +1,84 @@
+import logging
+import numpy as np
+from .scoring import POLYPHONY, SCALE_CONSISTENCY, PITCH_ENTROPY, DISSONANCE_RATE, PITCH_IN_SCALE_RATE
+
+LOWER_IS_BETTER = 'min'
+HIGHER_IS_BETTER = 'max'
+
+# metric column -> direction, the equal weights ranking used by find_best_sample
+DEFAULT_DIRECTIONS = {
+    POLYPHONY: LOWER_IS_BETTER,
+    SCALE_CONSISTENCY: HIGHER_IS_BETTER,
+    PITCH_ENTROPY: LOWER_IS_BETTER,
+    DISSONANCE_RATE: LOWER_IS_BETTER,
+}
+IN_SCALE_THRESHOLDS = (0.80, 0.70)  # only take tracks above 80% in scale rate, expanding to 70% if none are
+
+logger = logging.getLogger(__name__)
+
+
+def top_order(values, top_n=100, direction=LOWER_IS_BETTER):
+    # stable so ties keep candidate order, NaN always sorts last
+    if direction == HIGHER_IS_BETTER:
+        values = -values
+    if top_n < len(values):
+        # only the candidates up to the top_n-th value need sorting, ties past the cutoff still fall in candidate order
+        kth = np.partition(values, top_n - 1)[top_n - 1]
+        if not np.isnan(kth):
+            candidates = np.flatnonzero(values <= kth)
+            return candidates[np.argsort(values[candidates], kind='stable')][:top_n]
+    return np.argsort(values, kind='stable')[:top_n]
+
+
+def top_ranks(values, top_n=100, direction=LOWER_IS_BETTER):
+    # position inside the top_n, candidates outside it all get len(values)
+    order = top_order(values, top_n, direction)
+    ranks = np.full(len(values), len(values), dtype=np.int64)
+    ranks[order] = np.arange(len(order))
+    return ranks
+
+
+def aggregate_ranks(scores, directions=None, weights=None, top_n=100):
+    if directions is None:
+        directions = DEFAULT_DIRECTIONS
+    columns = list(directions)
+    ranks = np.stack([top_ranks(scores[:, column], top_n, directions[column]) for column in columns], axis=1)
+    if weights is None:
+        return ranks.mean(axis=1)
+    return np.average(ranks, axis=1, weights=[weights.get(column, 1.0) for column in columns])
+
+
+def penalise_polyphony(scores):
+    scores = scores.copy()
+    polyphony = scores[:, POLYPHONY]
+    # As I want constant notes, there should always be one note playing
+    scores[:, POLYPHONY] = np.where(polyphony >= 1, polyphony, 10)
+    return scores
+
+
+def in_scale_candidates(scale_scores, top_n=100, thresholds=IN_SCALE_THRESHOLDS):
+    top_in_scale_rate = top_order(scale_scores, top_n, HIGHER_IS_BETTER)
+    for threshold in thresholds:
+        filtered = top_in_scale_rate[scale_scores[top_in_scale_rate] > threshold]
+        if len(filtered):
+            return filtered
+    return top_in_scale_rate
+
+
+def rank_least_dissonant(scores, top_n=100):
+    top_dissonance = top_order(scores[:, DISSONANCE_RATE], top_n, LOWER_IS_BETTER)
+    best_track_index = int(top_dissonance[0])
+    logger.info(f"Best track found: Index {best_track_index}", extra={'index': best_track_index, 'candidates': len(scores)})
+    return best_track_index, top_dissonance
+
+
+def rank_best_sample(scores, use_scale=False, directions=None, weights=None, top_n=100):
+    average_ranks = aggregate_ranks(penalise_polyphony(scores), directions, weights, top_n)
+    if use_scale:
+        eligible = np.zeros(len(scores), dtype=bool)
+        eligible[in_scale_candidates(scores[:, PITCH_IN_SCALE_RATE], top_n)] = True
+        average_ranks = np.where(eligible, average_ranks, np.inf)
+
+    best_track_index = int(np.argmin(average_ranks))
+    logger.info(f"Best track found: Index {best_track_index}", extra={'index': best_track_index, 'candidates': len(scores)})
+    return best_track_index
@@ -0,0 +1,117 @@
+import numpy as np
+from ..metrics import timed
+
+# column order of the score matrix, PITCH_IN_SCALE_RATE is only added when a scale is requested
+POLYPHONY = 0
+SCALE_CONSISTENCY = 1
+PITCH_ENTROPY = 2
+DISSONANCE_RATE = 3
+PITCH_IN_SCALE_RATE = 4
+METRICS = ('polyphony', 'scale_consistency', 'pitch_entropy', 'dissonance_rate', 'pitch_in_scale_rate')
+
+DISSONANT_INTERVALS = (1, 2, 6, 10, 11)
+MODES = ('major', 'minor')
+C_SCALES = {
+    'major': np.array([1, 0, 1, 0, 1, 1, 0, 1, 0, 1, 0, 1], bool),
+    'minor': np.array([1, 0, 1, 1, 0, 1, 0, 1, 1, 0, 1, 0], bool),
+}
+
+
+def scale_mask(root, mode):
+    return np.roll(C_SCALES[mode.lower()], root % 12)
+
+
+def all_scale_masks():
+    # (24, 12), every major root followed by every minor root, same order muspy.scale_consistency walks
+    return np.array([scale_mask(root, mode) for mode in MODES for root in range(12)])
+
+
+def scale_column(root, mode):
+    # column of a scale in the all_scale_masks / scale_index order
+    mode = mode.lower()
+    if mode not in MODES:
+        raise ValueError("`mode` must be either 'major' or 'minor'.")
+    return MODES.index(mode) * 12 + root % 12
+
+
+def scale_index(pitch_classes):
+    # (batch, 24) pitch-in-scale rate for every root and mode, computed once per generated batch
+    return in_scale_rates(pitch_classes, all_scale_masks())
+
+
+def compute_scores(images, notes, scale=None):
+    # images is the (batch, pitch, time) roll the flat NOTE_DTYPE notes were taken from
+    batch_size = len(images)
+    with timed('score_pitch_histogram'):
+        pitch_histograms = pitch_histogram(notes, batch_size)
+    columns = []
+    with timed('score_polyphony'):
+        columns.append(polyphony(images))
+    with timed('score_scale_consistency'):
+        columns.append(scale_consistency(pitch_histograms))
+    with timed('score_pitch_entropy'):
+        columns.append(pitch_entropy(pitch_histograms))
+    with timed('score_dissonance_rate'):
+        columns.append(dissonance_rate(notes, batch_size))
+    if scale is not None:
+        with timed('score_pitch_in_scale_rate'):
+            columns.append(pitch_in_scale_rate(pitch_histograms, scale[0], scale[1]))
+    return np.stack(columns, axis=1)
+
+
+def polyphony(images):
+    pitches_on = images.sum(axis=(1, 2), dtype=np.float64)
+    active_steps = images.any(axis=1).sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(active_steps > 0, pitches_on / active_steps, np.nan)
+
+
+def pitch_histogram(notes, batch_size):
+    # note counts per MIDI pitch, (batch, 128)
+    flat = notes['index'].astype(np.int64) * 128 + notes['pitch']
+    return np.bincount(flat, minlength=batch_size * 128).reshape(batch_size, 128).astype(np.float64)
+
+
+def pitch_class_histogram(pitch_histograms):
+    padded = np.zeros((len(pitch_histograms), 132))
+    padded[:, :128] = pitch_histograms
+    return padded.reshape(-1, 11, 12).sum(axis=1)
+
+
+def in_scale_rates(pitch_classes, masks):
+    # (batch, len(masks)) pitch-in-scale rate against every mask, NaN where a candidate has no notes
+    note_counts = pitch_classes.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(note_counts > 0, (pitch_classes @ masks.T) / note_counts, np.nan)
+
+
+def pitch_in_scale_rate(pitch_histograms, root, mode):
+    return in_scale_rates(pitch_class_histogram(pitch_histograms), scale_mask(root, mode)[np.newaxis])[:, 0]
+
+
+def scale_consistency(pitch_histograms):
+    return in_scale_rates(pitch_class_histogram(pitch_histograms), all_scale_masks()).max(axis=1)
+
+
+def pitch_entropy(pitch_histograms):
+    note_counts = pitch_histograms.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        prob = pitch_histograms / note_counts
+        entropy = -np.nansum(prob * np.log2(prob), axis=1)
+    return np.where(note_counts[:, 0] > 0, entropy, np.nan)
+
+
+def dissonance_rate(notes, batch_size):
+    # intervals between consecutive onsets, ties on onset keep the note order like sorted() does
+    order = np.lexsort((notes['time'], notes['index']))
+    index = notes['index'][order]
+    pitch = notes['pitch'][order]
+
+    same_track = index[1:] == index[:-1]
+    intervals = np.abs(np.diff(pitch)) % 12
+    dissonant = same_track & np.isin(intervals, DISSONANT_INTERVALS)
+
+    total = np.bincount(index[1:][same_track], minlength=batch_size)
+    dissonant_count = np.bincount(index[1:][dissonant], minlength=batch_size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total > 0, dissonant_count / total, 0.0)
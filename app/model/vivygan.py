@@ -1,136 +1,359 @@
+import logging
 import os
+import time
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '1'
-import muspy
 import numpy as np
-import tensorflow as tf
-from keras.preprocessing.image import load_img, img_to_array
-import pretty_midi
-from pypianoroll import Multitrack, Track
 from PIL import Image
-import matplotlib.pyplot as plt
-
+from .scoring import compute_scores, pitch_histogram, pitch_class_histogram, scale_index, scale_column, POLYPHONY, SCALE_CONSISTENCY, PITCH_ENTROPY, DISSONANCE_RATE, PITCH_IN_SCALE_RATE
+from .ranking import rank_best_sample, rank_least_dissonant
+from ..metrics import timed
+
+
+CUT_NOTES_PERCENTAGE = 60
+ROLL_SHAPE = (72, 384)  # (pitch, time) of a generated roll
+
+logger = logging.getLogger(__name__)
+
+
+def generate_random(generator, batch_size=500, latent_dim=100, choose_arbitrary=False, scale=None, shift_pitch=False, cut_notes=False, equal_weights=False, least_dissonant=False, pool=None, cascade=None, budget=None, controller=None, rng=None):
+    # with a budget (seconds) and a BatchSizeController, candidates are generated in chunks until the budget runs out
+    # instead of as one batch_size batch, the arbitrary pick is the unfiltered baseline and never adapts.
+    # rng (a np.random.Generator) makes the noise reproducible, callers wanting a deterministic result also leave out
+    # the pool and the budget, whose candidates depend on timing
+    adaptive = budget is not None and controller is not None and not choose_arbitrary
+    started_at = time.monotonic()
+    candidates = None
+    if pool is not None:
+        with timed('pool_take'):
+            candidates = pool.take(batch_size, cut_notes=cut_notes)
+    if candidates is None and adaptive:
+        candidates = generate_within_budget(generator, started_at + budget, controller, latent_dim, cut_notes, cascade)
+    elif candidates is None:
+        candidates = generate_candidates(generator, batch_size, latent_dim, rng)
+        if cut_notes:
+            with timed('cut_notes'):
+                candidates = candidates.cut(CUT_NOTES_PERCENTAGE)
+        if cascade is not None and not choose_arbitrary:
+            candidates, _ = cascade.apply(candidates)
+    elif adaptive:
+        candidates = generate_within_budget(generator, started_at + budget, controller, latent_dim, cut_notes, cascade,
+                                            candidates=candidates)
+
+    index_value = select_candidate(candidates, choose_arbitrary=choose_arbitrary, scale=scale, shift_pitch=shift_pitch,
+                                   equal_weights=equal_weights, least_dissonant=least_dissonant)
+    if index_value is None:
+        return None
+    with timed('convert_to_muspy'):
+        return candidates.music(index_value)
+
+
+def generate_selections(generator, selections, batch_size=500, latent_dim=100, pool=None, cascade=None, rng=None):
+    # one music object per selection, a selection being the generate_random flags of a strategy. candidates are
+    # generated (or taken from the pool) once and scored once per cut_notes setting, every selection ranks that
+    # shared score matrix. selections picking the same candidate get the same music object back
+    generated = None
+    pooled = {}
+    views = {}
+    winners = {}
+    music_objects = []
+    for flags in selections:
+        flags = dict(flags)
+        cut_notes = flags.pop('cut_notes', False)
+        # as in generate_random, pool candidates are used as they are and fresh ones are filtered unless the pick is
+        # the arbitrary baseline
+        if pool is not None and cut_notes not in pooled:
+            with timed('pool_take'):
+                pooled[cut_notes] = pool.take(batch_size, cut_notes=cut_notes)
+        if pooled.get(cut_notes) is not None:
+            key = (cut_notes, 'pool')
+            views[key] = pooled[cut_notes]
+        else:
+            filtered = cascade is not None and not flags.get('choose_arbitrary', False)
+            key = (cut_notes, filtered)
+        if key not in views:
+            if generated is None:
+                generated = generate_candidates(generator, batch_size, latent_dim, rng)
+            candidates = generated
+            if cut_notes:
+                with timed('cut_notes'):
+                    candidates = candidates.cut(CUT_NOTES_PERCENTAGE)
+            if filtered:
+                candidates, _ = cascade.apply(candidates)
+            views[key] = candidates
+
+        index_value = select_candidate(views[key], **flags)
+        if index_value is None:
+            music_objects.append(None)
+            continue
+        if (key, index_value) not in winners:
+            with timed('convert_to_muspy'):
+                winners[key, index_value] = views[key].music(index_value)
+        music_objects.append(winners[key, index_value])
+    return music_objects
+
+
+def generate_within_budget(generator, deadline, controller, latent_dim=100, cut_notes=False, cascade=None, candidates=None):
+    # deadline is a time.monotonic() value. chunks are scored as they arrive and ranked together at the end, ranks are
+    # relative so that gives the same pick as keeping a running best. there is always at least one chunk to rank
+    batches = [] if candidates is None else [candidates]
+    searched = 0
+    while True:
+        chunk_size = controller.chunk_size(deadline - time.monotonic())
+        if chunk_size == 0:
+            if batches:
+                break
+            chunk_size = controller.min_batch_size
+
+        chunk_started_at = time.perf_counter()
+        chunk = generate_candidates(generator, chunk_size, latent_dim)
+        if cut_notes:
+            with timed('cut_notes'):
+                chunk = chunk.cut(CUT_NOTES_PERCENTAGE)
+        if cascade is not None:
+            chunk, _ = cascade.apply(chunk)
+        chunk.score()
+        controller.record(chunk_size, time.perf_counter() - chunk_started_at)
+        batches.append(chunk)
+        searched += chunk_size
+
+    controller.record_request(searched + (0 if candidates is None else len(candidates)))
+    return batches[0] if len(batches) == 1 else CandidateBatch.concatenate(batches)
+
+
+def generate_candidates(generator, batch_size=500, latent_dim=100, rng=None):
+    with timed('noise'):
+        noise = generate_noise(batch_size, latent_dim, rng)
+    with timed('predict'):
+        generated_images = generator.predict(noise)
+    with timed('remove_short_notes'):
+        binarized_images = binarize_generated(generated_images)
+        prepared_images = remove_short_notes_batch(np.squeeze(binarized_images, axis=-1))
+    with timed('extract_notes'):
+        notes = pianoroll_to_notes(prepared_images)
+    return CandidateBatch(notes, batch_size, images=prepared_images)
+
+
+def select_candidate(candidates, choose_arbitrary=False, scale=None, shift_pitch=False, equal_weights=False, least_dissonant=False):
+    if len(candidates) == 0:
+        raise ValueError('No candidates to select from.')
+    if choose_arbitrary:
+        # a pool or budget batch can be smaller than the fixed pick
+        return min(6, len(candidates) - 1)
 
-def generate_random(generator, batch_size=500, latent_dim=100, choose_arbitrary=False, scale=None, shift_pitch=False, cut_notes=False, equal_weights=False, least_dissonant=False):
-    noise = generate_noise(batch_size, latent_dim)
-    generated_images = generator.predict(noise)
-    binarized_images = (generated_images != 0).astype(int)
+    scores = candidates.scores_for(scale)
+    with timed('rank'):
+        return rank_candidates(scores, scale=scale, shift_pitch=shift_pitch, equal_weights=equal_weights,
+                               least_dissonant=least_dissonant)
 
-    track_array = []
-    muspy_music_objects = []
-    for i in range(batch_size):
-        prepared_image = np.squeeze(binarized_images[i], axis=-1)
-        prepared_image = remove_short_notes(prepared_image).T
-        track_array.append(prepared_image)
-        music = convert_to_muspy_class(prepared_image)
-        if cut_notes:
-            music = remove_lowest_notes_by_percentage(music, 60)
-        muspy_music_objects.append(music)
 
-    if choose_arbitrary:
-        return muspy_music_objects[6]
-    elif scale is not None:
-        generated_track, index_value = find_best_sample(muspy_music_objects, scale=scale)
-        return generated_track
+def rank_candidates(scores, scale=None, shift_pitch=False, equal_weights=False, least_dissonant=False):
+    if scale is not None:
+        return rank_best_sample(scores, use_scale=True)
     elif shift_pitch:
         # function to shift the pitch rather than the muspy pitch function
         return None
     elif equal_weights and least_dissonant:
-        _, _, top_dissonant = find_least_dissonant(muspy_music_objects)
-        generated_track, index_value = find_best_sample(top_dissonant)
-        return generated_track
+        _, top_dissonant = rank_least_dissonant(scores)
+        return top_dissonant[rank_best_sample(scores[top_dissonant])]
     elif equal_weights:
-        generated_track, index_value = find_best_sample(muspy_music_objects)
-        return generated_track
-    elif least_dissonant:
-        generated_track, index_value, top_dissonant = find_least_dissonant(muspy_music_objects)
-        return generated_track
-    else:
-        generated_track, index_value, top_dissonant = find_least_dissonant(muspy_music_objects)
-    return generated_track
-
-
-def generate_random_variations(generator, file_path, batch_size=10):
-    if file_path.lower().endswith(('.png', '.jpg', '.jpeg')):
-        original = load_from_png(file_path)
-    elif file_path.lower().endswith(('.mid', '.midi')):
-        original = load_from_midi(file_path)
-    elif file_path.lower().endswith(('.npz', '.npy')):
-        original = load_from_pianoroll(file_path)
-
-    music_array = []
-    outputs = []
-    for i in range(batch_size):
-        noise = original + np.random.normal(0, 0.1, original.shape)
-        generated_image = generator.predict(noise[np.newaxis, :])
-        binarized_image = (generated_image > 0.5).astype(np.float32)
-        prepared_image = np.squeeze(binarized_image, axis=-1)
-        prepared_image = np.squeeze(prepared_image)
-        prepared_image = remove_short_notes(prepared_image).T
-        music_array.append(prepared_image)
-        music = convert_to_muspy_class(prepared_image)
-        outputs.append(music)
-    # save_imgs(music_array, file_name='variation')
+        return rank_best_sample(scores)
+    index_value, top_dissonant = rank_least_dissonant(scores)
+    return index_value
+
+
+class CandidateBatch:
+    # post-processed candidates kept as one flat NOTE_DTYPE array, the roll is dropped once scored
+    def __init__(self, notes, size, images=None):
+        self.notes = notes
+        self.size = size
+        self.images = images
+        self.scores = None
+        self.scale_rates = None
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        arrays = (self.notes, self.images, self.scores, self.scale_rates)
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def score(self):
+        if self.scores is None:
+            images = self.images
+            if images is None:
+                images = notes_to_pianoroll(self.notes, (self.size,) + ROLL_SHAPE)
+            self.scores = compute_scores(images, self.notes)
+            with timed('score_scale_index'):
+                self.scale_rates = scale_index(pitch_class_histogram(pitch_histogram(self.notes, self.size)))
+            self.images = None
+        return self.scores
+
+    def scores_for(self, scale=None):
+        scores = self.score()
+        if scale is None:
+            return scores
+        return np.column_stack((scores, self.scale_rates[:, scale_column(scale[0], scale[1])]))
+
+    def cut(self, percentage):
+        notes = remove_lowest_notes_by_percentage_batch(self.notes, percentage)
+        images = None if self.images is None else notes_to_pianoroll(notes, self.images.shape, dtype=np.uint8)
+        return CandidateBatch(notes, self.size, images=images)
+
+    def take(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        remap = np.full(self.size, -1, dtype=np.int64)
+        remap[indices] = np.arange(len(indices))
+        new_index = remap[self.notes['index']]
+        keep = new_index >= 0
+
+        notes = self.notes[keep]
+        notes['index'] = new_index[keep]
+        notes = notes[np.argsort(notes['index'], kind='stable')]
+
+        batch = CandidateBatch(notes, len(indices), images=None if self.images is None else self.images[indices])
+        if self.scores is not None:
+            batch.scores = self.scores[indices]
+            batch.scale_rates = self.scale_rates[indices]
+        return batch
+
+    def music(self, index):
+        start, end = np.searchsorted(self.notes['index'], [index, index + 1])
+        return notes_to_muspy_class(self.notes[start:end])
+
+    @staticmethod
+    def concatenate(batches):
+        # batches are expected to be scored, as the candidate pool keeps them
+        offsets = np.cumsum([0] + [len(batch) for batch in batches[:-1]])
+        notes = np.concatenate([batch.notes for batch in batches])
+        notes['index'] += np.repeat(offsets, [len(batch.notes) for batch in batches]).astype(np.int32)
+        combined = CandidateBatch(notes, sum(len(batch) for batch in batches))
+        combined.scores = np.concatenate([batch.score() for batch in batches])
+        combined.scale_rates = np.concatenate([batch.scale_rates for batch in batches])
+        return combined
+
+
+def generate_random_variations(generator, original, batch_size=10, rng=None):
+    # original is the (pitch, time) roll from ingest.load_input
+    with timed('noise'):
+        noise = variation_noise(original, batch_size, rng)
+    with timed('predict'):
+        generated_images = generator.predict(noise, batch_size=batch_size)
+    with timed('remove_short_notes'):
+        binarized_images = binarize_variations(generated_images)
+        prepared_images = remove_short_notes_batch(np.squeeze(binarized_images, axis=-1))
+
+    with timed('extract_notes'):
+        candidate_notes = split_notes(pianoroll_to_notes(prepared_images), batch_size)
+    with timed('convert_to_muspy'):
+        outputs = [notes_to_muspy_class(track_notes) for track_notes in candidate_notes]
+    # save_imgs(prepared_images, file_name='variation')
     return outputs
 
 
-def generate_noise(batch_size, latent_dim):
-    return np.random.normal(0, 1, (batch_size, latent_dim))
+def generate_noise(batch_size, latent_dim, rng=None):
+    return (rng or np.random).normal(0, 1, (batch_size, latent_dim))
+
+
+def variation_noise(original, batch_size, rng=None):
+    # float32 like the model, the same draws as before so seeded variations don't change
+    noise = (rng or np.random).normal(0, 0.1, (batch_size,) + original.shape).astype(np.float32)
+    noise += original
+    return noise
+
+
+def binarize_generated(images):
+    return (images != 0).astype(np.uint8)
+
+
+def binarize_variations(images):
+    return (images > 0.5).astype(np.float32)
+
+
+NOTE_DTYPE = np.dtype([('index', np.int32), ('pitch', np.int32), ('time', np.int32), ('duration', np.int32)])
 
 
 def convert_to_muspy_class(track_array, time_unit=1, pitch_offset=24):
+    notes = pianoroll_to_notes(np.asarray(track_array).T[np.newaxis], pitch_offset=pitch_offset)
+    return notes_to_muspy_class(notes, time_unit=time_unit)
+
+
+def pianoroll_to_notes(images, pitch_offset=24):
+    # images is (batch, pitch, time), returns one flat NOTE_DTYPE array for the whole batch
+    active = images == 1
+    padded = np.zeros(active.shape[:-1] + (active.shape[-1] + 2,), dtype=np.int8)
+    padded[..., 1:-1] = active
+    edges = np.diff(padded, axis=-1)
+
+    starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)
+
+    notes = np.empty(len(starts[0]), dtype=NOTE_DTYPE)
+    notes['index'] = starts[0]
+    notes['pitch'] = starts[1] + pitch_offset
+    notes['time'] = starts[2]
+    notes['duration'] = ends[2] - starts[2]
+
+    # same order convert_to_muspy_class used to append in: by note end, then pitch
+    order = np.lexsort((notes['pitch'], ends[2], notes['index']))
+    return notes[order]
+
+
+def notes_to_pianoroll(notes, shape, pitch_offset=24, dtype=int):
+    # inverse of pianoroll_to_notes, shape is the (batch, pitch, time) roll shape
+    marks = np.zeros(shape[:-1] + (shape[-1] + 1,), dtype=np.int8)
+    pitch = notes['pitch'] - pitch_offset
+    marks[notes['index'], pitch, notes['time']] = 1
+    marks[notes['index'], pitch, notes['time'] + notes['duration']] = -1
+    return np.cumsum(marks, axis=-1, dtype=np.int8)[..., :-1].astype(dtype)
+
+
+def split_notes(notes, batch_size):
+    boundaries = np.searchsorted(notes['index'], np.arange(1, batch_size))
+    return np.split(notes, boundaries)
+
+
+def notes_to_muspy_class(notes, time_unit=1):
+    import muspy  # muspy pulls in music21, pypianoroll and matplotlib, so it's only imported once music is built
     music = muspy.Music()
     track = muspy.Track(program=0, is_drum=False)
-    note_start_times = [-1] * len(
-        track_array[0])
-
-    for time, pitch_row in enumerate(track_array):
-        for pitch, active in enumerate(pitch_row):
-            current_pitch = pitch + pitch_offset
-            if active == 1 and note_start_times[pitch] == -1:
-                note_start_times[pitch] = time
-            elif active == 0 and note_start_times[pitch] != -1:
-                duration = time - note_start_times[pitch]
-                note = muspy.Note(
-                    pitch=current_pitch,
-                    time=note_start_times[pitch] * time_unit,
-                    duration=duration * time_unit,
-                    velocity=100
-                )
-                track.notes.append(note)
-                note_start_times[pitch] = -1
-
-    for pitch, start_time in enumerate(note_start_times):
-        if start_time != -1:
-            duration = len(track_array) - start_time
-            note = muspy.Note(
-                pitch=pitch + pitch_offset,
-                time=start_time * time_unit,
-                duration=duration * time_unit,
-                velocity=100
-            )
-            track.notes.append(note)
+    for pitch, time, duration in zip(notes['pitch'].tolist(), notes['time'].tolist(), notes['duration'].tolist()):
+        track.notes.append(muspy.Note(
+            pitch=pitch,
+            time=time * time_unit,
+            duration=duration * time_unit,
+            velocity=100
+        ))
     music.tracks.append(track)
     return music
 
 
 def remove_short_notes(image, threshold=12):
-    for pitch in range(image.shape[0]):
-        active_note_start = None
-        for time_step in range(image.shape[1]):
-            if image[pitch, time_step] == 1 and active_note_start is None:
-                # note start
-                active_note_start = time_step
-            elif image[pitch, time_step] == 0 and active_note_start is not None:
-                # note end
-                if time_step - active_note_start < threshold:
-                    image[pitch, active_note_start:time_step] = 0
-                active_note_start = None
-        # last note
-        if active_note_start is not None and image.shape[1] - active_note_start < threshold:
-            image[pitch, active_note_start:] = 0
+    image[...] = remove_short_notes_batch(image[np.newaxis], threshold)[0]
     return image
 
 
+def remove_short_notes_batch(images, threshold=12):
+    # images is (batch, pitch, time), runs of 1s shorter than threshold are zeroed in one pass
+    active = images == 1
+    padded = np.zeros(active.shape[:-1] + (active.shape[-1] + 2,), dtype=np.int8)
+    padded[..., 1:-1] = active
+    edges = np.diff(padded, axis=-1)
+
+    # starts and ends alternate along each row, so they pair up in nonzero order
+    starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)
+    short = (ends[-1] - starts[-1]) < threshold
+
+    # +1 at the start and -1 at the end of every short run, cumsum marks the run
+    marks = np.zeros(edges.shape, dtype=np.int8)
+    marks[tuple(axis[short] for axis in starts)] = 1
+    marks[tuple(axis[short] for axis in ends)] = -1
+    remove = np.cumsum(marks, axis=-1, dtype=np.int8)[..., :-1].astype(bool)
+
+    return np.where(remove, 0, images)
+
+
 def remove_notes_below_C2(music):
     C2_MIDI_NUMBER = 48
     for track in music.tracks:
@@ -148,91 +371,50 @@ def remove_lowest_notes_by_percentage(music, percentage):
     return music
 
 
-def find_least_dissonant(tracks):
-    dissonance_scores = {}
+def remove_lowest_notes_by_percentage_batch(notes, percentage):
+    # notes is a flat NOTE_DTYPE array, the lowest notes are dropped per candidate
+    counts = np.bincount(notes['index'])
+    number_to_remove = (counts * (percentage / 100.0)).astype(int)
 
-    for i, track in enumerate(tracks):
-        dissonance_scores[i] = dissonance_rate(track)
+    by_pitch = np.lexsort((notes['pitch'], notes['index']))
+    first = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    rank = np.empty(len(notes), dtype=np.int64)
+    rank[by_pitch] = np.arange(len(notes)) - first[notes['index'][by_pitch]]
 
-    def get_top_scores(scores, top_n=100, reverse=False):
-        return dict(sorted(scores.items(), key=lambda item: item[1], reverse=reverse)[:top_n])
+    return notes[rank >= number_to_remove[notes['index']]]
 
-    top_dissonance = get_top_scores(dissonance_scores)  # lower is better
 
-    average_ranks = {}
-    for i in range(len(tracks)):
-        ranks = [
-            list(top_dissonance.keys()).index(i) if i in top_dissonance else len(tracks)
-        ]
-        average_ranks[i] = ranks
-
-    best_track_index = min(average_ranks, key=average_ranks.get)
-    print(f"Best track found: Index {best_track_index}")
-    top_dissonant_tracks = [tracks[i] for i in top_dissonance if i in top_dissonance]
+def find_least_dissonant(tracks, scores=None):
+    if scores is None:
+        scores = score_music_objects(tracks)
+    best_track_index, top_indices = rank_least_dissonant(scores)
+    top_dissonant_tracks = [tracks[i] for i in top_indices]
     return tracks[best_track_index], best_track_index, top_dissonant_tracks
 
 
-def find_best_sample(tracks, scale=None):
-    polyphony_scores, scale_consistency_scores, pitch_entropy_scores, dissonance_scores = {}, {}, {}, {}
-    scale_scores = {}
-    total_tracks = len(tracks)
-    print(f"Starting metrics calculation for {total_tracks} tracks.")
+def find_best_sample(tracks, scale=None, scores=None):
+    if scores is None:
+        scores = score_music_objects(tracks, scale=scale)
+    best_track_index = rank_best_sample(scores, use_scale=scale is not None)
+    return tracks[best_track_index], best_track_index
 
+
+def score_music_objects(tracks, scale=None):
+    import muspy
+    # reference path for muspy objects, generate_random scores the pianoroll batch with compute_scores
+    total_tracks = len(tracks)
+    logger.info(f"Starting metrics calculation for {total_tracks} tracks.", extra={'tracks': total_tracks})
+    scores = np.zeros((total_tracks, PITCH_IN_SCALE_RATE + 1 if scale is not None else PITCH_IN_SCALE_RATE))
     for i, track in enumerate(tracks):
         if i % 100 == 0:
-            print(f"Processing track {i + 1}/{total_tracks}...")
-        polyphony = muspy.polyphony(track)
-        if polyphony >= 1:
-            polyphony_scores[i] = polyphony
-        else:
-            polyphony_scores[i] = 10  # As I want constant notes, there should always be one note playing
-        scale_consistency_scores[i] = muspy.scale_consistency(track)
-        pitch_entropy_scores[i] = muspy.pitch_entropy(track)
-        dissonance_scores[i] = dissonance_rate(track)
+            logger.debug(f"Processing track {i + 1}/{total_tracks}...", extra={'track': i + 1, 'tracks': total_tracks})
+        scores[i, POLYPHONY] = muspy.polyphony(track)
+        scores[i, SCALE_CONSISTENCY] = muspy.scale_consistency(track)
+        scores[i, PITCH_ENTROPY] = muspy.pitch_entropy(track)
+        scores[i, DISSONANCE_RATE] = dissonance_rate(track)
         if scale is not None:
-            scale_scores[i] = muspy.pitch_in_scale_rate(track, scale[0], scale[1])
-
-    def get_top_scores(scores, top_n=100, reverse=False):
-        return dict(sorted(scores.items(), key=lambda item: item[1], reverse=reverse)[:top_n])
-
-    print("Sorting and ranking tracks...")
-    top_polyphony = get_top_scores(polyphony_scores)  # Lower is better
-    top_scale_consistency = get_top_scores(scale_consistency_scores, reverse=True)  # Higher is better
-    top_pitch_entropy = get_top_scores(pitch_entropy_scores)  # Lower is better
-    if scale is not None:
-        top_in_scale_rate = get_top_scores(scale_scores, reverse=True)  # Higher is better
-        filtered_top_in_scale_rate = {k: v for k, v in top_in_scale_rate.items() if v > 0.80}  # only take tracks with 80% in scale rate
-        print(filtered_top_in_scale_rate)
-        if filtered_top_in_scale_rate is None:
-            filtered_top_in_scale_rate = {k: v for k, v in top_in_scale_rate.items() if v > 0.70}  # expanding criteria to 70%
-    top_dissonance = get_top_scores(dissonance_scores)  # lower is better
-
-
-    print("Calculating average ranks...")
-    average_ranks = {}
-    if scale is not None:
-        for i in range(len(tracks)):
-            if i in filtered_top_in_scale_rate:
-                ranks = [
-                    list(top_polyphony.keys()).index(i) if i in top_polyphony else len(tracks),
-                    list(top_scale_consistency.keys()).index(i) if i in top_scale_consistency else len(tracks),
-                    list(top_pitch_entropy.keys()).index(i) if i in top_pitch_entropy else len(tracks),
-                    list(top_dissonance.keys()).index(i) if i in top_dissonance else len(tracks)
-                ]
-                average_ranks[i] = np.mean(ranks)
-    else:
-        for i in range(len(tracks)):
-            ranks = [
-                list(top_polyphony.keys()).index(i) if i in top_polyphony else len(tracks),
-                list(top_scale_consistency.keys()).index(i) if i in top_scale_consistency else len(tracks),
-                list(top_pitch_entropy.keys()).index(i) if i in top_pitch_entropy else len(tracks),
-                list(top_dissonance.keys()).index(i) if i in top_dissonance else len(tracks)
-            ]
-            average_ranks[i] = np.mean(ranks)
-
-    best_track_index = min(average_ranks, key=average_ranks.get)
-    print(f"Best track found: Index {best_track_index}")
-    return tracks[best_track_index], best_track_index
+            scores[i, PITCH_IN_SCALE_RATE] = muspy.pitch_in_scale_rate(track, scale[0], scale[1])
+    return scores
 
 
 def dissonance_rate(music):
@@ -256,29 +438,6 @@ def dissonance_rate(music):
     return dissonant_count / total_intervals
 
 
-def load_from_png(file_path, target_size=(72, 384)):
-    img = load_img(file_path, color_mode='grayscale', target_size=target_size)
-    img_array = img_to_array(img)
-    img_array = img_array / 255.0
-    return img_array.squeeze()
-
-
-def load_from_midi(midi_file, fs=100, pitch_range=(0, 72)):
-    midi_data = pretty_midi.PrettyMIDI(midi_file)
-    piano_roll = midi_data.get_piano_roll(fs=fs)[pitch_range[0]:pitch_range[1], :]
-    piano_roll = np.where(piano_roll > 0, 1, 0)
-    return piano_roll
-
-
-def load_from_pianoroll(file_path, track_index=0, binarize=True):
-    multitrack = Multitrack(file_path)
-    track = multitrack.tracks[track_index]
-    piano_roll = track.pianoroll
-    if binarize:
-        piano_roll = np.where(piano_roll > 0, 1, 0)
-    return piano_roll
-
-
 def save_imgs(generated_images, file_name, save_dir='./static', save_file=True):
     if len(generated_images) == 1:
         generated_images = [generated_images]
@@ -0,0 +1,62 @@
+import numpy as np
+from PIL import Image
+
+# (background, note) colours, notes are shaded between the two by velocity
+COLORMAPS = {
+    'blues': ((255, 255, 255), (8, 48, 107)),
+    'greys': ((255, 255, 255), (0, 0, 0)),
+    'dark': ((24, 24, 32), (120, 200, 255)),
+}
+PITCH_RANGE = (24, 96)  # the 72 pitches the generator covers
+BEAT_RESOLUTION = 24  # muspy's default time steps per quarter note
+BEATS_PER_BAR = 4
+
+
+def music_to_pianoroll(music, pitch_range=PITCH_RANGE, length=None):
+    # (pitch, time) velocity roll of a muspy.Music restricted to pitch_range, lowest pitch first
+    notes = [note for track in music.tracks for note in track.notes]
+    if length is None:
+        length = max([note.time + note.duration for note in notes], default=0)
+    roll = np.zeros((pitch_range[1] - pitch_range[0], max(length, 1)), dtype=np.uint8)
+    for note in notes:
+        if pitch_range[0] <= note.pitch < pitch_range[1]:
+            roll[note.pitch - pitch_range[0], note.time:note.time + note.duration] = note.velocity
+    return roll
+
+
+def colormap_lut(colormap='blues'):
+    background, note = (np.array(color, dtype=np.float64) for color in COLORMAPS[colormap])
+    weights = np.linspace(0, 1, 128)[:, np.newaxis]
+    return ((1 - weights) * background + weights * note).round().astype(np.uint8)
+
+
+def render_pianoroll(roll, time_scale=2, pitch_scale=6, colormap='blues', pitch_offset=PITCH_RANGE[0],
+                     beat_resolution=BEAT_RESOLUTION, beats_per_bar=BEATS_PER_BAR, gridlines=True):
+    # roll is (pitch, time) with velocities 0-127, returns an (height, width, 3) uint8 image with high pitches on top
+    lut = colormap_lut(colormap)
+    image = lut[np.clip(roll, 0, 127)][::-1]
+    image = np.repeat(np.repeat(image, pitch_scale, axis=0), time_scale, axis=1)
+
+    if gridlines:
+        background = lut[0].astype(np.int16)
+        n_pitches, n_steps = roll.shape
+        # a line under every C, then lighter beat lines and darker bar lines across time
+        c_rows = [(n_pitches - 1 - pitch) * pitch_scale + pitch_scale - 1
+                  for pitch in range(n_pitches) if (pitch + pitch_offset) % 12 == 0]
+        beat_columns = np.arange(beat_resolution, n_steps, beat_resolution)
+        bar_columns = beat_columns[(beat_columns // beat_resolution) % beats_per_bar == 0]
+        _shade(image, (slice(None), beat_columns * time_scale), background, 24)
+        _shade(image, (slice(None), bar_columns * time_scale), background, 64)
+        _shade(image, (c_rows, slice(None)), background, 40)
+    return image
+
+
+def render_pianoroll_image(roll, path, **options):
+    Image.fromarray(render_pianoroll(roll, **options), 'RGB').save(path, compress_level=1)
+
+
+def _shade(image, index, background, amount):
+    # darkens light backgrounds and lightens dark ones so gridlines show on any colormap
+    direction = -1 if background.mean() > 127 else 1
+    shaded = image[index].astype(np.int16) + direction * amount
+    image[index] = np.clip(shaded, 0, 255).astype(np.uint8)
@@ -1,16 +1,66 @@
-from flask import Blueprint, current_app, jsonify, send_from_directory, request
+from flask import Blueprint, current_app, jsonify, send_from_directory, request, url_for, abort, g, Response
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
 import tempfile
-import muspy
-from .model.vivygan import generate_random, generate_random_variations
-import pypianoroll
+from .model.vivygan import generate_random, generate_random_variations, generate_selections
+from .model.ingest import InputError, input_kind, load_input
+from .model.scoring import MODES
+from .model.batching import PredictBatcher
+from .model.inference import CompiledModel
+from .jobs import QueueFull
+from .audio import AudioRenderTimeout, AUDIO_FORMATS
+from .cache import cache_key
+from .metrics import (REGISTRY, REQUEST_SECONDS, REQUESTS, REQUESTS_IN_FLIGHT, JOB_QUEUE_DEPTH, CANDIDATE_POOL_SIZE,
+                      RESULT_CACHE_BYTES, timed, start_timings, finish_timings, server_timing)
+from .render import render_pianoroll_image, music_to_pianoroll
+import hashlib
+import io
 import numpy as np
 import os
-import matplotlib.pyplot as plt
+import threading
+import time
 
-muspy.download_musescore_soundfont()
 bp = Blueprint('api', __name__, url_prefix='/api')
+pyplot_lock = threading.Lock()
+
+# strategy -> (generate_random flags, output file prefix), shared by the generate routes and /api/jobs
+STRATEGIES = {
+    'generate': ({'cut_notes': True, 'equal_weights': True, 'least_dissonant': True}, 'track'),
+    '60_percent': ({'cut_notes': True}, '60_percent_cut_track'),
+    'equal_weights': ({'equal_weights': True}, 'equal_weights_track'),
+    'low_dissonance': ({'least_dissonant': True}, 'lowest_dissonance_track'),
+    'random': ({'choose_arbitrary': True}, 'random_track'),
+}
+GENERATE_STAGES = ('generate', 'render')
+# room for the multipart boundaries and the other form fields next to an upload
+UPLOAD_FORM_BYTES = 64 * 1024
+# endpoints that answer before the models are loaded, every other route waits on startup
+NO_MODEL_ENDPOINTS = {'api.health', 'api.ready', 'api.custom_static', 'api.stream_audio', 'api.job_status', 'api.stats',
+                      'api.metrics'}
+
+
+@bp.errorhandler(AudioRenderTimeout)
+def audio_render_timeout(e):
+    return jsonify({'error': str(e)}), 504
+
+
+@bp.before_request  # registered first so requests turned away by require_models are counted too
+def start_request_metrics():
+    g.request_started_at = time.perf_counter()
+    g.metrics_endpoint = request.endpoint or 'unknown'
+    REQUESTS_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+    start_timings()
+
+
+@bp.before_request
+def require_models():
+    if request.method == 'OPTIONS' or request.endpoint in NO_MODEL_ENDPOINTS:
+        return None
+    startup = current_app.config['startup']
+    startup.start()  # no-op unless STARTUP_MODE is 'lazy' and this is the first request
+    if not startup.wait(current_app.config['STARTUP_WAIT_TIMEOUT']):
+        return jsonify({'error': 'The models are still loading, try again shortly.', **startup.to_dict()}), 503, \
+            {'Retry-After': '5'}
+    return None
 
 
 @bp.after_request
@@ -20,6 +70,32 @@ def after_request(response):
     return response
 
 
+@bp.after_request
+def finish_request_metrics(response):
+    # flask also runs this for the 500 response of an unhandled exception
+    if 'request_started_at' not in g:
+        return response
+    seconds = time.perf_counter() - g.pop('request_started_at')
+    timings = finish_timings()
+    REQUESTS_IN_FLIGHT.dec(endpoint=g.metrics_endpoint)
+    REQUEST_SECONDS.observe(seconds, endpoint=g.metrics_endpoint)
+    REQUESTS.inc(endpoint=g.metrics_endpoint, status=response.status_code)
+    if current_app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = server_timing({**timings, 'total': seconds})
+    return response
+
+
+@bp.route('/health', methods=['GET'])  # liveness, answers as soon as the app is bound
+def health():
+    return jsonify({'status': 'ok'})
+
+
+@bp.route('/ready', methods=['GET'])  # readiness with per-stage startup timings, 503 until the models are loaded
+def ready():
+    startup = current_app.config['startup']
+    return jsonify(startup.to_dict()), 200 if startup.ready else 503
+
+
 @bp.route('/static/<path:filename>')
 def custom_static(filename):
     response = send_from_directory(bp.static_folder, filename)
@@ -27,28 +103,33 @@ def custom_static(filename):
     return response
 
 
-@bp.route('/generate', methods=['POST'])  # default generate with a mixture of metrics
-def generate():
-    model = current_app.config['model']
-    music_object = generate_random(model, cut_notes=True, equal_weights=True, least_dissonant=True)
-
-    static_dir = os.path.join(current_app.root_path, 'static')
-    audio_filename = 'track.wav'
-    image_filename = 'track_pianoroll.png'
-
-    if not os.path.exists(static_dir):
-        os.makedirs(static_dir)
+@bp.route('/audio/<artifact_id>/<path:filename>')  # audio with HTTP range support so playback can start early
+def stream_audio(artifact_id, filename):
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension not in AUDIO_FORMATS:
+        abort(404)
+    store = current_app.config['artifact_store']
+    response = send_from_directory(store.root, f'{artifact_id}/{filename}', mimetype=AUDIO_FORMATS[extension][1],
+                                   conditional=True, max_age=store.max_age)
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
 
-    audio_path = os.path.join(static_dir, audio_filename)
-    muspy.write_audio(audio_path, music_object, audio_format='wav')
-    image_path = os.path.join(static_dir, image_filename)
-    save_pianoroll_image(music_object, image_path)
-    audio_url = f"{request.host_url}static/{audio_filename}"
-    image_url = f"{request.host_url}static/{image_filename}"
 
+@bp.route('/generate', methods=['POST'])  # default generate with a mixture of metrics
+def generate():
+    audio_format, error = requested_audio_format()
+    if error is not None:
+        return error
+    budget, error = requested_budget()
+    if error is not None:
+        return error
+    seed, error = requested_seed()
+    if error is not None:
+        return error
+    result = generate_track(None, current_app._get_current_object(), request.host_url, 'generate',
+                            audio_format=audio_format, budget=budget, seed=seed)
     response = jsonify({
-        'audio_url': audio_url,
-        'image_url': image_url,
+        **result,
         'message': 'Files successfully generated.'
     })
     return response
@@ -56,192 +137,626 @@ def generate():
 
 @bp.route('/generate_60_percent', methods=['POST'])  # cutting the total number of notes by 60% starting from low notes
 def generate_percentage_cut():
-    model = current_app.config['model']
-    music_object = generate_random(model, cut_notes=True)
-
-    static_dir = os.path.join(current_app.root_path, 'static')
-    audio_filename = '60_percent_cut_track.wav'
-    image_filename = '60_percent_cut_track_pianoroll.png'
-
-    if not os.path.exists(static_dir):
-        os.makedirs(static_dir)
-
-    audio_path = os.path.join(static_dir, audio_filename)
-    muspy.write_audio(audio_path, music_object, audio_format='wav')
-    image_path = os.path.join(static_dir, image_filename)
-    save_pianoroll_image(music_object, image_path)
-    audio_url = f"{request.host_url}static/{audio_filename}"
-    image_url = f"{request.host_url}static/{image_filename}"
-
+    audio_format, error = requested_audio_format()
+    if error is not None:
+        return error
+    budget, error = requested_budget()
+    if error is not None:
+        return error
+    seed, error = requested_seed()
+    if error is not None:
+        return error
+    result = generate_track(None, current_app._get_current_object(), request.host_url, '60_percent',
+                            audio_format=audio_format, budget=budget, seed=seed)
     return jsonify({
-        'audio_url': audio_url,
-        'image_url': image_url,
+        **result,
         'message': 'Files successfully generated.'
     })
 
 
 @bp.route('/generate_equal_weights', methods=['POST'])  # assigns equal weights to muspy polyphony, scale consistency, and pitch entropy along with the dissonance metric to find the best track
 def generate_equal_weights():
-    model = current_app.config['model']
-    music_object = generate_random(model, equal_weights=True)
-
-    static_dir = os.path.join(current_app.root_path, 'static')
-    audio_filename = 'equal_weights_track.wav'
-    image_filename = 'equal_weights_track_pianoroll.png'
-
-    if not os.path.exists(static_dir):
-        os.makedirs(static_dir)
-
-    audio_path = os.path.join(static_dir, audio_filename)
-    muspy.write_audio(audio_path, music_object, audio_format='wav')
-    image_path = os.path.join(static_dir, image_filename)
-    save_pianoroll_image(music_object, image_path)
-    audio_url = f"{request.host_url}static/{audio_filename}"
-    image_url = f"{request.host_url}static/{image_filename}"
-
+    audio_format, error = requested_audio_format()
+    if error is not None:
+        return error
+    budget, error = requested_budget()
+    if error is not None:
+        return error
+    seed, error = requested_seed()
+    if error is not None:
+        return error
+    result = generate_track(None, current_app._get_current_object(), request.host_url, 'equal_weights',
+                            audio_format=audio_format, budget=budget, seed=seed)
     return jsonify({
-        'audio_url': audio_url,
-        'image_url': image_url,
+        **result,
         'message': 'Files successfully generated.'
     })
 
 
 @bp.route('/generate_low_dissonance', methods=['POST'])  # uses the dissonance metric to find the best track
 def generate_least_dissonant():
-    model = current_app.config['model']
-    music_object = generate_random(model, least_dissonant=True)
-
-    static_dir = os.path.join(current_app.root_path, 'static')
-    audio_filename = 'lowest_dissonance_track.wav'
-    image_filename = 'lowest_dissonance_track_pianoroll.png'
-
-    if not os.path.exists(static_dir):
-        os.makedirs(static_dir)
-
-    audio_path = os.path.join(static_dir, audio_filename)
-    muspy.write_audio(audio_path, music_object, audio_format='wav')
-    image_path = os.path.join(static_dir, image_filename)
-    save_pianoroll_image(music_object, image_path)
-    audio_url = f"{request.host_url}static/{audio_filename}"
-    image_url = f"{request.host_url}static/{image_filename}"
-
+    audio_format, error = requested_audio_format()
+    if error is not None:
+        return error
+    budget, error = requested_budget()
+    if error is not None:
+        return error
+    seed, error = requested_seed()
+    if error is not None:
+        return error
+    result = generate_track(None, current_app._get_current_object(), request.host_url, 'low_dissonance',
+                            audio_format=audio_format, budget=budget, seed=seed)
     return jsonify({
-        'audio_url': audio_url,
-        'image_url': image_url,
+        **result,
         'message': 'Files successfully generated.'
     })
 
 
 @bp.route('/generate_random', methods=['POST'])  # returns an arbitrary generation, for purely random comparison
 def generate_true_random():
-    model = current_app.config['model']
-    music_object = generate_random(model, choose_arbitrary=True)
-
-    static_dir = os.path.join(current_app.root_path, 'static')
-    audio_filename = 'random_track.wav'
-    image_filename = 'random_track_pianoroll.png'
-
-    if not os.path.exists(static_dir):
-        os.makedirs(static_dir)
-
-    audio_path = os.path.join(static_dir, audio_filename)
-    muspy.write_audio(audio_path, music_object, audio_format='wav')
-    image_path = os.path.join(static_dir, image_filename)
-    save_pianoroll_image(music_object, image_path)
-    audio_url = f"{request.host_url}static/{audio_filename}"
-    image_url = f"{request.host_url}static/{image_filename}"
-
+    audio_format, error = requested_audio_format()
+    if error is not None:
+        return error
+    budget, error = requested_budget()
+    if error is not None:
+        return error
+    seed, error = requested_seed()
+    if error is not None:
+        return error
+    result = generate_track(None, current_app._get_current_object(), request.host_url, 'random',
+                            audio_format=audio_format, budget=budget, seed=seed)
     return jsonify({
-        'audio_url': audio_url,
-        'image_url': image_url,
+        **result,
         'message': 'Files successfully generated.'
     })
 
 
 @bp.route('/generate_to_scale', methods=['POST'])  # uses muspy pitch_in_scale_rate to find generated samples that best fit a desired scale
 def generate_to_scale():
-    data = request.get_json()
-    note = data['note']
-    mode = data['mode']
-    octave = int(data['octave'])
-    model = current_app.config['model']
-
-    static_dir = os.path.join(current_app.root_path, 'static')
-    audio_filename = f'{note}_scale_track.wav'
-    image_filename = f'{note}_scale_track_pianoroll.png'
-
-    note_to_midibase = {
-        'C': 60, 'D': 62, 'E': 64, 'F': 65,
-        'G': 67, 'A': 69, 'B': 71
-    }
-
-    midi_base = note_to_midibase[note]
-    midi_note = midi_base + (octave - 4) * 12
-
-    music_object = generate_random(model, scale=[midi_note, mode])
-
-    audio_path = os.path.join(static_dir, audio_filename)
-    muspy.write_audio(audio_path, music_object, audio_format='wav')
-    image_path = os.path.join(static_dir, image_filename)
-    save_pianoroll_image(music_object, image_path)
-    audio_url = f"{request.host_url}static/{audio_filename}"
-    image_url = f"{request.host_url}static/{image_filename}"
-
+    scale, file_prefix, error = parse_scale(request.get_json(silent=True))
+    if error is not None:
+        return jsonify({'error': error}), 400
+    audio_format, error = requested_audio_format()
+    if error is not None:
+        return error
+    budget, error = requested_budget()
+    if error is not None:
+        return error
+    seed, error = requested_seed()
+    if error is not None:
+        return error
+
+    result = generate_track(None, current_app._get_current_object(), request.host_url, 'scale',
+                            scale=scale, file_prefix=file_prefix, audio_format=audio_format, budget=budget, seed=seed)
     return jsonify({
         'status': 'success',
         'message': 'Scale generated successfully.',
-        'audio_url': audio_url,
-        'image_url': image_url
+        **result
     })
 
 
 @bp.route('/generate_variations', methods=['POST'])  # uses a separate model to generate variations on samples by adding noise
 def generate_variations():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-    if 'batch_size' not in request.form:
-        return jsonify({"message": "Batch size not specified"}), 400
-    batch_size = int(request.form['batch_size'])
-
-    if not os.path.exists('upload'):
-        os.makedirs('upload')
-
-    filename = secure_filename(file.filename)
-    file_path = os.path.join('upload', filename)
-    file.save(file_path)
-
-    model = current_app.config['variation_model']
-    music_objects = generate_random_variations(model, file_path, batch_size=batch_size)
-
-    static_dir = os.path.join(current_app.root_path, 'static')
+    original, batch_size, error = read_upload()
+    if error is not None:
+        return error
+    audio_format, error = requested_audio_format()
+    if error is not None:
+        return error
+    seed, error = requested_seed()
+    if error is not None:
+        return error
+
+    result = generate_variation_tracks(None, current_app._get_current_object(), request.host_url, original, batch_size,
+                                       audio_format=audio_format, seed=seed)
+    return jsonify({
+        **result,
+        'message': 'Files successfully generated.'
+    })
 
-    if not os.path.exists(static_dir):
-        os.makedirs(static_dir)
 
-    for i, music_object in enumerate(music_objects):
-        audio_filename = f'variation_{i + 1}.wav'
-        image_filename = f'variation_{i + 1}_pianoroll.png'
+@bp.route('/generate_batch', methods=['POST'])  # several strategies and scales ranked from one set of candidates
+def generate_batch():
+    selections, error = parse_selections(request.get_json(silent=True) or {})
+    if error is not None:
+        return jsonify({'error': error}), 400
+    audio_format, error = requested_audio_format()
+    if error is not None:
+        return error
+    seed, error = requested_seed()
+    if error is not None:
+        return error
+
+    result = generate_batch_tracks(None, current_app._get_current_object(), request.host_url, selections,
+                                   audio_format=audio_format, seed=seed)
+    return jsonify({
+        **result,
+        'message': 'Files successfully generated.'
+    })
 
-        audio_path = os.path.join(static_dir, audio_filename)
-        muspy.write_audio(audio_path, music_object, audio_format='wav')
 
-        image_path = os.path.join(static_dir, image_filename)
-        save_pianoroll_image(music_object, image_path)
+@bp.route('/jobs', methods=['POST'])  # queues any of the above and returns a job id to poll instead of blocking
+def submit_job():
+    job_queue = current_app.config['job_queue']
+    app = current_app._get_current_object()
+    audio_format, error = requested_audio_format()
+    if error is not None:
+        return error
+    seed, error = requested_seed()
+    if error is not None:
+        return error
+
+    data = request.get_json(silent=True) or {}
+    if 'file' in request.files:
+        original, batch_size, error = read_upload()
+        if error is not None:
+            return error
+        func, args, stages = generate_variation_tracks, (app, request.host_url, original, batch_size), GENERATE_STAGES
+        kwargs = {'audio_format': audio_format, 'seed': seed}
+    elif 'strategies' in data or 'scales' in data:
+        selections, error = parse_selections(data)
+        if error is not None:
+            return jsonify({'error': error}), 400
+        func, args, stages = generate_batch_tracks, (app, request.host_url, selections), GENERATE_STAGES
+        kwargs = {'audio_format': audio_format, 'seed': seed}
+    else:
+        strategy = data.get('strategy', 'generate')
+        if strategy == 'scale':
+            scale, file_prefix, error = parse_scale(data)
+            if error is not None:
+                return jsonify({'error': error}), 400
+            args = (app, request.host_url, strategy, scale, file_prefix)
+        elif strategy in STRATEGIES:
+            args = (app, request.host_url, strategy)
+        else:
+            return jsonify({'error': f'Unknown strategy {strategy}'}), 400
+        budget, error = requested_budget()
+        if error is not None:
+            return error
+        func, stages = generate_track, GENERATE_STAGES
+        kwargs = {'audio_format': audio_format, 'budget': budget, 'seed': seed}
+
+    try:
+        job = job_queue.submit(func, *args, stages=stages, **kwargs)
+    except QueueFull as e:
+        response = jsonify({'error': f'Too many queued jobs: {e}'})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+
+    response = jsonify({**job.to_dict(), 'status_url': url_for('api.job_status', job_id=job.id, _external=True)})
+    response.headers['Location'] = url_for('api.job_status', job_id=job.id)
+    return response, 202
+
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = current_app.config['job_queue'].get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+
+@bp.route('/metrics', methods=['GET'])  # Prometheus text format, each worker process reports its own requests
+def metrics():
+    config = current_app.config
+    JOB_QUEUE_DEPTH.set(config['job_queue'].depth())
+    if config['candidate_pool'] is not None:
+        CANDIDATE_POOL_SIZE.set(len(config['candidate_pool']))
+    if config['result_cache'] is not None:
+        RESULT_CACHE_BYTES.set(config['result_cache'].stats()['bytes'])
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+@bp.route('/stats', methods=['GET'])
+def stats():
+    config = current_app.config
+    response = {'job_queue_depth': config['job_queue'].depth()}
+    if config['candidate_pool'] is not None:
+        response['candidate_pool'] = config['candidate_pool'].stats()
+    if config['cascade'] is not None:
+        response['cascade'] = config['cascade'].stats()
+    response['batch_controller'] = config['batch_controller'].stats()
+    if config['result_cache'] is not None:
+        response['result_cache'] = config['result_cache'].stats()
+    response['input_cache'] = config['input_cache'].stats()
+    for name in ('model', 'variation_model'):
+        model = config[name]
+        if isinstance(model, PredictBatcher):
+            response[f'{name}_batching'] = model.stats()
+            model = model.model
+        if isinstance(model, CompiledModel):
+            response[f'{name}_inference'] = model.stats()
+    return jsonify(response)
+
+
+def generate_track(job, app, host_url, strategy, scale=None, file_prefix=None, audio_format='wav', budget=None,
+                   seed=None):
+    # job is None when called straight from a request
+    if job is not None:
+        job.stage('generate')
+    if strategy == 'scale':
+        flags = {'scale': scale}
+    else:
+        flags, file_prefix = STRATEGIES[strategy]
+
+    if seed is None:
+        music_object = generate_random(app.config['model'], batch_size=app.config['CANDIDATE_BATCH_SIZE'],
+                                       pool=app.config['candidate_pool'], cascade=app.config['cascade'],
+                                       budget=budget, controller=app.config['batch_controller'], **flags)
+        return render_track(job, app, host_url, music_object, file_prefix, audio_format)
+
+    # a seeded search is always one fixed CANDIDATE_BATCH_SIZE batch, the pool and the budget would make it
+    # depend on what ran before and how long it took
+    cascade = app.config['cascade']
+    key = result_key(app, 'MODEL_BLOB_NAME', strategy, sorted(flags.items()), seed, app.config['CANDIDATE_BATCH_SIZE'],
+                     cascade.stages if cascade is not None else None)
+    results = cached_tracks(job, app, host_url, key, audio_format, [file_prefix])
+    if results is None:
+        music_objects = cached_music(app, key)
+        if music_objects is None:
+            music_objects = [generate_random(seeded_model(app.config['model']),
+                                             batch_size=app.config['CANDIDATE_BATCH_SIZE'], cascade=cascade,
+                                             rng=np.random.default_rng(seed), **flags)]
+            cache_music(app, key, music_objects)
+        results = render_tracks(job, app, host_url, music_objects, [file_prefix], audio_format, cache_key=key)
+    return {**results[0], 'seed': seed}
+
+
+def render_track(job, app, host_url, music_object, file_prefix, audio_format='wav'):
+    return render_tracks(job, app, host_url, [music_object], [file_prefix], audio_format)[0]
+
+
+def generate_batch_tracks(job, app, host_url, selections, audio_format='wav', seed=None):
+    # selections come from parse_selections. every selection ranks the same scored candidates, the winners are
+    # rendered together and selections with the same winner share its files
+    if job is not None:
+        job.stage('generate')
+    cascade = app.config['cascade']
+    key = None
+    if seed is not None:
+        key = result_key(app, 'MODEL_BLOB_NAME', 'batch',
+                         [(selection['strategy'], sorted(selection['flags'].items())) for selection in selections],
+                         seed, app.config['CANDIDATE_BATCH_SIZE'], cascade.stages if cascade is not None else None)
+
+    music_objects = cached_music(app, key) if key is not None else None
+    if music_objects is None:
+        if seed is None:
+            model, pool, rng = app.config['model'], app.config['candidate_pool'], None
+        else:
+            model, pool, rng = seeded_model(app.config['model']), None, np.random.default_rng(seed)
+        music_objects = generate_selections(model, [selection['flags'] for selection in selections],
+                                            batch_size=app.config['CANDIDATE_BATCH_SIZE'], pool=pool, cascade=cascade,
+                                            rng=rng)
+        if key is not None:
+            cache_music(app, key, music_objects)
+
+    winners, unique, file_prefixes = [], [], []
+    for selection, music_object in zip(selections, music_objects):
+        for i, other in enumerate(unique):
+            if other is music_object:
+                winners.append(i)
+                break
+        else:
+            winners.append(len(unique))
+            unique.append(music_object)
+            # two scales on the same note share a prefix
+            file_prefix, n = selection['file_prefix'], 2
+            while file_prefix in file_prefixes:
+                file_prefix, n = f"{selection['file_prefix']}_{n}", n + 1
+            file_prefixes.append(file_prefix)
+
+    results = cached_tracks(job, app, host_url, key, audio_format, file_prefixes) if key is not None else None
+    if results is None:
+        results = render_tracks(job, app, host_url, unique, file_prefixes, audio_format, cache_key=key)
+
+    tracks = []
+    for selection, winner in zip(selections, winners):
+        track = {'strategy': selection['strategy'], **results[winner]}
+        if 'scale' in selection:
+            track['scale'] = selection['scale']
+        tracks.append(track)
+    response = {'tracks': tracks}
+    if seed is not None:
+        response['seed'] = seed
+    return response
 
-    audio_urls = [f"{request.host_url}static/variation_{i+1}.wav" for i in range(batch_size)]
-    image_urls = [f"{request.host_url}static/variation_{i+1}_pianoroll.png" for i in range(batch_size)]
 
-    return jsonify({
-        'audio_urls': audio_urls,
-        'image_urls': image_urls,
-        'message': 'Files successfully generated.'
-    })
+def generate_variation_tracks(job, app, host_url, original, batch_size, audio_format='wav', seed=None):
+    # original is the parsed upload from read_upload
+    if job is not None:
+        job.stage('generate')
+    file_prefixes = [f'variation_{i + 1}' for i in range(batch_size)]
+
+    if seed is None:
+        music_objects = generate_random_variations(app.config['variation_model'], original, batch_size=batch_size)
+        results = render_tracks(job, app, host_url, music_objects, file_prefixes[:len(music_objects)], audio_format)
+    else:
+        key = result_key(app, 'MODEL_BLOB_NAME_2', 'variations', array_digest(original), batch_size, seed)
+        results = cached_tracks(job, app, host_url, key, audio_format, file_prefixes)
+        if results is None:
+            music_objects = cached_music(app, key)
+            if music_objects is None:
+                music_objects = generate_random_variations(seeded_model(app.config['variation_model']), original,
+                                                           batch_size=batch_size, rng=np.random.default_rng(seed))
+                cache_music(app, key, music_objects)
+            results = render_tracks(job, app, host_url, music_objects, file_prefixes[:len(music_objects)],
+                                    audio_format, cache_key=key)
+
+    response = {
+        'audio_urls': [result['audio_url'] for result in results],
+        'image_urls': [result['image_url'] for result in results]
+    }
+    if seed is not None:
+        response['seed'] = seed
+    return response
 
 
-def save_pianoroll_image(music_object, filename):
-    muspy.show_pianoroll(music_object)
-    plt.savefig(filename)
-    plt.close()
+def render_tracks(job, app, host_url, music_objects, file_prefixes, audio_format='wav', cache_key=None):
+    # audio renders run on the renderer pool while the pianoroll images are drawn here. with a cache_key the
+    # rendered files are kept in the result cache for cached_tracks
+    if job is not None:
+        job.stage('render')
+    deadline = time.monotonic() + app.config['AUDIO_RENDER_TIMEOUT']
+    store = app.config['artifact_store']
+    renderer = app.config['audio_renderer']
+    artifact_id, artifact_dir = store.allocate()
+
+    futures = []
+    for music_object, file_prefix in zip(music_objects, file_prefixes):
+        audio_filename = f'{file_prefix}.{audio_format}'
+        futures.append(renderer.submit(os.path.join(artifact_dir, audio_filename), music_object, audio_format=audio_format))
+
+    for music_object, file_prefix in zip(music_objects, file_prefixes):
+        image_path = os.path.join(artifact_dir, f'{file_prefix}_pianoroll.png')
+        with timed('pianoroll_image'):
+            save_pianoroll_image(music_object, image_path, **image_options(app))
+
+    with timed('audio_wait'):
+        renderer.wait(futures, deadline)
+    if cache_key is not None and app.config['result_cache'] is not None:
+        files = {}
+        for filename in track_files(file_prefixes, audio_format):
+            with open(os.path.join(artifact_dir, filename), 'rb') as file:
+                files[filename] = file.read()
+        app.config['result_cache'].put(render_key(app, cache_key, audio_format, file_prefixes),
+                                       {'file_prefixes': list(file_prefixes), 'files': files})
+    return track_urls(app, host_url, artifact_id, file_prefixes, audio_format)
+
+
+def track_files(file_prefixes, audio_format):
+    for file_prefix in file_prefixes:
+        yield f'{file_prefix}.{audio_format}'
+        yield f'{file_prefix}_pianoroll.png'
+
+
+def track_urls(app, host_url, artifact_id, file_prefixes, audio_format):
+    store = app.config['artifact_store']
+    return [{
+        # served by stream_audio so players can start on the first range instead of the whole file
+        'audio_url': f"{host_url}api/audio/{artifact_id}/{file_prefix}.{audio_format}",
+        'image_url': store.url(host_url, artifact_id, f'{file_prefix}_pianoroll.png')
+    } for file_prefix in file_prefixes]
+
+
+def result_key(app, blob_name, *parts):
+    # everything a seeded result depends on, including the model version so an updated model misses the cache
+    return cache_key(app.config['model_versions'].get(blob_name), app.config['INFERENCE_PRECISION'], *parts)
+
+
+def render_key(app, key, audio_format, file_prefixes):
+    # the file names are part of the render, C# and Db share a result key but not their files
+    return cache_key(key, audio_format, sorted(image_options(app).items()), list(file_prefixes))
+
+
+def cached_tracks(job, app, host_url, key, audio_format, file_prefixes):
+    # the track urls of a cached render written to a new artifact directory, None on a miss
+    cache = app.config['result_cache']
+    if cache is None:
+        return None
+    with timed('result_cache'):
+        cached = cache.get(render_key(app, key, audio_format, file_prefixes))
+    if cached is None:
+        return None
+    if job is not None:
+        job.stage('render')
+    artifact_id, artifact_dir = app.config['artifact_store'].allocate()
+    for filename, content in cached['files'].items():
+        with open(os.path.join(artifact_dir, filename), 'wb') as file:
+            file.write(content)
+    return track_urls(app, host_url, artifact_id, cached['file_prefixes'], audio_format)
+
+
+def cached_music(app, key):
+    # the ranked music objects of a seeded request, so another audio format or image mode skips inference
+    cache = app.config['result_cache']
+    return cache.get(key) if cache is not None else None
+
+
+def cache_music(app, key, music_objects):
+    if app.config['result_cache'] is not None:
+        app.config['result_cache'].put(key, music_objects)
+
+
+def seeded_model(model):
+    # predict batching pads a seeded request together with whatever else is in flight, the different batch shape
+    # can move the outputs by a rounding error and flip a note, so seeded requests call the model directly
+    return model.model if isinstance(model, PredictBatcher) else model
+
+
+def array_digest(array):
+    return hashlib.sha256(np.ascontiguousarray(array).tobytes()).hexdigest()
+
+
+def requested_audio_format():
+    # ?format=, or 'format' in the JSON body / form, returns (format, error response)
+    data = request.get_json(silent=True) or {}
+    audio_format = (request.args.get('format') or request.form.get('format') or data.get('format')
+                    or current_app.config['AUDIO_FORMAT']).lower()
+    if audio_format not in AUDIO_FORMATS:
+        return None, (jsonify({'error': f'Unknown audio format {audio_format}, expected one of {", ".join(AUDIO_FORMATS)}'}), 400)
+    return audio_format, None
+
+
+def requested_budget():
+    # candidate search budget in seconds from ?budget_ms= or 'budget_ms' in the JSON body / form, returns
+    # (budget, error response). None keeps the fixed CANDIDATE_BATCH_SIZE
+    data = request.get_json(silent=True) or {}
+    budget_ms = request.args.get('budget_ms') or request.form.get('budget_ms') or data.get('budget_ms')
+    if budget_ms is None:
+        budget_ms = current_app.config['GENERATE_LATENCY_BUDGET_MS']
+    if budget_ms is None:
+        return None, None
+    try:
+        budget_ms = float(budget_ms)
+    except (TypeError, ValueError):
+        return None, (jsonify({'error': 'budget_ms must be a number'}), 400)
+    if not 0 < budget_ms <= current_app.config['GENERATE_MAX_LATENCY_BUDGET_MS']:
+        return None, (jsonify({'error': f"budget_ms must be between 0 and {current_app.config['GENERATE_MAX_LATENCY_BUDGET_MS']}"}), 400)
+    return budget_ms / 1000, None
+
+
+def requested_seed():
+    # ?seed= or 'seed' in the JSON body / form, returns (seed, error response). None keeps generation random
+    data = request.get_json(silent=True) or {}
+    seed = request.args.get('seed') or request.form.get('seed') or data.get('seed')
+    if seed is None:
+        return None, None
+    try:
+        seed = int(seed)
+    except (TypeError, ValueError):
+        return None, (jsonify({'error': 'seed must be an integer'}), 400)
+    if not 0 <= seed < 2 ** 32:
+        return None, (jsonify({'error': 'seed must be between 0 and 2**32 - 1'}), 400)
+    return seed, None
+
+
+def read_upload():
+    # parses the uploaded file into the variation model's input, returns (original, batch_size, error response).
+    # the file is never written to disk and parsed inputs are cached by its hash, so sending the same file again skips
+    # parsing. a declared body past the limit is turned away before the form is read
+    config = current_app.config
+    max_bytes = config['VARIATION_UPLOAD_MAX_BYTES']
+    if request.content_length is not None and request.content_length > max_bytes + UPLOAD_FORM_BYTES:
+        return None, None, (jsonify({'error': f'The file is larger than {max_bytes} bytes'}), 413)
+    if 'file' not in request.files:
+        return None, None, (jsonify({'error': 'No file part'}), 400)
+    file = request.files['file']
+    if file.filename == '':
+        return None, None, (jsonify({'error': 'No selected file'}), 400)
+    if 'batch_size' not in request.form:
+        return None, None, (jsonify({"message": "Batch size not specified"}), 400)
+    try:
+        batch_size = int(request.form['batch_size'])
+    except ValueError:
+        return None, None, (jsonify({'error': 'batch_size must be an integer'}), 400)
+    if not 1 <= batch_size <= config['VARIATION_MAX_BATCH_SIZE']:
+        return None, None, (jsonify({'error': f"batch_size must be between 1 and {config['VARIATION_MAX_BATCH_SIZE']}"}), 400)
+
+    data = file.stream.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        return None, None, (jsonify({'error': f'The file is larger than {max_bytes} bytes'}), 413)
+    key = cache_key('variation_input', input_kind(file.filename), hashlib.sha256(data).hexdigest())
+    original = config['input_cache'].get(key)
+    if original is None:
+        try:
+            with timed('ingest'):
+                original = load_input(io.BytesIO(data), file.filename,
+                                      max_decoded_bytes=config['VARIATION_INPUT_MAX_DECODED_BYTES'])
+        except InputError as e:
+            return None, None, (jsonify({'error': str(e)}), 400)
+        config['input_cache'].put(key, original)
+    return original, batch_size, None
+
+
+def parse_selections(data):
+    # 'strategies' (keys of STRATEGIES) and 'scales' ({note, mode, octave} as for /generate_to_scale), returns
+    # (selections, error message)
+    strategies = data.get('strategies', [])
+    scales = data.get('scales', [])
+    if not isinstance(strategies, list) or not isinstance(scales, list):
+        return None, 'strategies and scales must be lists'
+
+    selections = []
+    for strategy in strategies:
+        if not isinstance(strategy, str) or strategy not in STRATEGIES:
+            return None, f'Unknown strategy {strategy}'
+        if any(selection['strategy'] == strategy for selection in selections):
+            continue
+        flags, file_prefix = STRATEGIES[strategy]
+        selections.append({'strategy': strategy, 'flags': flags, 'file_prefix': file_prefix})
+    for scale_data in scales:
+        scale, file_prefix, error = parse_scale(scale_data)
+        if error is not None:
+            return None, error
+        selections.append({'strategy': 'scale', 'flags': {'scale': scale}, 'file_prefix': file_prefix,
+                           'scale': {field: scale_data[field] for field in ('note', 'mode', 'octave')}})
+
+    if not selections:
+        return None, 'Give at least one strategy or scale'
+    if len(selections) > current_app.config['GENERATE_BATCH_MAX_SELECTIONS']:
+        return None, f"At most {current_app.config['GENERATE_BATCH_MAX_SELECTIONS']} strategies and scales per request"
+    return selections, None
+
+
+def parse_scale(data):
+    # returns ([midi_note, mode], file prefix, error message)
+    if not isinstance(data, dict) or any(field not in data for field in ('note', 'mode', 'octave')):
+        return None, None, 'A scale needs a note, mode and octave'
+    note = data['note']
+    mode = data['mode']
+    if not isinstance(note, str) or not isinstance(mode, str):
+        return None, None, 'note and mode must be strings'
+    try:
+        octave = int(data['octave'])
+    except (TypeError, ValueError):
+        return None, None, 'octave must be an integer'
+
+    midi_note = note_to_midi(note, octave)
+    if midi_note is None:
+        return None, None, f'Unknown note {note}'
+    if not 0 <= midi_note <= 127:
+        return None, None, f'{note} in octave {octave} is outside the MIDI range'
+    if mode.lower() not in MODES:
+        return None, None, f'Unknown mode {mode}'
+
+    note_name = note.strip().replace('#', 'sharp').replace('♯', 'sharp').replace('♭', 'b')
+    return [midi_note, mode], f'{note_name}_scale_track', None
+
+
+def note_to_midi(note, octave):
+    # note names like C, F#, Bb or E♭, anything the scale index can serve
+    note_to_midibase = {
+        'C': 60, 'D': 62, 'E': 64, 'F': 65,
+        'G': 67, 'A': 69, 'B': 71
+    }
+    accidentals = {'#': 1, '♯': 1, 'b': -1, '♭': -1}
+
+    note = note.strip()
+    if not note or note[0].upper() not in note_to_midibase:
+        return None
+    if any(accidental not in accidentals for accidental in note[1:]):
+        return None
+    midi_base = note_to_midibase[note[0].upper()] + sum(accidentals[accidental] for accidental in note[1:])
+    return midi_base + (octave - 4) * 12
+
+
+def save_pianoroll_image(music_object, filename, mode='fast', **options):
+    if mode == 'pretty':
+        import matplotlib.pyplot as plt
+        import muspy
+        # pyplot keeps global figure state, so only one thread can draw at a time
+        with pyplot_lock:
+            muspy.show_pianoroll(music_object)
+            plt.savefig(filename)
+            plt.close()
+        return
+    render_pianoroll_image(music_to_pianoroll(music_object), filename, **options)
+
+
+def image_options(app):
+    return {
+        'mode': app.config['PIANOROLL_IMAGE_MODE'],
+        'time_scale': app.config['PIANOROLL_TIME_SCALE'],
+        'pitch_scale': app.config['PIANOROLL_PITCH_SCALE'],
+        'colormap': app.config['PIANOROLL_COLORMAP'],
+    }
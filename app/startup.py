@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+
+PENDING = 'pending'
+LOADING = 'loading'
+READY = 'ready'
+FAILED = 'failed'
+
+logger = logging.getLogger(__name__)
+
+
+class Startup:
+    # runs the slow part of create_app (heavy imports, model downloads, soundfont) as named stages, so the
+    # app can bind and answer /api/health and /api/ready while they load. stages added with before_fork=True
+    # are safe to run in a gunicorn master before it forks, see run_before_fork
+    def __init__(self):
+        self.state = PENDING
+        self.stages = {}
+        self.error = None
+        self.import_seconds = None  # set by create_app, time spent importing the app package
+        self.create_app_seconds = None
+        self._steps = []
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+
+    def add(self, name, func, before_fork=False):
+        self._steps.append((name, func, before_fork))
+        self.stages[name] = {'state': PENDING, 'seconds': None}
+        return self
+
+    def run_before_fork(self):
+        # runs the leading before_fork stages in this process, start() in each forked worker runs the rest
+        for name, func, before_fork in self._steps:
+            if not before_fork:
+                break
+            if not self._run_stage(name, func):
+                self._finished.set()
+                break
+        return self
+
+    def start(self, background=True):
+        # only the first call does anything, later calls (e.g. from every request in lazy mode) return straight away
+        with self._lock:
+            if self.state != PENDING:
+                return self
+            self.state = LOADING
+        if background:
+            threading.Thread(target=self._run, name='startup', daemon=True).start()
+        else:
+            self._run()
+        return self
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    def wait(self, timeout=None):
+        self._finished.wait(timeout)
+        return self.ready
+
+    def to_dict(self):
+        return {
+            'state': self.state,
+            'error': self.error,
+            'import_seconds': self.import_seconds,
+            'create_app_seconds': self.create_app_seconds,
+            'stages': {name: dict(stage) for name, stage in self.stages.items()},
+        }
+
+    def _run(self):
+        started_at = time.perf_counter()
+        for name, func, _ in self._steps:
+            if self.stages[name]['state'] == READY:
+                continue
+            if not self._run_stage(name, func):
+                self._finished.set()
+                return
+
+        self.state = READY
+        seconds = time.perf_counter() - started_at
+        logger.info(f"Ready after {seconds:.2f}s of loading", extra={'seconds': seconds})
+        self._finished.set()
+
+    def _run_stage(self, name, func):
+        stage = self.stages[name]
+        stage['state'] = LOADING
+        started_at = time.perf_counter()
+        try:
+            func()
+        except Exception as e:
+            stage['state'] = FAILED
+            stage['seconds'] = round(time.perf_counter() - started_at, 3)
+            self.error = f'{name}: {e}'
+            self.state = FAILED
+            logger.exception(f"Startup stage {name} failed", extra={'stage': name, 'seconds': stage['seconds']})
+            return False
+        stage['state'] = READY
+        stage['seconds'] = round(time.perf_counter() - started_at, 3)
+        logger.info(f"Startup stage {name} took {stage['seconds']:.2f}s", extra={'stage': name, 'seconds': stage['seconds']})
+        return True
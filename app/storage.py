@@ -0,0 +1,87 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+
+
+class ArtifactStore:
+    # every request writes into its own directory under root, old directories are evicted by age and total size
+    def __init__(self, root, url_prefix=None, max_age=3600, max_bytes=512 * 1024 * 1024, sweep_interval=60, min_age=60):
+        self.root = root
+        self.url_prefix = url_prefix
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.min_age = min_age  # never evict anything this recent, it may still be being written or served
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def allocate(self):
+        # returns (artifact id, directory)
+        self.maybe_evict()
+        artifact_id = uuid.uuid4().hex
+        directory = os.path.join(self.root, artifact_id)
+        os.makedirs(directory)
+        return artifact_id, directory
+
+    def path(self, artifact_id, filename):
+        return os.path.join(self.root, artifact_id, filename)
+
+    def url(self, host_url, artifact_id, filename):
+        return f"{host_url}{self.url_prefix}/{artifact_id}/{filename}"
+
+    def maybe_evict(self):
+        with self._lock:
+            if time.time() - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = time.time()
+        self.evict()
+
+    def evict(self):
+        if not os.path.exists(self.root):
+            return []
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.root):
+            entry = os.path.join(self.root, name)
+            try:
+                entries.append((os.path.getmtime(entry), _size(entry), entry))
+            except FileNotFoundError:
+                continue
+        entries.sort()
+
+        removed = []
+        total = sum(size for _, size, _ in entries)
+        for modified, size, entry in entries:
+            age = now - modified
+            if age < self.min_age:
+                break
+            if age > self.max_age or total > self.max_bytes:
+                _remove(entry)
+                removed.append(entry)
+                total -= size
+        return removed
+
+
+def _size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for directory, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(directory, filename))
+            except FileNotFoundError:
+                continue
+    return total
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,228 @@
+import argparse
+import io
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+# replays requests against the Flask app in-process, with the stub models from stub_models.py standing in for the
+# real ones, and reports the latency percentiles of each route. a replay file has one JSON request per line:
+#   {"method": "POST", "path": "/api/generate", "json": {...}, "form": {...}, "upload": "roll.png", "at": 1.5}
+# "upload" is sent as the multipart 'file' (relative to the replay file). without "at" the requests are cycled
+# through by --concurrency closed-loop clients, with "at" on every line they are sent at those offsets in seconds
+# (divided by --speed) whether or not earlier ones have finished. run from the repository root, e.g.
+#   python benchmarks/load.py --concurrency 8 --requests 200 --output load.json
+#   python benchmarks/load.py --replay requests.jsonl --speed 2 --set PREDICT_BATCHING_ENABLED=false
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+from PIL import Image
+from stub_models import StubGenerator, stub_models
+
+DEFAULT_MIX = [
+    {'method': 'POST', 'path': '/api/generate'},
+    {'method': 'POST', 'path': '/api/generate_60_percent'},
+    {'method': 'POST', 'path': '/api/generate_equal_weights'},
+    {'method': 'POST', 'path': '/api/generate_low_dissonance'},
+    {'method': 'POST', 'path': '/api/generate_random'},
+    {'method': 'POST', 'path': '/api/generate_to_scale', 'json': {'note': 'C', 'mode': 'major', 'octave': 4}},
+    {'method': 'POST', 'path': '/api/generate_variations', 'form': {'batch_size': '4'}, 'upload': 'roll.png'},
+]
+
+
+def load_replay(path):
+    with open(path) as file:
+        entries = [json.loads(line) for line in file if line.strip()]
+    for entry in entries:
+        if 'upload' in entry:
+            entry['upload'] = os.path.join(os.path.dirname(os.path.abspath(path)), entry['upload'])
+    return entries
+
+
+def default_entries(directory):
+    # the route mix with a stub roll as the variation upload
+    path = os.path.join(directory, 'roll.png')
+    roll = StubGenerator().predict(np.random.default_rng(0).normal(0, 1, (1, 100)))[0, ..., 0]
+    Image.fromarray((roll * 255).astype(np.uint8), 'L').save(path)
+    return [{**entry, 'upload': path} if 'upload' in entry else dict(entry) for entry in DEFAULT_MIX]
+
+
+def create_app(directory, seconds_per_row, overrides):
+    from app import create_app
+    config = {
+        'MODEL_FACTORY': stub_models(seconds_per_row),
+        'STARTUP_MODE': 'eager',
+        'INFERENCE_COMPILED': False,  # compiling traces keras models, the stubs are plain numpy
+        'LOG_LEVEL': 'WARNING',
+        'RESULT_CACHE_DIR': os.path.join(directory, 'result_cache'),
+        **overrides,
+    }
+    app = create_app(config)
+    if not app.config['startup'].ready:
+        raise SystemExit(f"The app failed to start: {app.config['startup'].error}")
+    return app
+
+
+def send(client, entry, uploads):
+    # returns (route, status, seconds)
+    kwargs = {}
+    if 'json' in entry:
+        kwargs['json'] = entry['json']
+    if 'form' in entry or 'upload' in entry:
+        data = dict(entry.get('form', {}))
+        if 'upload' in entry:
+            data['file'] = (io.BytesIO(uploads[entry['upload']]), os.path.basename(entry['upload']))
+        kwargs['data'] = data
+    started_at = time.perf_counter()
+    response = client.open(entry['path'], method=entry.get('method', 'GET'), query_string=entry.get('query'), **kwargs)
+    response.close()
+    return entry.get('route', entry['path']), response.status_code, time.perf_counter() - started_at
+
+
+def run_closed_loop(app, entries, uploads, concurrency, requests, duration, seed):
+    # every client sends its next request as soon as the previous one is answered
+    order = list(entries)
+    random.Random(seed).shuffle(order)
+    schedule = itertools.cycle(order)
+    lock = threading.Lock()
+    samples = []
+    sent = [0]
+    deadline = time.perf_counter() + duration if duration else None
+
+    def client():
+        client = app.test_client()
+        while True:
+            with lock:
+                if (requests and sent[0] >= requests) or (deadline and time.perf_counter() >= deadline):
+                    return
+                sent[0] += 1
+                entry = next(schedule)
+            sample = send(client, entry, uploads)
+            with lock:
+                samples.append(sample)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def run_open_loop(app, entries, uploads, concurrency, speed):
+    # requests go out at their recorded offsets, at most concurrency at once
+    from concurrent.futures import ThreadPoolExecutor
+    local = threading.local()
+
+    def job(entry):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        return send(local.client, entry, uploads)
+
+    started_at = time.perf_counter()
+    futures = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for entry in sorted(entries, key=lambda entry: entry['at']):
+            delay = entry['at'] / speed - (time.perf_counter() - started_at)
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(executor.submit(job, entry))
+    return [future.result() for future in futures]
+
+
+def summarise(samples, seconds):
+    routes = {}
+    for route, status, latency in samples:
+        routes.setdefault(route, []).append((status, latency))
+    summary = {}
+    for route, route_samples in sorted(routes.items()):
+        latencies = np.array([latency for _, latency in route_samples]) * 1000
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        statuses = {}
+        for status, _ in route_samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        summary[route] = {
+            'requests': len(route_samples),
+            'errors': sum(1 for status, _ in route_samples if status >= 400),
+            'statuses': statuses,
+            'p50_ms': round(p50, 1),
+            'p95_ms': round(p95, 1),
+            'p99_ms': round(p99, 1),
+            'mean_ms': round(float(latencies.mean()), 1),
+            'max_ms': round(float(latencies.max()), 1),
+        }
+    return {
+        'requests': len(samples),
+        'seconds': round(seconds, 2),
+        'requests_per_second': round(len(samples) / seconds, 2) if seconds else None,
+        'routes': summary,
+    }
+
+
+def parse_overrides(pairs):
+    # KEY=VALUE, the value is read as JSON when it parses (numbers, true/false, lists) and as a string otherwise
+    overrides = {}
+    for pair in pairs:
+        key, _, value = pair.partition('=')
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+    return overrides
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replay', help='JSON lines file of requests, defaults to one of each generate route')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=100, help='closed loop: total requests to send')
+    parser.add_argument('--duration', type=float, help='closed loop: stop sending after this many seconds instead')
+    parser.add_argument('--speed', type=float, default=1.0, help='open loop: replay this many times faster')
+    parser.add_argument('--model-ms-per-row', type=float, default=0.05,
+                        help='simulated inference time of the stub models per row')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='app config override')
+    parser.add_argument('--seed', type=int, default=0, help='shuffles the closed loop request order')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        entries = load_replay(args.replay) if args.replay else default_entries(directory)
+        uploads = {}
+        for entry in entries:
+            if 'upload' in entry and entry['upload'] not in uploads:
+                with open(entry['upload'], 'rb') as file:
+                    uploads[entry['upload']] = file.read()
+        overrides = parse_overrides(args.set)
+        app = create_app(directory, args.model_ms_per_row / 1000, overrides)
+
+        started_at = time.perf_counter()
+        if all('at' in entry for entry in entries):
+            samples = run_open_loop(app, entries, uploads, args.concurrency, args.speed)
+        else:
+            samples = run_closed_loop(app, entries, uploads, args.concurrency,
+                                      None if args.duration else args.requests, args.duration, args.seed)
+        report = summarise(samples, time.perf_counter() - started_at)
+        report['config'] = {'concurrency': args.concurrency, 'model_ms_per_row': args.model_ms_per_row,
+                            'overrides': overrides}
+        if app.config['candidate_pool'] is not None:
+            app.config['candidate_pool'].stop()
+        app.config['audio_renderer'].shutdown()
+
+    print(f"{'route':<32} {'requests':>8} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for route, stats in report['routes'].items():
+        print(f"{route:<32} {stats['requests']:>8} {stats['errors']:>6} {stats['p50_ms']:>9} {stats['p95_ms']:>9} "
+              f"{stats['p99_ms']:>9} {stats['max_ms']:>9}")
+    print(f"{report['requests']} requests in {report['seconds']}s, {report['requests_per_second']} per second")
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# times the generation pipeline on the stub models in stub_models.py, so it runs without the Azure hosted files:
+#   generate    generate_random for every strategy of the /api/generate* routes, with the default cascade
+#   variations  generate_random_variations on an uploaded roll, and parsing png and midi uploads into its input
+#   score       CandidateBatch.score on generated candidates, split into each metric
+#   render      muspy conversion, the pianoroll image and (with fluidsynth installed) the audio of one track
+# every case reports the median wall time, throughput, the time in each stage (see app/metrics.py) and the peak
+# traced allocation. run from the repository root, e.g.
+#   python benchmarks/pipeline.py --output before.json
+#   python benchmarks/pipeline.py --output after.json --compare before.json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+from PIL import Image
+from stub_models import StubGenerator, StubVariationModel
+from app.metrics import start_timings, finish_timings
+from app.model.cascade import Cascade
+from app.model.ingest import load_input
+from app.model.vivygan import ROLL_SHAPE, generate_random, generate_random_variations, generate_candidates
+from app.routes import STRATEGIES, save_pianoroll_image
+
+SCALE = [60, 'major']
+
+
+def measure(func, repeat, memory=True):
+    # one untimed run for imports and first-call caches, the median of repeat timed runs with their mean stage
+    # timings, then one traced run for the peak allocation
+    func()
+    runs, stages = [], {}
+    for _ in range(repeat):
+        start_timings()
+        started_at = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - started_at)
+        for stage, seconds in finish_timings().items():
+            stages[stage] = stages.get(stage, 0.0) + seconds / repeat
+
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        func()
+        peak_mb = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+        tracemalloc.stop()
+    return {
+        'seconds': round(statistics.median(runs), 5),
+        'seconds_min': round(min(runs), 5),
+        'stages': {stage: round(seconds, 5) for stage, seconds in sorted(stages.items(), key=lambda item: -item[1])},
+        'peak_mb': peak_mb,
+    }
+
+
+def bench_generate(batch_sizes, strategies, repeat, memory):
+    generator = StubGenerator()
+    cascade = Cascade(verbose=False)
+    for batch_size in batch_sizes:
+        for strategy in strategies:
+            flags = {'scale': SCALE} if strategy == 'scale' else STRATEGIES[strategy][0]
+            result = measure(lambda: generate_random(generator, batch_size=batch_size, cascade=cascade, **flags),
+                             repeat, memory)
+            yield {'benchmark': 'generate', 'case': strategy, 'batch_size': batch_size,
+                   'throughput': round(batch_size / result['seconds'], 1), **result}
+
+
+def bench_variations(batch_sizes, repeat, memory, directory):
+    path = os.path.join(directory, 'roll.png')
+    candidates = generate_candidates(StubGenerator(), 1)
+    Image.fromarray((candidates.images[0] * 255).astype(np.uint8), 'L').save(path)
+    model = StubVariationModel()
+    original = load_input(path, path)
+    for batch_size in batch_sizes:
+        result = measure(lambda: generate_random_variations(model, original, batch_size=batch_size), repeat, memory)
+        yield {'benchmark': 'variations', 'case': 'png', 'batch_size': batch_size,
+               'throughput': round(batch_size / result['seconds'], 1), **result}
+
+    # parsing uploads, an hour long midi should cost what one the length of the model input does
+    cases = [('ingest_png', path)]
+    for name, repeats in (('ingest_midi', 1), ('ingest_midi_hour', 450)):
+        cases.append((name, write_midi(candidates.music(0), os.path.join(directory, f'{name}.mid'), repeats)))
+    for name, case_path in cases:
+        result = measure(lambda: load_input(case_path, case_path), repeat, memory)
+        yield {'benchmark': 'variations', 'case': name, 'batch_size': 1,
+               'throughput': round(1 / result['seconds'], 1), **result}
+
+
+def write_midi(music, path, repeats):
+    # the track played repeats times back to back, one roll is 8 seconds at muspy's default 120 bpm
+    import muspy
+    notes = music.tracks[0].notes
+    music.tracks[0].notes = [muspy.Note(time=note.time + i * ROLL_SHAPE[1], pitch=note.pitch, duration=note.duration,
+                                        velocity=note.velocity) for i in range(repeats) for note in notes]
+    muspy.write_midi(path, music)
+    return path
+
+
+def bench_score(batch_sizes, repeat, memory):
+    generator = StubGenerator()
+    for batch_size in batch_sizes:
+        candidates = generate_candidates(generator, batch_size)
+
+        def score():
+            candidates.scores = None
+            candidates.score()
+            candidates.images = images  # score() drops the roll, put it back for the next run
+
+        images = candidates.images
+        result = measure(score, repeat, memory)
+        yield {'benchmark': 'score', 'case': 'all_metrics', 'batch_size': batch_size,
+               'throughput': round(batch_size / result['seconds'], 1), **result}
+
+
+def bench_render(renders, repeat, memory, directory):
+    from app.audio import AudioRenderer
+    candidates = generate_candidates(StubGenerator(), renders)
+    music_objects = [candidates.music(index) for index in range(renders)]
+    cases = [('pianoroll_image', lambda: [save_pianoroll_image(music, os.path.join(directory, f'{i}.png'))
+                                          for i, music in enumerate(music_objects)]),
+             ('convert_to_muspy', lambda: [candidates.music(index) for index in range(renders)])]
+    if shutil.which('fluidsynth'):
+        renderer = AudioRenderer(workers=os.cpu_count() or 2)
+        cases.append(('audio_wav', lambda: renderer.render(
+            [(os.path.join(directory, f'{i}.wav'), music) for i, music in enumerate(music_objects)])))
+    else:
+        print('fluidsynth not found, skipping the audio render', file=sys.stderr)
+    for name, func in cases:
+        result = measure(func, repeat, memory)
+        yield {'benchmark': 'render', 'case': name, 'batch_size': renders,
+               'throughput': round(renders / result['seconds'], 1), **result}
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, threshold):
+    # prints the change in median seconds per case, returns the cases slower than baseline by more than threshold
+    previous = {(r['benchmark'], r['case'], r['batch_size']): r for r in baseline['results']}
+    regressions = []
+    print(f"\n{'benchmark':<11} {'case':<18} {'batch':>6} {'before s':>10} {'after s':>10} {'change':>8}")
+    for result in results:
+        key = (result['benchmark'], result['case'], result['batch_size'])
+        if key not in previous:
+            continue
+        before, after = previous[key]['seconds'], result['seconds']
+        change = after / before - 1 if before else 0.0
+        flag = ' slower' if change > threshold else ''
+        print(f"{key[0]:<11} {key[1]:<18} {key[2]:>6} {before:>10.4f} {after:>10.4f} {change:>+7.1%}{flag}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--variation-batch-sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--strategies', nargs='+', default=list(STRATEGIES) + ['scale'],
+                        choices=list(STRATEGIES) + ['scale'])
+    parser.add_argument('--benchmarks', nargs='+', default=['generate', 'variations', 'score', 'render'],
+                        choices=['generate', 'variations', 'score', 'render'])
+    parser.add_argument('--renders', type=int, default=5, help='tracks per render case')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced run for peak memory')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown counted as a regression by --compare')
+    args = parser.parse_args()
+
+    memory = not args.no_memory
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        suites = {
+            'generate': lambda: bench_generate(args.batch_sizes, args.strategies, args.repeat, memory),
+            'variations': lambda: bench_variations(args.variation_batch_sizes, args.repeat, memory, directory),
+            'score': lambda: bench_score(args.batch_sizes, args.repeat, memory),
+            'render': lambda: bench_render(args.renders, args.repeat, memory, directory),
+        }
+        print(f"{'benchmark':<11} {'case':<18} {'batch':>6} {'median s':>10} {'per s':>10} {'peak MB':>8}  slowest stages")
+        for name in args.benchmarks:
+            for result in suites[name]():
+                results.append(result)
+                slowest = ', '.join(f'{stage} {seconds * 1000:.0f}ms' for stage, seconds in list(result['stages'].items())[:3])
+                print(f"{result['benchmark']:<11} {result['case']:<18} {result['batch_size']:>6} {result['seconds']:>10.4f} "
+                      f"{result['throughput']:>10.1f} {str(result['peak_mb']):>8}  {slowest}", flush=True)
+
+    report = {'environment': environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
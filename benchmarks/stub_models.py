@@ -0,0 +1,76 @@
+import time
+import numpy as np
+
+# stand-ins for the two keras models so the pipeline runs without the Azure hosted files. outputs depend only on
+# each input row, so a row gives the same roll whatever batch it is predicted in
+ROLL_SHAPE = (72, 384)
+MAX_NOTES = 48
+DURATIONS = np.array([4, 8, 12, 12, 24, 24, 24, 48, 48, 96])  # steps, the short ones are dropped by remove_short_notes
+DEGENERATE_RATE = 0.05  # share of rolls with at most one note, what the cascade is there to drop
+
+
+class StubGenerator:
+    # (batch, 100) noise -> (batch, 72, 384, 1) rolls of 0.0 / 1.0 with 8-48 notes around a random register,
+    # which is the density and pitch spread the trained generator produces after binarize_generated
+    name = 'stub_generator'
+
+    def __init__(self, latent_dim=100, seconds_per_row=0.0):
+        self.latent_dim = latent_dim
+        self.input_shape = (None, latent_dim)
+        self.output_shape = (None,) + ROLL_SHAPE + (1,)
+        self.seconds_per_row = seconds_per_row  # simulated inference cost
+        self._mixing = np.random.default_rng(0).normal(0, 1, (latent_dim, 3 * MAX_NOTES + 3))
+
+    def predict(self, inputs, **kwargs):
+        inputs = np.asarray(inputs, dtype=np.float64)
+        if self.seconds_per_row:
+            time.sleep(len(inputs) * self.seconds_per_row)
+        # uniforms in [0, 1) derived from each row, the sin-fract hash keeps them independent of the batch
+        uniforms = np.modf(np.abs(np.sin(inputs @ self._mixing) * 43758.5453))[0]
+        return paint_rolls(uniforms)[..., np.newaxis]
+
+
+class StubVariationModel:
+    # (batch, 72, 384) noisy rolls -> (batch, 72, 384, 1), a denoiser that keeps the cells the noise didn't push
+    # far from the original
+    name = 'stub_variation_model'
+
+    def __init__(self, seconds_per_row=0.0):
+        self.input_shape = (None,) + ROLL_SHAPE
+        self.output_shape = (None,) + ROLL_SHAPE + (1,)
+        self.seconds_per_row = seconds_per_row
+
+    def predict(self, inputs, **kwargs):
+        inputs = np.asarray(inputs, dtype=np.float32)
+        if self.seconds_per_row:
+            time.sleep(len(inputs) * self.seconds_per_row)
+        return np.clip(inputs, 0, 1)[..., np.newaxis]
+
+
+def paint_rolls(uniforms):
+    batch_size = len(uniforms)
+    note_counts = (8 + uniforms[:, 0] * (MAX_NOTES - 8)).astype(np.int64)
+    note_counts[uniforms[:, 1] < DEGENERATE_RATE] = (uniforms[uniforms[:, 1] < DEGENERATE_RATE, 0] * 2).astype(np.int64)
+    register = (12 + uniforms[:, 2] * 36).astype(np.int64)
+
+    notes = uniforms[:, 3:].reshape(batch_size, MAX_NOTES, 3)
+    keep = np.arange(MAX_NOTES)[np.newaxis] < note_counts[:, np.newaxis]
+    rows = np.broadcast_to(np.arange(batch_size)[:, np.newaxis], keep.shape)[keep]
+    pitch = np.clip(register[:, np.newaxis] + ((notes[..., 0] - 0.5) * 24).astype(np.int64), 0, ROLL_SHAPE[0] - 1)[keep]
+    start = (notes[..., 1] * ROLL_SHAPE[1]).astype(np.int64)[keep]
+    end = np.minimum(start + DURATIONS[(notes[..., 2] * len(DURATIONS)).astype(np.int64)][keep], ROLL_SHAPE[1])
+
+    # +1 at each note start and -1 at its end, overlapping notes on a pitch merge
+    marks = np.zeros((batch_size,) + ROLL_SHAPE[:1] + (ROLL_SHAPE[1] + 1,), dtype=np.int8)
+    np.add.at(marks, (rows, pitch, start), 1)
+    np.add.at(marks, (rows, pitch, end), -1)
+    return (np.cumsum(marks, axis=-1, dtype=np.int8)[..., :-1] > 0).astype(np.float32)
+
+
+def stub_models(seconds_per_row=0.0):
+    # MODEL_FACTORY for create_app: config key -> model
+    models = {
+        'MODEL_BLOB_NAME': StubGenerator(seconds_per_row=seconds_per_row),
+        'MODEL_BLOB_NAME_2': StubVariationModel(seconds_per_row=seconds_per_row),
+    }
+    return models.__getitem__
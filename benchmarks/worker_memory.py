@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# memory per worker with and without a preloading master. workers are forked the way gunicorn forks them, so
+# this runs without gunicorn installed:
+#   independent  every worker imports the app and runs every startup stage itself (gunicorn's default)
+#   preload      the master runs create_app in STARTUP_MODE=preload and the workers only load the models
+# run from the repository root, e.g. MODEL_LOCAL_DIR=/path/to/models python benchmarks/worker_memory.py --workers 4
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def memory(pid):
+    # rss, pss and uss (private pages) in MB from /proc/<pid>/smaps_rollup
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss_mb': round(fields['Rss'], 1),
+        'pss_mb': round(fields['Pss'], 1),
+        'uss_mb': round(fields['Private_Clean'] + fields['Private_Dirty'], 1),
+    }
+
+
+def worker(app_factory, ready_fd, release_fd):
+    import numpy as np
+    app = app_factory()
+    startup = app.config['startup']
+    startup.start(background=False)
+    if not startup.ready:
+        os.write(ready_fd, b'F')
+        os._exit(1)
+    # one inference so tensorflow's thread pools and buffers are counted too
+    app.config['model'].predict(np.random.normal(0, 1, (64, 100)))
+    os.write(ready_fd, b'R')
+    os.read(release_fd, 1)
+    os._exit(0)
+
+
+def run_mode(mode, workers):
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    os.environ['WEB_CONCURRENCY'] = str(workers)
+    os.environ['STARTUP_MODE'] = 'preload' if mode == 'preload' else 'lazy'
+
+    started_at = time.perf_counter()
+    if mode == 'preload':
+        import gc
+        from app import create_app
+        app = create_app()
+        gc.freeze()
+        app_factory = lambda: app
+    else:
+        def app_factory():
+            from app import create_app
+            return create_app()
+
+    ready_read, ready_write = os.pipe()
+    release_read, release_write = os.pipe()
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            worker(app_factory, ready_write, release_read)
+        pids.append(pid)
+
+    failed = 0
+    for _ in pids:
+        failed += os.read(ready_read, 1) == b'F'
+    ready_seconds = time.perf_counter() - started_at
+
+    worker_memory = [memory(pid) for pid in pids if os.path.exists(f'/proc/{pid}')]
+    master_memory = memory(os.getpid())
+    os.write(release_write, b'x' * workers)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+    return {
+        'mode': mode,
+        'workers': workers,
+        'failed_workers': failed,
+        'ready_seconds': round(ready_seconds, 2),
+        'master': master_memory,
+        'per_worker': {key: round(sum(m[key] for m in worker_memory) / max(len(worker_memory), 1), 1)
+                       for key in ('rss_mb', 'pss_mb', 'uss_mb')},
+        'total_pss_mb': round(master_memory['pss_mb'] + sum(m['pss_mb'] for m in worker_memory), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--modes', nargs='+', default=['independent', 'preload'], choices=['independent', 'preload'])
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--run-mode', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        print(json.dumps(run_mode(args.run_mode, args.workers)))
+        return
+
+    # each mode runs in a fresh interpreter so nothing imported by one mode is shared with the next
+    results = []
+    for mode in args.modes:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run-mode', mode, '--workers', str(args.workers)],
+            check=True, stdout=subprocess.PIPE, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'mode':<12} {'workers':>7} {'ready s':>8} {'rss/worker':>11} {'pss/worker':>11} {'uss/worker':>11} "
+          f"{'total pss':>10}")
+    for result in results:
+        per_worker = result['per_worker']
+        print(f"{result['mode']:<12} {result['workers']:>7} {result['ready_seconds']:>8} "
+              f"{per_worker['rss_mb']:>9}MB {per_worker['pss_mb']:>9}MB {per_worker['uss_mb']:>9}MB "
+              f"{result['total_pss_mb']:>8}MB")
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+import gc
+import os
+
+# gunicorn reads this file from the working directory, the Procfile flags still apply on top of it. the worker count
+# comes from --workers or WEB_CONCURRENCY as usual
+
+# PRELOAD_MODELS=1 runs create_app once in the master, which downloads the model files and imports tensorflow and
+# muspy before forking. the workers share those pages copy-on-write and only deserialize the models themselves
+preload_app = os.environ.get('PRELOAD_MODELS', '') == '1'
+if preload_app:
+    os.environ.setdefault('STARTUP_MODE', 'preload')
+
+
+def when_ready(server):
+    if preload_app:
+        # moves the preloaded objects out of the collector's reach so gc passes in the workers don't write to
+        # (and un-share) the pages holding them
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    # create_app splits tensorflow's threads between the workers gunicorn actually runs, whichever setting gave the
+    # count. a worker without preload creates its app after this, a preloaded app gets it before its models load
+    os.environ['WEB_CONCURRENCY'] = str(server.cfg.workers)
+    if preload_app:
+        from run import app
+        app.config['WEB_WORKERS'] = server.cfg.workers
+        app.config['startup'].start()
@@ -0,0 +1,49 @@
+from concurrent.futures import Future
+import pytest
+from stub_models import stub_models
+from app import create_app
+from app.audio import AudioRenderer
+from app.storage import ArtifactStore
+
+
+class MidiRenderer(AudioRenderer):
+    # writes the MIDI file in place of the audio, so the routes run without fluidsynth
+    def submit(self, path, music, audio_format='wav'):
+        import muspy
+        muspy.write_midi(path, music)
+        future = Future()
+        future.set_result((path, 0.0))
+        return future
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    # create_app on the stub models from benchmarks/stub_models.py, keyword arguments are config overrides
+    apps = []
+
+    def make_app(**overrides):
+        app = create_app({
+            'MODEL_FACTORY': stub_models(),
+            'STARTUP_MODE': 'eager',
+            'INFERENCE_COMPILED': False,
+            'CANDIDATE_POOL_ENABLED': False,
+            'CANDIDATE_BATCH_SIZE': 100,
+            'LOG_LEVEL': 'WARNING',
+            'RESULT_CACHE_DIR': str(tmp_path / 'result_cache'),
+            **overrides,
+        })
+        assert app.config['startup'].ready, app.config['startup'].error
+        app.config['artifact_store'] = ArtifactStore(str(tmp_path / 'results'), url_prefix='static/results')
+        app.config['audio_renderer'] = MidiRenderer()
+        apps.append(app)
+        return app
+
+    yield make_app
+    for app in apps:
+        if app.config['candidate_pool'] is not None:
+            app.config['candidate_pool'].stop()
+
+
+@pytest.fixture
+def client(make_app):
+    return make_app().test_client()
@@ -0,0 +1,64 @@
+import threading
+import numpy as np
+from app.model.batching import PredictBatcher
+
+
+class RecordingModel:
+    # doubles its inputs and records the size of every call
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    def predict(self, inputs, **kwargs):
+        self.calls.append(len(inputs))
+        if self.error is not None:
+            raise self.error
+        return inputs * 2
+
+
+def predict_together(batcher, inputs):
+    # one thread per call, returns each call's outputs (or exception) in the order of inputs
+    results = [None] * len(inputs)
+
+    def call(i):
+        try:
+            results[i] = batcher.predict(inputs[i])
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(inputs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def test_merged_calls_get_their_own_rows():
+    # the window is long enough that only filling max_batch_size flushes, so all calls share one predict
+    model = RecordingModel()
+    sizes = [3, 1, 5, 2]
+    batcher = PredictBatcher(model, window_ms=10000, max_batch_size=sum(sizes))
+    rng = np.random.default_rng(0)
+    inputs = [rng.random((size, 4)) for size in sizes]
+    outputs = predict_together(batcher, inputs)
+    assert model.calls == [sum(sizes)]
+    for given, output in zip(inputs, outputs):
+        np.testing.assert_array_equal(output, given * 2)
+    assert batcher.stats()['max_batch_requests'] == len(sizes)
+
+
+def test_shapes_are_batched_separately():
+    model = RecordingModel()
+    batcher = PredictBatcher(model, window_ms=50)
+    inputs = [np.ones((2, 4)), np.ones((3, 5))]
+    outputs = predict_together(batcher, inputs)
+    assert sorted(model.calls) == [2, 3]
+    for given, output in zip(inputs, outputs):
+        np.testing.assert_array_equal(output, given * 2)
+
+
+def test_errors_reach_every_caller():
+    batcher = PredictBatcher(RecordingModel(error=RuntimeError('out of memory')), window_ms=10000, max_batch_size=4)
+    outputs = predict_together(batcher, [np.ones((2, 4)), np.ones((2, 4))])
+    assert [str(output) for output in outputs] == ['out of memory', 'out of memory']
@@ -0,0 +1,52 @@
+import pickle
+from app.cache import ResultCache, cache_key
+
+# values of about 1KB pickled, two fit in memory
+VALUE_BYTES = len(pickle.dumps(b'x' * 1000, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def value(name):
+    return name.encode() * (1000 // len(name))
+
+
+def test_lru_keeps_recent_entries_in_memory():
+    cache = ResultCache(max_bytes=2 * VALUE_BYTES + 10)
+    cache.put('a', value('a'))
+    cache.put('b', value('b'))
+    assert cache.get('a') == value('a')
+    cache.put('c', value('c'))
+    # b was the least recently used, and without a disk_dir it is gone
+    assert cache.get('b') is None
+    assert cache.get('a') == value('a') and cache.get('c') == value('c')
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses'], stats['spills']) == (2, 3, 1, 1)
+
+
+def test_spills_to_disk_and_reads_back(tmp_path):
+    cache = ResultCache(max_bytes=2 * VALUE_BYTES + 10, disk_dir=str(tmp_path))
+    for name in ('a', 'b', 'c'):
+        cache.put(name, value(name))
+    assert cache.stats()['disk_entries'] == 1
+
+    # a comes back from disk into memory, which spills b
+    assert cache.get('a') == value('a')
+    stats = cache.stats()
+    assert (stats['disk_hits'], stats['entries'], stats['spills']) == (1, 2, 2)
+    assert cache.get('b') == value('b')
+    assert cache.stats()['disk_hits'] == 2
+
+    # spilled entries outlive the process that wrote them
+    assert ResultCache(disk_dir=str(tmp_path)).get('a') is not None
+
+
+def test_disk_is_bounded(tmp_path):
+    cache = ResultCache(max_bytes=VALUE_BYTES + 10, disk_dir=str(tmp_path), disk_max_bytes=2 * VALUE_BYTES + 10)
+    for name in ('a', 'b', 'c', 'd', 'e'):
+        cache.put(name, value(name))
+    assert cache.stats()['disk_entries'] == 2
+    assert not [path for path in tmp_path.iterdir() if path.name.startswith('.spill-')]
+
+
+def test_cache_key_is_stable():
+    assert cache_key('generate', 1, None, (2, 'minor')) == cache_key('generate', 1, None, (2, 'minor'))
+    assert cache_key('generate', 1) != cache_key('generate', '1')
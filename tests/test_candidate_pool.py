@@ -0,0 +1,71 @@
+import time
+import pytest
+from stub_models import StubGenerator
+from app.model.candidate_pool import CandidatePool
+
+
+def wait_until(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def pool():
+    pool = CandidatePool(StubGenerator(), low_watermark=200, high_watermark=400, refill_batch_size=100).start()
+    yield pool
+    pool.stop(timeout=5)
+
+
+def test_fills_both_views_to_the_high_watermark(pool):
+    wait_until(lambda: len(pool) >= 400)
+    stats = pool.stats()
+    assert stats['size'] == stats['cut_size'] == 400
+    assert stats['refills'] == 4
+
+
+def test_refills_once_below_the_low_watermark(pool):
+    wait_until(lambda: len(pool) >= 400)
+    assert len(pool.take(150)) == 150
+    # still above the low watermark, nothing is generated
+    time.sleep(0.2)
+    assert pool.stats()['size'] == 250 and pool.stats()['refills'] == 4
+
+    pool.take(100)
+    wait_until(lambda: pool.stats()['size'] >= 400)
+    stats = pool.stats()
+    assert stats['size'] == 450 and stats['cut_size'] == 400
+    assert stats['hits'] == 2
+
+
+def test_take_misses_when_short(pool):
+    wait_until(lambda: len(pool) >= 400)
+    assert pool.take(1000) is None
+    assert pool.take(50, cut_notes=True) is not None
+    assert pool.stats()['misses'] == 1
+
+
+def test_max_bytes_stops_the_refill():
+    pool = CandidatePool(StubGenerator(), low_watermark=200, high_watermark=400, refill_batch_size=100, max_bytes=1)
+    checks = []
+    views_with_room = pool._views_with_room
+    pool._views_with_room = lambda: checks.append(None) or views_with_room()
+    pool.start()
+    try:
+        wait_until(lambda: pool.stats()['refills'] >= 1)
+        time.sleep(0.1)
+        # the worker waits for take() instead of checking for room again and again
+        settled = len(checks)
+        time.sleep(0.3)
+        assert pool.stats()['refills'] == 1
+        assert len(checks) == settled
+
+        # a take wakes the worker, which refills once there is room
+        pool.max_bytes = 64 * 1024 * 1024
+        pool.take(10)
+        wait_until(lambda: len(pool) >= 400)
+    finally:
+        pool.stop(timeout=5)
+    assert not pool._thread.is_alive()
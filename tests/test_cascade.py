@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+from app.model.cascade import Cascade, coverage, note_counts, pitch_range
+from app.model.vivygan import NOTE_DTYPE, ROLL_SHAPE, CandidateBatch
+
+LENGTH = ROLL_SHAPE[1]
+
+
+def random_notes(size=20, seed=0):
+    # notes grouped by candidate index as pianoroll_to_notes leaves them, every third candidate empty and some notes
+    # running past the end of the roll
+    rng = np.random.default_rng(seed)
+    notes = []
+    for index in range(size):
+        if index % 3 == 1:
+            continue
+        for _ in range(rng.integers(1, 30)):
+            time = int(rng.integers(0, LENGTH))
+            notes.append((index, int(rng.integers(24, 96)), time, int(rng.integers(1, 120))))
+    return np.array(notes, dtype=NOTE_DTYPE)
+
+
+def candidate_notes(notes, index):
+    return notes[notes['index'] == index]
+
+
+def brute_coverage(notes, index):
+    active = np.zeros(LENGTH, dtype=bool)
+    for note in candidate_notes(notes, index):
+        active[note['time']:note['time'] + note['duration']] = True
+    return active.mean()
+
+
+def brute_pitch_range(notes, index):
+    pitches = candidate_notes(notes, index)['pitch']
+    return int(pitches.max() - pitches.min()) if len(pitches) else 0
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_features_match_a_per_candidate_loop(seed):
+    size = 20
+    notes = random_notes(size, seed)
+    assert np.any(notes['time'] + notes['duration'] > LENGTH)
+    assert note_counts(notes, size).tolist() == [len(candidate_notes(notes, index)) for index in range(size)]
+    np.testing.assert_allclose(coverage(notes, size), [brute_coverage(notes, index) for index in range(size)])
+    assert pitch_range(notes, size).tolist() == [brute_pitch_range(notes, index) for index in range(size)]
+
+
+def test_features_of_a_trailing_empty_candidate():
+    notes = np.array([(0, 60, 0, 10), (0, 72, LENGTH - 5, 20)], dtype=NOTE_DTYPE)
+    assert pitch_range(notes, 3).tolist() == [12, 0, 0]
+    np.testing.assert_allclose(coverage(notes, 3), [15 / LENGTH, 0, 0])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_apply_matches_a_per_candidate_filter(seed):
+    size = 20
+    notes = random_notes(size, seed)
+    stages = (('note_count', 10, None), ('coverage', 0.9, None), ('pitch_range', None, 68))
+    checks = {
+        'note_count': lambda index: len(candidate_notes(notes, index)),
+        'coverage': lambda index: brute_coverage(notes, index),
+        'pitch_range': lambda index: brute_pitch_range(notes, index),
+    }
+    survivors, report = Cascade(stages, verbose=False).apply(CandidateBatch(notes, size))
+
+    keep = list(range(size))
+    for (name, low, high), stage in zip(stages, report):
+        passing = [index for index in keep if (low is None or checks[name](index) >= low)
+                   and (high is None or checks[name](index) <= high)]
+        skipped = not passing
+        if not skipped:
+            dropped, keep = len(keep) - len(passing), passing
+        else:
+            dropped = 0
+        assert stage == {'stage': name, 'dropped': dropped, 'remaining': len(keep), 'skipped': skipped}
+    assert len(survivors) == len(keep)
+    for new_index, index in enumerate(keep):
+        kept = candidate_notes(survivors.notes, new_index)
+        assert np.array_equal(kept[['pitch', 'time', 'duration']], candidate_notes(notes, index)[['pitch', 'time', 'duration']])
+
+
+def test_stage_dropping_everything_is_skipped():
+    notes = random_notes(6)
+    # the empty candidates (1 and 4) go first, then no pitch range is below 0 so that stage is skipped
+    stages = (('note_count', 1, None), ('pitch_range', None, -1), ('coverage', None, 1.0))
+    survivors, report = Cascade(stages, verbose=False).apply(CandidateBatch(notes, 6))
+    assert [stage['skipped'] for stage in report] == [False, True, False]
+    assert report[1]['dropped'] == 0 and report[1]['remaining'] == report[0]['remaining'] == 4
+    assert len(survivors) == 4
+
+
+def test_stats_add_up():
+    cascade = Cascade((('note_count', 1, None),), verbose=False)
+    for seed in range(3):
+        cascade.apply(CandidateBatch(random_notes(6, seed), 6))
+    stats = cascade.stats()
+    assert (stats['runs'], stats['candidates'], stats['scored']) == (3, 18, 12)
+    assert stats['dropped'] == {'note_count': 6} and stats['skipped'] == {'note_count': 0}
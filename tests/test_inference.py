@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from app.model.inference import CompiledModel
+
+keras = pytest.importorskip('keras')
+
+
+@pytest.fixture(scope='module')
+def model():
+    return keras.Sequential([keras.Input((3,)), keras.layers.Dense(2)])
+
+
+@pytest.mark.parametrize('batch_size, buckets', [(1, {1}), (5, {8}), (500, {512}), (1024, {512}), (1100, {128, 512})])
+def test_buckets_for(model, batch_size, buckets):
+    assert CompiledModel(model).buckets_for(batch_size) == buckets
+
+
+def test_warmup_only_runs_the_requested_buckets(model):
+    compiled = CompiledModel(model, buckets=(1, 2, 4, 8))
+    compiled.warmup([3, 10])
+    assert compiled.stats()['warm_buckets'] == [2, 4, 8]
+    assert sorted(compiled._functions) == [2, 4, 8]
+    compiled.warmup()
+    assert compiled.stats()['warm_buckets'] == [1, 2, 4, 8]
+
+
+def test_predict_matches_the_model(model):
+    inputs = np.random.default_rng(0).random((6, 3)).astype(np.float32)
+    compiled = CompiledModel(model, buckets=(1, 2, 4, 8)).warmup([6])
+    np.testing.assert_allclose(compiled.predict(inputs), model(inputs).numpy(), rtol=1e-5, atol=1e-6)
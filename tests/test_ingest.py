@@ -0,0 +1,55 @@
+import io
+import numpy as np
+import pretty_midi
+import pytest
+from app.model.ingest import InputError, load_from_midi, load_input
+from app.model.vivygan import ROLL_SHAPE
+
+# the hand written midi reader against pretty_midi's piano roll, which is what the variation endpoint used to read
+
+
+def pretty_midi_roll(path):
+    roll = (pretty_midi.PrettyMIDI(str(path)).get_piano_roll(fs=100)[:ROLL_SHAPE[0]] > 0).astype(np.float32)
+    roll = roll[:, :ROLL_SHAPE[1]]
+    return np.pad(roll, ((0, 0), (0, ROLL_SHAPE[1] - roll.shape[1])))
+
+
+def random_midi(path, seed):
+    # notes on a few instruments and a drum kit, sustain pedal and tempo changes, some of it past the window
+    rng = np.random.default_rng(seed)
+    midi = pretty_midi.PrettyMIDI(initial_tempo=float(rng.uniform(80, 180)), resolution=int(rng.choice([96, 220, 480])))
+    for _ in range(rng.integers(1, 4)):
+        instrument = pretty_midi.Instrument(program=int(rng.integers(0, 8)), is_drum=bool(rng.random() < 0.2))
+        for _ in range(rng.integers(0, 60)):
+            start = float(rng.uniform(0, 6))
+            end = start + float(rng.choice([0.01, 0.1, 0.5, 1.5]))
+            instrument.notes.append(pretty_midi.Note(int(rng.integers(1, 127)), int(rng.integers(20, 90)), start, end))
+        for _ in range(rng.integers(0, 6)):
+            value = int(rng.choice([0, 10, 100, 127]))
+            instrument.control_changes.append(pretty_midi.ControlChange(64, value, float(rng.uniform(0, 6))))
+        midi.instruments.append(instrument)
+    if rng.random() < 0.5:
+        # a second tempo, pretty_midi writes its tick scales as set_tempo events of the first track
+        midi._tick_scales.append((int(rng.integers(1, midi.resolution * 8)), 60.0 / (float(rng.uniform(60, 200)) * midi.resolution)))
+        midi._update_tick_to_time(midi.resolution * 100)
+    midi.write(str(path))
+    return path
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_midi_matches_pretty_midi(tmp_path, seed):
+    path = random_midi(tmp_path / 'song.mid', seed)
+    np.testing.assert_array_equal(load_from_midi(path), pretty_midi_roll(path))
+
+
+def test_midi_upload(tmp_path):
+    path = random_midi(tmp_path / 'song.mid', 0)
+    roll = load_input(io.BytesIO(path.read_bytes()), 'song.MID')
+    assert roll.shape == ROLL_SHAPE and roll.dtype == np.float32
+    np.testing.assert_array_equal(roll, pretty_midi_roll(path))
+
+
+@pytest.mark.parametrize('data', [b'', b'MThd', b'MThd\x00\x00\x00\x06\x00\x01\x00\x01\x01\xe0MTrk\x00\x00\x00\x04\x00\x90\x3c'])
+def test_midi_rejects_broken_files(data):
+    with pytest.raises(InputError):
+        load_input(io.BytesIO(data), 'song.mid')
@@ -0,0 +1,49 @@
+import threading
+import time
+import pytest
+from app.jobs import DONE, FAILED, JobQueue, QueueFull
+
+
+def wait_for(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while job.status not in (DONE, FAILED) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+def test_full_queue_raises():
+    release = threading.Event()
+    jobs = JobQueue(workers=1, max_queued=1).start()
+    running = jobs.submit(lambda job: release.wait())
+    while jobs.depth():
+        time.sleep(0.01)
+    jobs.submit(lambda job: 'queued')
+    with pytest.raises(QueueFull):
+        jobs.submit(lambda job: 'rejected')
+    release.set()
+    assert wait_for(running).status == DONE
+
+
+def test_job_result_and_failure():
+    jobs = JobQueue(workers=1).start()
+
+    def fail(job):
+        raise RuntimeError('no model')
+
+    assert wait_for(jobs.submit(lambda job, x: x * 2, 21)).result == 42
+    failed = wait_for(jobs.submit(fail))
+    assert failed.status == FAILED and failed.error == 'no model'
+
+
+def test_route_answers_429_when_the_queue_is_full(make_app):
+    app = make_app()
+    # never started, so submitted jobs stay queued
+    app.config['job_queue'] = JobQueue(workers=1, max_queued=1)
+    client = app.test_client()
+    first = client.post('/api/jobs', json={'strategy': 'random'})
+    assert first.status_code == 202
+    assert client.get(first.headers['Location']).get_json()['status'] == 'queued'
+    second = client.post('/api/jobs', json={'strategy': 'random'})
+    assert second.status_code == 429
+    assert second.headers['Retry-After'] == '5'
+    assert 'error' in second.get_json()
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import pytest
+from app.model.model_store import LocalDirBackend, ModelStore, ModelUnavailable, model_version
+
+
+class FakeBackend:
+    # one blob whose content and ETag the test changes, counts the downloads
+    def __init__(self, content=b'weights v1', etag='etag-1'):
+        self.content = content
+        self.etag = etag
+        self.md5 = None
+        self.reachable = True
+        self.downloads = 0
+
+    def fingerprint(self, blob_name):
+        if not self.reachable:
+            raise ConnectionError('unreachable')
+        return self.etag, self.md5
+
+    def download(self, blob_name, file):
+        self.downloads += 1
+        file.write(self.content)
+
+
+class CountingDirBackend(LocalDirBackend):
+    # the shipped directory backend, counting the downloads
+    downloads = 0
+
+    def download(self, blob_name, file):
+        self.downloads += 1
+        super().download(blob_name, file)
+
+
+def write_blob(root, name, content, mtime_ns=None):
+    path = root / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def test_unchanged_etag_uses_the_cached_copy(tmp_path):
+    backend = FakeBackend()
+    store = ModelStore(backend, str(tmp_path))
+    path = store.fetch('models/generator.keras')
+    assert read(path) == b'weights v1'
+    assert store.fetch('models/generator.keras') == path
+    assert backend.downloads == 1
+    assert model_version(path) == hashlib.sha256(b'weights v1').hexdigest()
+
+
+def test_new_etag_downloads_and_prunes(tmp_path):
+    backend = FakeBackend()
+    store = ModelStore(backend, str(tmp_path), keep_versions=1)
+    first = store.fetch('generator')
+    backend.content, backend.etag = b'weights v2', 'etag-2'
+    second = store.fetch('generator')
+    assert read(second) == b'weights v2' and backend.downloads == 2
+    assert not os.path.exists(first)
+
+
+def test_corrupt_cache_is_downloaded_again(tmp_path):
+    backend = FakeBackend()
+    store = ModelStore(backend, str(tmp_path))
+    path = store.fetch('generator')
+    with open(path, 'wb') as file:
+        file.write(b'weights v0')  # same size, different content
+    assert read(store.fetch('generator')) == b'weights v1'
+    assert backend.downloads == 2
+
+
+def test_md5_mismatch_keeps_nothing(tmp_path):
+    backend = FakeBackend()
+    backend.md5 = hashlib.md5(b'something else').hexdigest()
+    store = ModelStore(backend, str(tmp_path))
+    with pytest.raises(ModelUnavailable):
+        store.fetch('generator')
+    assert os.listdir(tmp_path / 'generator') == []
+
+
+def test_unreachable_or_offline_falls_back_to_the_cache(tmp_path):
+    backend = FakeBackend()
+    path = ModelStore(backend, str(tmp_path)).fetch('generator')
+    backend.reachable = False
+    assert ModelStore(backend, str(tmp_path)).fetch('generator') == path
+    assert ModelStore(None, str(tmp_path), offline=True).fetch('generator') == path
+    with pytest.raises(ModelUnavailable):
+        ModelStore(None, str(tmp_path), offline=True).fetch('variation')
+
+
+def test_local_dir_etag_hit_and_miss(tmp_path):
+    blobs = tmp_path / 'blobs'
+    write_blob(blobs, 'models/generator.keras', b'weights v1' * 200000, mtime_ns=1_000_000_000)
+    backend = CountingDirBackend(str(blobs))
+    store = ModelStore(backend, str(tmp_path / 'cache'), keep_versions=1)
+    path = store.fetch('models/generator.keras')
+    assert read(path) == b'weights v1' * 200000
+    assert store.fetch('models/generator.keras') == path and backend.downloads == 1
+
+    # same size, so only the new mtime changes the ETag. 2MB runs the copy over more than one chunk
+    write_blob(blobs, 'models/generator.keras', b'weights v2' * 200000, mtime_ns=2_000_000_000)
+    new_path = store.fetch('models/generator.keras')
+    assert new_path != path and not os.path.exists(path)
+    assert read(new_path) == b'weights v2' * 200000 and backend.downloads == 2
+    assert model_version(new_path) == hashlib.sha256(b'weights v2' * 200000).hexdigest()
+
+
+def test_local_dir_checksum_mismatch_downloads_again(tmp_path):
+    blobs = tmp_path / 'blobs'
+    write_blob(blobs, 'generator', b'weights v1')
+    backend = CountingDirBackend(str(blobs))
+    store = ModelStore(backend, str(tmp_path / 'cache'))
+    path = store.fetch('generator')
+    with open(path, 'wb') as file:
+        file.write(b'weights v0')
+    assert store.fetch('generator') == path
+    assert read(path) == b'weights v1' and backend.downloads == 2
+
+
+def test_local_dir_missing_blob_falls_back_to_the_cache(tmp_path):
+    blobs = tmp_path / 'blobs'
+    write_blob(blobs, 'generator', b'weights v1')
+    store = ModelStore(LocalDirBackend(str(blobs)), str(tmp_path / 'cache'))
+    path = store.fetch('generator')
+    os.remove(blobs / 'generator')
+    assert store.fetch('generator') == path
+    with pytest.raises(ModelUnavailable):
+        store.fetch('variation')
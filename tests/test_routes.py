@@ -0,0 +1,76 @@
+import io
+import numpy as np
+import pytest
+from PIL import Image
+
+
+def upload(client, batch_size, name='roll.png'):
+    buffer = io.BytesIO()
+    Image.fromarray((np.random.default_rng(0).random((72, 384)) < 0.05).astype(np.uint8) * 255, 'L').save(buffer, 'PNG')
+    return client.post('/api/generate_variations', content_type='multipart/form-data',
+                       data={'file': (io.BytesIO(buffer.getvalue()), name), 'batch_size': batch_size})
+
+
+@pytest.mark.parametrize('batch_size', ['abc', '-1', '0', '1.5', '101', '100000'])
+def test_variations_reject_bad_batch_size(client, batch_size):
+    response = upload(client, batch_size)
+    assert response.status_code == 400
+    assert 'batch_size' in response.get_json()['error']
+
+
+def test_variations(client):
+    response = upload(client, '3')
+    assert response.status_code == 200
+    assert len(response.get_json()['audio_urls']) == 3
+
+
+def fetch(client, url):
+    response = client.get(url.replace('http://localhost', ''))
+    assert response.status_code == 200
+    return response.data
+
+
+def test_seeded_batch_matches_the_single_route(client):
+    single = client.post('/api/generate_random', json={'seed': 7}).get_json()
+    batch = client.post('/api/generate_batch', json={'seed': 7, 'strategies': ['random']}).get_json()
+    track, = batch['tracks']
+    assert fetch(client, track['audio_url']) == fetch(client, single['audio_url'])
+
+
+@pytest.mark.parametrize('body', [
+    {'note': 'C', 'mode': 'major'},
+    {'note': 'C', 'mode': 'major', 'octave': 'four'},
+    {'note': 'C', 'mode': 'major', 'octave': None},
+    {'note': 'C', 'mode': 'major', 'octave': 40},
+    {'note': 5, 'mode': 'major', 'octave': 4},
+    {'note': 'C', 'mode': ['major'], 'octave': 4},
+    {'note': 'H', 'mode': 'major', 'octave': 4},
+    None,
+    [],
+])
+def test_scale_rejects_bad_input(client, body):
+    for response in (client.post('/api/generate_to_scale', json=body),
+                     client.post('/api/generate_batch', json={'scales': [body]}),
+                     client.post('/api/jobs', json={'strategy': 'scale', **(body or {})}
+                                 if isinstance(body, dict) else {'strategy': 'scale'})):
+        assert response.status_code == 400, response.get_json()
+        assert 'error' in response.get_json()
+
+
+def test_scale(client):
+    response = client.post('/api/generate_to_scale', json={'note': 'F#', 'mode': 'minor', 'octave': 4})
+    assert response.status_code == 200
+    assert 'Fsharp_scale_track' in response.get_json()['audio_url']
+
+
+def test_enharmonic_scales_keep_their_file_names(client):
+    # C#4 and Db4 are the same seeded search, the second one reuses the music but not the first one's file names
+    sharp = client.post('/api/generate_to_scale', json={'note': 'C#', 'mode': 'major', 'octave': 4, 'seed': 3})
+    flat = client.post('/api/generate_to_scale', json={'note': 'Db', 'mode': 'major', 'octave': 4, 'seed': 3})
+    assert 'Csharp_scale_track' in sharp.get_json()['audio_url']
+    assert 'Db_scale_track' in flat.get_json()['audio_url']
+    assert fetch(client, flat.get_json()['audio_url']) == fetch(client, sharp.get_json()['audio_url'])
+
+    again = client.post('/api/generate_to_scale', json={'note': 'Db', 'mode': 'major', 'octave': 4, 'seed': 3})
+    assert 'Db_scale_track' in again.get_json()['audio_url']
+    assert fetch(client, again.get_json()['audio_url']) == fetch(client, sharp.get_json()['audio_url'])
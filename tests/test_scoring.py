@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from app.model.vivygan import CUT_NOTES_PERCENTAGE, ROLL_SHAPE, CandidateBatch, pianoroll_to_notes, score_music_objects
+
+# the vectorized scores of CandidateBatch against muspy's metrics on the same tracks
+
+
+def random_batch(size=12, seed=0):
+    # sparse random rolls, the last one empty so the NaN (muspy on no notes) and 0.0 paths are covered
+    rng = np.random.default_rng(seed)
+    images = (rng.random((size,) + ROLL_SHAPE) < 0.01).astype(np.uint8)
+    images[-1] = 0
+    return CandidateBatch(pianoroll_to_notes(images), size, images=images)
+
+
+def music_objects(candidates):
+    return [candidates.music(index) for index in range(len(candidates))]
+
+
+@pytest.mark.parametrize('cut_notes, scale', [(False, None), (True, None), (False, (62, 'minor'))])
+def test_scores_match_muspy(cut_notes, scale):
+    candidates = random_batch()
+    if cut_notes:
+        candidates = candidates.cut(CUT_NOTES_PERCENTAGE)
+    expected = score_music_objects(music_objects(candidates), scale)
+    np.testing.assert_allclose(candidates.scores_for(scale), expected, rtol=1e-6, atol=1e-9, equal_nan=True)
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from stub_models import StubGenerator
+from app.model.cascade import Cascade
+from app.model.ranking import in_scale_candidates, rank_best_sample, rank_least_dissonant
+from app.model.scoring import DISSONANCE_RATE, PITCH_ENTROPY, PITCH_IN_SCALE_RATE, POLYPHONY, SCALE_CONSISTENCY
+from app.model.vivygan import (ROLL_SHAPE, CandidateBatch, find_best_sample, generate_random, generate_selections,
+                                pianoroll_to_notes, select_candidate)
+
+
+def batch(size, seed=0):
+    images = (np.random.default_rng(seed).random((size,) + ROLL_SHAPE) < 0.01).astype(np.uint8)
+    return CandidateBatch(pianoroll_to_notes(images), size, images=images)
+
+
+@pytest.mark.parametrize('size, index', [(12, 6), (7, 6), (3, 2), (1, 0)])
+def test_arbitrary_pick_stays_in_the_batch(size, index):
+    assert select_candidate(batch(size), choose_arbitrary=True) == index
+
+
+@pytest.mark.parametrize('flags', [{'choose_arbitrary': True}, {}, {'scale': (60, 'major')}])
+def test_empty_batch_raises(flags):
+    with pytest.raises(ValueError):
+        select_candidate(batch(0), **flags)
+
+
+class EmptyPool:
+    def take(self, batch_size, cut_notes=False):
+        return None
+
+
+@pytest.mark.parametrize('flags', [{'choose_arbitrary': True}, {'cut_notes': True}, {'equal_weights': True}])
+def test_selections_fall_back_like_generate_random(flags):
+    # a pool with nothing in it, both then generate one batch and filter it the same way. the cascade drops about half
+    # the stub candidates so a filtered and an unfiltered batch pick differently
+    generator, cascade = StubGenerator(), Cascade([('note_count', 18, None)], verbose=False)
+    expected = generate_random(generator, batch_size=100, pool=EmptyPool(), cascade=cascade,
+                               rng=np.random.default_rng(3), **flags)
+    music, = generate_selections(generator, [flags], batch_size=100, pool=EmptyPool(), cascade=cascade,
+                                 rng=np.random.default_rng(3))
+    assert music.to_pianoroll_representation().tolist() == expected.to_pianoroll_representation().tolist()
+
+
+def baseline_top(values, top_n=100, reverse=False):
+    # the original get_top_scores: a stable sort of the candidates by value, NaN last
+    return sorted(range(len(values)), key=lambda i: (np.isnan(values[i]), -values[i] if reverse else values[i]))[:top_n]
+
+
+def baseline_best(scores, use_scale=False, top_n=100):
+    # find_best_sample before the rewrite, with the 80% -> 70% fallback working as its comments meant it to
+    polyphony = np.where(scores[:, POLYPHONY] >= 1, scores[:, POLYPHONY], 10)
+    tops = [baseline_top(polyphony, top_n), baseline_top(scores[:, SCALE_CONSISTENCY], top_n, reverse=True),
+            baseline_top(scores[:, PITCH_ENTROPY], top_n), baseline_top(scores[:, DISSONANCE_RATE], top_n)]
+    eligible = range(len(scores))
+    if use_scale:
+        top_in_scale = baseline_top(scores[:, PITCH_IN_SCALE_RATE], top_n, reverse=True)
+        eligible = [i for i in top_in_scale if scores[i, PITCH_IN_SCALE_RATE] > 0.80] or \
+                   [i for i in top_in_scale if scores[i, PITCH_IN_SCALE_RATE] > 0.70] or top_in_scale
+    average_ranks = {i: np.mean([top.index(i) if i in top else len(scores) for top in tops])
+                     for i in sorted(eligible)}
+    return min(average_ranks, key=average_ranks.get)
+
+
+def score_matrix(size=150, seed=0, in_scale_high=1.0):
+    # values on a coarse grid so every column has ties, including at the top_n cutoff, and a few all-NaN rows as
+    # muspy gives for empty candidates
+    rng = np.random.default_rng(seed)
+    scores = np.round(rng.random((size, PITCH_IN_SCALE_RATE + 1)) * 10) / 10
+    scores[:, POLYPHONY] *= 3
+    scores[:, PITCH_IN_SCALE_RATE] *= in_scale_high
+    scores[rng.choice(size, 5, replace=False)] = np.nan
+    return scores
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('top_n', [10, 100, 200])
+def test_ranking_matches_the_baseline(seed, top_n):
+    scores = score_matrix(seed=seed)
+    assert rank_best_sample(scores, top_n=top_n) == baseline_best(scores, top_n=top_n)
+    index, top = rank_least_dissonant(scores, top_n=top_n)
+    assert top.tolist() == baseline_top(scores[:, DISSONANCE_RATE], top_n)
+    assert index == top[0]
+
+
+# the best in-scale rate reaches past 80%, only past 70% (the 80% filter is empty) and neither
+@pytest.mark.parametrize('in_scale_high', [1.0, 0.79, 0.7])
+@pytest.mark.parametrize('seed', range(5))
+def test_scale_ranking_matches_the_baseline(seed, in_scale_high):
+    scores = score_matrix(seed=seed, in_scale_high=in_scale_high)
+    for top_n in (10, 100):
+        assert rank_best_sample(scores, use_scale=True, top_n=top_n) == baseline_best(scores, True, top_n)
+    assert find_best_sample(list(range(len(scores))), scale=(60, 'major'), scores=scores)[1] == \
+        baseline_best(scores, True)
+
+
+def test_in_scale_fallback():
+    rates = np.array([0.75, 0.9, 0.72, np.nan, 0.5])
+    assert in_scale_candidates(rates).tolist() == [1]
+    assert in_scale_candidates(np.where(rates > 0.8, 0.6, rates)).tolist() == [0, 2]
+    assert in_scale_candidates(np.array([0.5, 0.6, 0.6])).tolist() == [1, 2, 0]